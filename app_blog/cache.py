@@ -0,0 +1,164 @@
+import json
+import time
+import hashlib
+import threading
+from fastapi_filter.contrib.sqlalchemy import Filter
+from config.cache import get_cache, run_blocking
+from config.settings import settings
+from .models import UserModel
+
+
+class PrincipalCache:
+
+    fields = ("id", "username", "full_name", "email", "is_active")
+
+    def __init__(self):
+        self.cache = get_cache(
+                                backend=settings.PRINCIPAL_CACHE_BACKEND,
+                                prefix="principal",
+                                maxsize=settings.PRINCIPAL_CACHE_SIZE)
+
+
+    async def get(self, subject: str) -> UserModel:
+        if self.cache is None:
+            return None
+        principal = await run_blocking(settings.PRINCIPAL_CACHE_BACKEND, self.cache.get, subject)
+        if principal is None:
+            return None
+        return UserModel(**principal)
+
+
+    async def set(self, subject: str, instance: UserModel) -> None:
+        if self.cache is None:
+            return
+        principal = {field: getattr(instance, field) for field in self.fields}
+        await run_blocking(settings.PRINCIPAL_CACHE_BACKEND, self.cache.set, subject, principal, settings.PRINCIPAL_CACHE_TTL)
+
+
+    async def invalidate(self, subject: str) -> None:
+        if self.cache is not None:
+            await run_blocking(settings.PRINCIPAL_CACHE_BACKEND, self.cache.delete, subject)
+
+
+class TokenCache:
+
+    def __init__(self):
+        self.cache = get_cache(
+                                backend="memory" if settings.TOKEN_CACHE_SIZE else None,
+                                prefix="token",
+                                maxsize=settings.TOKEN_CACHE_SIZE)
+
+
+    def get_key(self, token: str, refresh: bool) -> str:
+        return f"{"refresh" if refresh else "access"}:{hashlib.sha256(token.encode("utf-8")).hexdigest()}"
+
+
+    def get(self, token: str, refresh: bool) -> dict:
+        if self.cache is None:
+            return None
+        return self.cache.get(self.get_key(token, refresh))
+
+
+    def set(self, token: str, refresh: bool, claims: dict) -> None:
+        if self.cache is None:
+            return
+        ttl = min(claims.get("exp", 0) - time.time(), settings.TOKEN_CACHE_TTL)
+        if ttl > 0:
+            self.cache.set(self.get_key(token, refresh), claims, ttl)
+
+
+class PostCache:
+
+    def __init__(self):
+        self.cache = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+
+    def get_backend(self):
+        if self.cache is None:
+            self.cache = get_cache(
+                                    backend=settings.POST_CACHE_BACKEND,
+                                    prefix="post",
+                                    maxsize=settings.POST_CACHE_SIZE)
+        return self.cache
+
+
+    def get_tags(self, filter: Filter) -> list[str]:
+        users = getattr(filter, "users", None)
+        if users is not None and users.username:
+            return [f"user:{users.username}"]
+        return ["all"]
+
+
+    def get_key(self, filter: Filter, cursor: str, limit: int, generations: list[int]) -> str:
+        payload = json.dumps(
+                                {
+                                    "filter": filter.model_dump(mode="json", exclude_none=True),
+                                    "cursor": cursor,
+                                    "limit": min(limit or settings.PAGE_SIZE_DEFAULT, settings.PAGE_SIZE_MAX),
+                                    "generations": generations},
+                                sort_keys=True)
+        return f"find:{hashlib.sha256(payload.encode("utf-8")).hexdigest()}"
+
+
+    def get_blocking(self, filter: Filter, cursor: str, limit: int) -> tuple[str, str]:
+        backend = self.get_backend()
+        if backend is None:
+            return None, None
+        generations = backend.get_counters(self.get_tags(filter))
+        if generations is None:
+            return None, None
+        key = self.get_key(filter, cursor, limit, generations)
+        value = backend.get(key)
+        with self.lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return key, value
+
+
+    def set_blocking(self, key: str, value: str) -> None:
+        if key is not None and self.cache is not None:
+            self.cache.set(key, value, settings.POST_CACHE_TTL)
+
+
+    def invalidate_blocking(self, *usernames: str) -> None:
+        backend = self.get_backend()
+        if backend is None:
+            return
+        backend.incr("all")
+        for username in {username for username in usernames if username is not None}:
+            backend.incr(f"user:{username}")
+        with self.lock:
+            self.invalidations += 1
+
+
+    async def get(self, filter: Filter, cursor: str, limit: int) -> tuple[str, str]:
+        return await run_blocking(settings.POST_CACHE_BACKEND, self.get_blocking, filter, cursor, limit)
+
+
+    async def set(self, key: str, value: str) -> None:
+        if key is not None:
+            await run_blocking(settings.POST_CACHE_BACKEND, self.set_blocking, key, value)
+
+
+    async def invalidate(self, *usernames: str) -> None:
+        await run_blocking(settings.POST_CACHE_BACKEND, self.invalidate_blocking, *usernames)
+
+
+    def status(self) -> dict:
+        with self.lock:
+            return {
+                    "backend": settings.POST_CACHE_BACKEND if self.cache is not None else None,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "invalidations": self.invalidations}
+
+
+principal_cache = PrincipalCache()
+token_cache = TokenCache()
+post_cache = PostCache()
@@ -1,35 +1,42 @@
-from fastapi import APIRouter, status, Depends, Form, Request
+from typing import Optional
+from fastapi import APIRouter, status, Depends, Form, Request, Query, File, UploadFile
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi_filter import FilterDepends
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi_restful.cbv import cbv
-from config.database import get_db
+from config.database import get_db, database
 from .schemas import (UserCreateBase, UserViewBase, UserUpdateBase, UserChangePasswordBase,
-                      TokenAccessRefreshBase, TokenAccessBase,
-                      PostCreateBase, PostUpdateBase, PostViewBase)
+                      TokenAccessRefreshBase, TokenAccessBase, PoolStatusBase, CacheStatusBase, UserStatsBase,
+                      PostCreateBase, PostUpdateBase, PostViewBase, PostPageBase, PostSearchBase, ImportResultBase)
 from .models import UserModel
 from .filters import PostOwnFilter, PostFindFilter
 from .service import AuthenticationService, BlogService
-from .dependency import Dependency
+from .cache import post_cache
+from .dependency import Dependency, RateLimitDependency, oauth2_scheme
 
 
 router_auth = APIRouter()
 router_blog = APIRouter()
+router_media = APIRouter()
 dependency = Dependency()
 
 
 @cbv(router_auth)
 class APIAuthClass:
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 
 
-    @router_auth.post(path="/register/", status_code=status.HTTP_201_CREATED, response_model=UserViewBase)
+    @router_auth.post(
+                        path="/register/",
+                        status_code=status.HTTP_201_CREATED,
+                        response_model=UserViewBase,
+                        dependencies=[Depends(RateLimitDependency("register"))])
     async def register_user(
                             self,
                             data: UserCreateBase):
         service = AuthenticationService(db=self.db)
-        return service.auth_register_user(data=data)
+        return await service.auth_register_user(data=data)
 
 
     @router_auth.put(path="/update/", status_code=status.HTTP_200_OK, response_model=UserViewBase)
@@ -38,7 +45,7 @@ class APIAuthClass:
                             data: UserUpdateBase,
                             cuser: UserModel = Depends(dependency.log_dependency)):
         service = AuthenticationService(db=self.db, cuser=cuser)
-        return service.auth_update_user(data=data)
+        return await service.auth_update_user(data=data)
 
 
     @router_auth.delete(path="/delete/", status_code=status.HTTP_200_OK)
@@ -46,38 +53,75 @@ class APIAuthClass:
                             self,
                             cuser: UserModel = Depends(dependency.log_dependency)):
         service = AuthenticationService(db=self.db, cuser=cuser)
-        return service.auth_delete_user()
+        return await service.auth_delete_user()
 
 
     @router_auth.put(path="/change_password/", status_code=status.HTTP_200_OK)
     async def change_password(
                             self,
                             data: UserChangePasswordBase,
-                            cuser: UserModel = Depends(dependency.log_dependency)):
+                            cuser: UserModel = Depends(dependency.log_dependency),
+                            token: str = Depends(oauth2_scheme)):
         service = AuthenticationService(db=self.db, cuser=cuser)
-        return service.auth_change_password(data=data)
+        return await service.auth_change_password(data=data, token=token)
 
 
-    @router_auth.post(path="/login/", status_code=status.HTTP_200_OK, response_model=TokenAccessRefreshBase)
+    @router_auth.post(
+                        path="/login/",
+                        status_code=status.HTTP_200_OK,
+                        response_model=TokenAccessRefreshBase,
+                        dependencies=[Depends(RateLimitDependency("login"))])
     async def login(
                             self,
                             data: OAuth2PasswordRequestForm = Depends()):
         service = AuthenticationService(db=self.db)
-        return service.auth_login(data=data)
+        return await service.auth_login(data=data)
 
 
     @router_auth.post(path="/refresh/", status_code=status.HTTP_200_OK, response_model=TokenAccessBase)
     async def refresh(
                             self,
-                            cuser: UserModel = Depends(dependency.refresh_token_dependency)):
+                            cuser: UserModel = Depends(dependency.refresh_token_dependency),
+                            token: str = Depends(oauth2_scheme)):
+        service = AuthenticationService(db=self.db, cuser=cuser)
+        return await service.auth_refresh(token=token)
+
+
+    @router_auth.post(path="/logout/", status_code=status.HTTP_200_OK)
+    async def logout(
+                            self,
+                            cuser: UserModel = Depends(dependency.log_dependency),
+                            token: str = Depends(oauth2_scheme)):
         service = AuthenticationService(db=self.db, cuser=cuser)
-        return service.auth_refresh()
+        return await service.auth_logout(token=token)
+
+
+    @router_auth.get(path="/me/stats/", status_code=status.HTTP_200_OK, response_model=UserStatsBase)
+    async def user_stats(
+                            self,
+                            cuser: UserModel = Depends(dependency.log_dependency)):
+        service = AuthenticationService(db=self.db, cuser=cuser)
+        return await service.auth_user_stats()
+
+
+    @router_auth.get(path="/pool_status/", status_code=status.HTTP_200_OK, response_model=PoolStatusBase)
+    async def pool_status(
+                            self,
+                            cuser: UserModel = Depends(dependency.log_dependency)):
+        return database.pool_status()
+
+
+    @router_auth.get(path="/cache_status/", status_code=status.HTTP_200_OK, response_model=CacheStatusBase)
+    async def cache_status(
+                            self,
+                            cuser: UserModel = Depends(dependency.log_dependency)):
+        return post_cache.status()
 
 
 @cbv(router_blog)
 class APIBlogClass:
 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 
 
     @router_blog.post(path="/create_post/", status_code=status.HTTP_201_CREATED, response_model=PostViewBase)
@@ -90,6 +134,16 @@ class APIBlogClass:
         return await service.blog_create_post(data=data)
 
 
+    @router_blog.post(path="/import/", status_code=status.HTTP_200_OK, response_model=ImportResultBase)
+    async def import_posts(
+                            self,
+                            file: UploadFile = File(),
+                            format: Optional[str] = Query(default=None, pattern="^(ndjson|csv)$"),
+                            cuser: UserModel = Depends(dependency.log_dependency)):
+        service = BlogService(db=self.db, cuser=cuser)
+        return await service.blog_import_posts(file=file, format=format)
+
+
     @router_blog.put(path="/update_post/{id}/", status_code=status.HTTP_200_OK, response_model=PostViewBase)
     async def update_post(
                             self,
@@ -97,7 +151,7 @@ class APIBlogClass:
                             data: PostUpdateBase,
                             cuser: UserModel = Depends(dependency.log_dependency)):
         service = BlogService(db=self.db, cuser=cuser)
-        return service.blog_update_post(id=id, data=data)
+        return await service.blog_update_post(id=id, data=data)
 
 
     @router_blog.delete(path="/delete_post/{id}/", status_code=status.HTTP_200_OK)
@@ -106,31 +160,72 @@ class APIBlogClass:
                             id: int,
                             cuser: UserModel = Depends(dependency.log_dependency)):
         service = BlogService(db=self.db, cuser=cuser)
-        return service.blog_delete_post(id=id)
+        return await service.blog_delete_post(id=id)
 
 
-    @router_blog.get(path="/show_my_posts/", status_code=status.HTTP_200_OK, response_model=list[PostViewBase])
+    @router_blog.get(path="/show_my_posts/", status_code=status.HTTP_200_OK, response_model=PostPageBase)
     async def show_my_posts(
                             self,
                             cuser: UserModel = Depends(dependency.log_dependency),
-                            filter: PostOwnFilter = FilterDepends(PostOwnFilter)):
+                            filter: PostOwnFilter = FilterDepends(PostOwnFilter),
+                            cursor: Optional[str] = None,
+                            limit: Optional[int] = Query(default=None, ge=1)):
         service = BlogService(db=self.db, cuser=cuser)
-        return service.blog_show_my_posts(filter=filter)
+        return await service.blog_show_my_posts(filter=filter, cursor=cursor, limit=limit)
 
 
-    @router_blog.get(path="/find_post/", status_code=status.HTTP_200_OK, response_model=list[PostViewBase])
+    @router_blog.get(path="/find_post/", status_code=status.HTTP_200_OK, response_model=PostPageBase)
     async def find_post(
                             self,
                             cuser: UserModel = Depends(dependency.log_dependency),
-                            filter: PostFindFilter = FilterDepends(PostFindFilter)):
+                            filter: PostFindFilter = FilterDepends(PostFindFilter),
+                            cursor: Optional[str] = None,
+                            limit: Optional[int] = Query(default=None, ge=1)):
         service = BlogService(db=self.db, cuser=cuser)
-        return service.blog_find_post(filter=filter)
+        return await service.blog_find_post(filter=filter, cursor=cursor, limit=limit)
+
+
+    @router_blog.get(path="/export/", status_code=status.HTTP_200_OK)
+    async def export_posts(
+                            self,
+                            cuser: UserModel = Depends(dependency.log_dependency),
+                            filter: PostFindFilter = FilterDepends(PostFindFilter),
+                            format: str = Query(default="ndjson", pattern="^(ndjson|csv)$")):
+        service = BlogService(db=self.db, cuser=cuser)
+        return await service.blog_export_posts(filter=filter, format=format)
+
+
+    @router_blog.get(path="/search/", status_code=status.HTTP_200_OK, response_model=list[PostSearchBase])
+    async def search_post(
+                            self,
+                            q: str = Query(min_length=1),
+                            limit: Optional[int] = Query(default=None, ge=1),
+                            cuser: UserModel = Depends(dependency.log_dependency)):
+        service = BlogService(db=self.db, cuser=cuser)
+        return await service.blog_search_post(term=q, limit=limit)
 
 
     @router_blog.get(path="/download_file/{file_name}/", status_code=status.HTTP_200_OK)
     async def download_file(
                             self,
                             file_name: str,
-                            cuser: UserModel = Depends(dependency.log_dependency)):
-        service = BlogService(db=self.db, cuser=cuser)
-        return service.blog_download_file(file_name=file_name)
+                            cuser: UserModel = Depends(dependency.log_dependency),
+                            request: Request = None):
+        service = BlogService(db=self.db, cuser=cuser, request=request)
+        return await service.blog_download_file(file_name=file_name)
+
+
+@cbv(router_media)
+class APIMediaClass:
+
+    db: AsyncSession = Depends(get_db)
+
+
+    @router_media.get(path="/{file_path:path}", status_code=status.HTTP_200_OK)
+    async def media_file(
+                            self,
+                            file_path: str,
+                            cuser: UserModel = Depends(dependency.log_dependency),
+                            request: Request = None):
+        service = BlogService(db=self.db, cuser=cuser, request=request)
+        return await service.blog_media_file(file_path=file_path)
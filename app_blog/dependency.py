@@ -1,43 +1,109 @@
-from fastapi import Depends
+import hashlib
+import ipaddress
+import anyio
+from fastapi import Depends, Request
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import TypeVar
 from config.database import Base, get_db
+from config.ratelimit import SlidingWindowLimiter
+from config.settings import settings
 from . import exceptions
 from .models import UserModel
+from .cache import principal_cache
 from .repository import AuthenticationRepository
 
 
 Model = TypeVar("Model", bound=Base)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/admin/login/")
+rate_limiter = SlidingWindowLimiter(prefix="ratelimit", retry=settings.RATE_LIMIT_RETRY)
+
+
+def is_trusted_proxy(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address.strip())
+    except ValueError:
+        return False
+    return any(ip in ipaddress.ip_network(network, strict=False) for network in settings.RATE_LIMIT_TRUSTED_PROXIES)
+
+
+def get_client_ip(request: Request) -> str:
+    address = request.client.host if request.client else None
+    if address is None or not is_trusted_proxy(address):
+        return address
+    forwarded = [item.strip() for item in request.headers.get("x-forwarded-for", "").split(",") if item.strip()]
+    for item in reversed(forwarded):
+        if not is_trusted_proxy(item):
+            return item
+    return forwarded[0] if forwarded else address
 
 
 class Dependency:
 
 
+    async def get_principal(self, auth: AuthenticationRepository, username: str) -> UserModel:
+        instance = await principal_cache.get(username)
+        if instance is not None:
+            return instance
+        instance = await auth.get_user_by_username(username)
+        if instance is None:
+            raise exceptions.CredentialsException
+        if instance.is_active == False:
+            raise exceptions.UserInActiveException
+        await principal_cache.set(username, instance)
+        return instance
+
+
     async def log_dependency(
                                         self,
                                         token: str = Depends(oauth2_scheme),
-                                        db: Session = Depends(get_db)):
-        self.auth = AuthenticationRepository(db, UserModel)
-        username = self.auth.verify_token(token=token, refresh=False)
+                                        db: AsyncSession = Depends(get_db)):
+        auth = AuthenticationRepository(db, UserModel)
+        username = await auth.verify_token(token=token, refresh=False)
         if username is None:
             raise exceptions.CredentialsException
-        instance = self.auth.get_user_by_username(username)
-        if self.auth.get_active_status(instance.username) == False:
-            raise exceptions.UserInActiveException
-        return instance
+        return await self.get_principal(auth, username)
 
 
     async def refresh_token_dependency(
                                         self,
                                         token: str = Depends(oauth2_scheme),
-                                        db: Session = Depends(get_db)):
-        self.auth = AuthenticationRepository(db, UserModel)
-        username = self.auth.verify_token(token=token, refresh=True)
+                                        db: AsyncSession = Depends(get_db)):
+        auth = AuthenticationRepository(db, UserModel)
+        username = await auth.verify_token(token=token, refresh=True)
         if username is None:
             raise exceptions.CredentialsException
-        instance = self.auth.get_user_by_username(username=username)
-        if self.auth.get_active_status(instance.username) == False:
-            raise exceptions.UserInActiveException
-        return instance
+        return await self.get_principal(auth, username)
+
+
+class RateLimitDependency:
+
+    def __init__(self, route: str):
+        self.route = route
+
+
+    async def get_username(self, request: Request) -> str:
+        try:
+            if request.headers.get("content-type", "").startswith("application/json"):
+                body = await request.json()
+                username = body.get("username") if isinstance(body, dict) else None
+            else:
+                username = (await request.form()).get("username")
+        except ValueError:
+            return None
+        return username if isinstance(username, str) and username else None
+
+
+    async def __call__(self, request: Request) -> None:
+        if settings.RATE_LIMIT_BACKEND != "redis":
+            return
+        limits = settings.RATE_LIMITS.get(self.route, {})
+        subjects = {"ip": get_client_ip(request)}
+        if "username" in limits:
+            subjects["username"] = await self.get_username(request)
+        keys = {
+                    f"{self.route}:{kind}:{hashlib.sha256(subject.encode("utf-8")).hexdigest()}": limits[kind]
+                    for kind, subject in subjects.items() if kind in limits and subject is not None}
+        retry_after = await anyio.to_thread.run_sync(rate_limiter.hit, keys)
+        if retry_after > 0:
+            raise exceptions.TooManyRequestsException(retry_after)
@@ -0,0 +1,98 @@
+import os
+import uuid
+import asyncio
+import logging
+from PIL import Image, ImageOps
+from sqlalchemy import select, update
+from config.database import DatabaseSessionClass
+from config.settings import settings
+from config.workers import derivative_workers
+from .cache import post_cache
+from .models import ImageModel, PostModel, UserModel, post_image
+from .repository import MediaRepository, get_media_path
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+def remove_partial_file(partial_path: str) -> None:
+    try:
+        os.remove(partial_path)
+    except FileNotFoundError:
+        pass
+
+
+def generate_derivatives_blocking(file_name: str) -> bool:
+    names = ImageModel.get_derivative_names(file_name)
+    if all(os.path.exists(get_media_path(name)) for name in names.values()):
+        return True
+    try:
+        with Image.open(get_media_path(file_name)) as source:
+            image_format = source.format
+            image = ImageOps.exif_transpose(source)
+            for size_name, size in settings.DERIVATIVE_SIZES.items():
+                resized = image.copy()
+                resized.thumbnail((size, size))
+                for name, derivative_format in ((size_name, image_format), (f"{size_name}_webp", "WEBP")):
+                    derivative_path = get_media_path(names[name])
+                    partial_path = f"{derivative_path}.{uuid.uuid4().hex}.part"
+                    try:
+                        resized.save(partial_path, format=derivative_format, quality=settings.DERIVATIVE_QUALITY)
+                        os.replace(partial_path, derivative_path)
+                    finally:
+                        remove_partial_file(partial_path)
+    except Exception as exception:
+        logger.warning(f"Derivatives of {file_name} were not generated: {exception}")
+        return False
+    return True
+
+
+class DerivativePipeline:
+
+    def __init__(self):
+        self.tasks = set()
+
+
+    def schedule(self, file_names: list[str]) -> None:
+        task = asyncio.get_running_loop().create_task(self.process(file_names))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+
+    async def process(self, file_names: list[str]) -> None:
+        ready = []
+        for file_name in file_names:
+            try:
+                if await derivative_workers.run(generate_derivatives_blocking, file_name, wait=True):
+                    ready.append(file_name)
+            except Exception as exception:
+                logger.warning(f"Derivatives of {file_name} were not generated: {exception}")
+        try:
+            if ready:
+                async with DatabaseSessionClass() as db:
+                    registered = await db.scalars(
+                                        update(ImageModel)
+                                        .where(ImageModel.filename.in_(ready))
+                                        .values(derivatives_ready=True)
+                                        .returning(ImageModel.filename))
+                    registered = set(registered.all())
+                    owners = await db.scalars(
+                                        select(UserModel.username)
+                                        .join(PostModel, PostModel.created_by == UserModel.id)
+                                        .join(post_image, post_image.c.post_id == PostModel.id)
+                                        .join(ImageModel, ImageModel.id == post_image.c.image_id)
+                                        .where(ImageModel.filename.in_(registered))
+                                        .distinct())
+                    owners = owners.all()
+                await post_cache.invalidate(*owners)
+                await MediaRepository().remove_derivatives(set(ready) - registered)
+        except Exception as exception:
+            logger.error(f"Derivatives of {ready} were not registered: {exception}")
+
+
+    async def drain(self) -> None:
+        while self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+derivatives = DerivativePipeline()
@@ -90,3 +90,11 @@ class TooLargeFileException(HTTPException):
         super().__init__(
                         status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
                         detail="File is too large.")
+
+
+class TooManyRequestsException(HTTPException):
+    def __init__(self, retry_after: int = 1):
+        super().__init__(
+                        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                        detail="Too many requests, try again later.",
+                        headers={"Retry-After": str(retry_after)})
@@ -0,0 +1,59 @@
+import io
+import csv
+import json
+import anyio
+from typing import AsyncIterator
+from pydantic import TypeAdapter
+from config.database import DatabaseSessionClass
+from config.settings import settings
+from .schemas import PostViewBase, UserBase
+
+
+EXPORT_FORMATS = {
+                    "ndjson": "application/x-ndjson",
+                    "csv": "text/csv"}
+EXPORT_CSV_FIELDS = ("id", "title", "content", "published", "created_at", "username", "email", "images")
+export_adapter = TypeAdapter(list[PostViewBase])
+
+
+def validate_posts(posts: list) -> list[PostViewBase]:
+    users = {}
+    for post in posts:
+        if post.created_by not in users:
+            users[post.created_by] = UserBase.model_validate(post.users, from_attributes=True)
+    return export_adapter.validate_python(
+                                            [
+                                                {
+                                                    **{field: getattr(post, field) for field in PostViewBase.model_fields},
+                                                    "users": users[post.created_by]}
+                                                for post in posts],
+                                            from_attributes=True)
+
+
+def export_ndjson(posts: list) -> bytes:
+    items = validate_posts(posts)
+    return b"".join(item.model_dump_json().encode("utf-8") + b"\n" for item in items)
+
+
+def export_csv(posts: list, header: bool = False) -> bytes:
+    stream = io.StringIO()
+    writer = csv.writer(stream)
+    if header:
+        writer.writerow(EXPORT_CSV_FIELDS)
+    for item in export_adapter.dump_python(validate_posts(posts), mode="json"):
+        writer.writerow([
+                            *(item[field] for field in EXPORT_CSV_FIELDS[:5]),
+                            item["users"]["username"],
+                            item["users"]["email"],
+                            json.dumps(item["images"], separators=(",", ":"))])
+    return stream.getvalue().encode("utf-8")
+
+
+async def stream_export(query, format: str) -> AsyncIterator[bytes]:
+    if format == "csv":
+        yield export_csv([], header=True)
+    serialize = export_csv if format == "csv" else export_ndjson
+    async with DatabaseSessionClass() as db:
+        result = await db.stream_scalars(query.execution_options(yield_per=settings.EXPORT_BATCH_SIZE))
+        async for posts in result.partitions():
+            yield await anyio.to_thread.run_sync(serialize, posts)
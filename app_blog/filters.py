@@ -2,10 +2,12 @@ from typing import Optional
 from fastapi_filter import FilterDepends
 from fastapi_filter.contrib.sqlalchemy import Filter
 from .models import UserModel, PostModel
+from .repository import get_search_query
 
 
 class UserFilter(Filter):
     username: Optional[str] = None
+    username__like: Optional[str] = None
 
     class Constants(Filter.Constants):
         model = UserModel
@@ -22,6 +24,11 @@ class PostOwnFilter(Filter):
         model = PostModel
         search_model_fields = ["content"]
 
+    def filter(self, query):
+        if self.search:
+            query = query.filter(PostModel.search_vector.bool_op("@@")(get_search_query(self.search)))
+        return super(PostOwnFilter, self.model_copy(update={"search": None})).filter(query)
+
 
 class PostFindFilter(Filter):
 
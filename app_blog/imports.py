@@ -0,0 +1,100 @@
+import io
+import os
+import csv
+from itertools import islice
+from typing import Iterator
+from pydantic import TypeAdapter, ValidationError
+from . import exceptions
+from .schemas import PostImportBase
+
+
+IMPORT_FORMATS = {
+                    ".ndjson": "ndjson",
+                    ".jsonl": "ndjson",
+                    ".csv": "csv",
+                    "application/x-ndjson": "ndjson",
+                    "application/jsonl": "ndjson",
+                    "text/csv": "csv"}
+REQUIRED_FIELDS = {name for name, field in PostImportBase.model_fields.items() if field.is_required()}
+import_adapter = TypeAdapter(list[PostImportBase])
+
+
+def get_import_format(file_name: str, content_type: str, format: str = None) -> str:
+    format = format or IMPORT_FORMATS.get(os.path.splitext(file_name or "")[1].lower()) or IMPORT_FORMATS.get(content_type)
+    if format is None:
+        raise exceptions.BadRequestException("Import format should be ndjson or csv.")
+    return format
+
+
+def read_ndjson(stream: io.TextIOBase) -> Iterator[tuple[int, str]]:
+    for line, text in enumerate(stream, start=1):
+        if text.strip():
+            yield line, text
+
+
+def read_csv(stream: io.TextIOBase) -> Iterator[tuple[int, dict]]:
+    reader = csv.DictReader(stream)
+    try:
+        for row in reader:
+            yield reader.line_num, {field: value for field, value in row.items() if value or field in REQUIRED_FIELDS}
+    except csv.Error as error:
+        raise exceptions.BadRequestException(f"Invalid CSV at line {reader.line_num}: {error}.")
+
+
+def format_errors(details: list[dict]) -> str:
+    messages = []
+    for detail in details:
+        field = ".".join(str(part) for part in detail["loc"] if part is not None)
+        if detail["type"] == "json_invalid":
+            messages.append(f"Invalid JSON: {detail["ctx"]["error"]}.")
+        elif detail["type"] == "extra_forbidden" and not field:
+            messages.append("Too many fields.")
+        else:
+            messages.append(f"{field}: {detail["msg"]}" if field else detail["msg"])
+    return "; ".join(messages)
+
+
+def validate_row(row: str | dict) -> PostImportBase:
+    if isinstance(row, str):
+        return PostImportBase.model_validate_json(row)
+    if None in row:
+        raise ValidationError.from_exception_data("PostImportBase", [{"type": "extra_forbidden", "loc": (), "input": row[None]}])
+    return PostImportBase.model_validate(row)
+
+
+def validate_batch(rows: list[tuple[int, str | dict]]) -> list[PostImportBase]:
+    if isinstance(rows[0][1], str):
+        return [PostImportBase.model_validate_json(row) for _, row in rows]
+    return import_adapter.validate_python([row for _, row in rows])
+
+
+def validate_rows(rows: list[tuple[int, str | dict]]) -> tuple[list[tuple], list[tuple[int, str]]]:
+    try:
+        items = validate_batch(rows)
+    except ValidationError:
+        items = None
+    errors = []
+    if items is None:
+        items, valid = [], []
+        for line, row in rows:
+            try:
+                items.append(validate_row(row))
+                valid.append((line, row))
+            except ValidationError as error:
+                errors.append((line, format_errors(error.errors())))
+        rows = valid
+    records = [(line, item.title, item.content, item.published, item.created_at) for (line, _), item in zip(rows, items)]
+    return records, errors
+
+
+def read_batches(file, format: str, batch_size: int) -> Iterator[tuple[int, list[tuple], list[tuple[int, str]]]]:
+    stream = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    reader = read_csv(stream) if format == "csv" else read_ndjson(stream)
+    try:
+        while rows := list(islice(reader, batch_size)):
+            records, errors = validate_rows(rows)
+            yield len(rows), records, errors
+    except UnicodeDecodeError:
+        raise exceptions.BadRequestException("Import file should be UTF-8 encoded.")
+    finally:
+        stream.detach()
@@ -1,7 +1,16 @@
+import os
 from datetime import datetime
-from sqlalchemy import ForeignKey, Integer, String, Boolean, TIMESTAMP, text, Index
+from sqlalchemy import ForeignKey, Integer, BigInteger, String, Boolean, TIMESTAMP, text, Index, Computed, DDL, event, Table, Column, MetaData
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from config.database import Base
+from config.settings import settings
+
+
+event.listen(
+                Base.metadata,
+                "before_create",
+                DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
 
 
 class UserModel(Base):
@@ -9,7 +18,8 @@ class UserModel(Base):
     __tablename__ = "user"
     __table_args__ = (
                         Index("idx_user_id", "id", postgresql_using="btree"),
-                        Index("idx_user_username", "username", postgresql_using="btree"))
+                        Index("idx_user_username", "username", postgresql_using="btree"),
+                        Index("idx_user_username_trgm", "username", postgresql_using="gin", postgresql_ops={"username": "gin_trgm_ops"}))
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     username: Mapped[str] = mapped_column(String(50), unique=True, nullable=False)
@@ -17,7 +27,10 @@ class UserModel(Base):
     email: Mapped[str] = mapped_column(String(50), unique=True, nullable=False)
     hashed_password: Mapped[str] = mapped_column(String(250), nullable=False)
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
-    posts: Mapped[list["PostModel"]] = relationship("PostModel", back_populates="users")
+    post_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    published_post_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    image_bytes: Mapped[int] = mapped_column(BigInteger, nullable=False, server_default="0")
+    posts: Mapped[list["PostModel"]] = relationship("PostModel", back_populates="users", passive_deletes=True)
 
 
 class PostModel(Base):
@@ -25,7 +38,11 @@ class PostModel(Base):
     __tablename__ = "post"
     __table_args__ = (
                         Index("idx_post_id", "id", postgresql_using="btree"),
-                        Index("idx_post_title", "title", postgresql_using="btree"))
+                        Index("idx_post_title", "title", postgresql_using="btree"),
+                        Index("idx_post_title_trgm", "title", postgresql_using="gin", postgresql_ops={"title": "gin_trgm_ops"}),
+                        Index("idx_post_created_at_id", "created_at", "id", postgresql_using="btree"),
+                        Index("idx_post_created_by_created_at_id", "created_by", "created_at", "id", postgresql_using="btree"),
+                        Index("idx_post_search_vector", "search_vector", postgresql_using="gin"))
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     title: Mapped[str] = mapped_column(String, unique=True, nullable=False)
@@ -33,8 +50,35 @@ class PostModel(Base):
     published: Mapped[bool] = mapped_column(Boolean, server_default="False")
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), server_default=text("now()"))
     created_by: Mapped[int] = mapped_column(Integer, ForeignKey("user.id"))
+    search_vector: Mapped[str] = mapped_column(
+                                                TSVECTOR,
+                                                Computed(
+                                                    f"setweight(to_tsvector('{settings.SEARCH_LANGUAGE}', coalesce(title, '')), 'A') || "
+                                                    f"setweight(to_tsvector('{settings.SEARCH_LANGUAGE}', coalesce(content, '')), 'B')",
+                                                    persisted=True),
+                                                deferred=True)
     users: Mapped["UserModel"] = relationship("UserModel", back_populates="posts")
-    images: Mapped[list["ImageModel"]] = relationship("ImageModel", back_populates="posts")
+    images: Mapped[list["ImageModel"]] = relationship("ImageModel", secondary="post_image", back_populates="posts", passive_deletes=True)
+
+
+post_import = Table(
+                    "post_import",
+                    MetaData(),
+                    Column("line", Integer, nullable=False),
+                    Column("title", String, nullable=False),
+                    Column("content", String, nullable=False),
+                    Column("published", Boolean, nullable=False),
+                    Column("created_at", TIMESTAMP(timezone=True)),
+                    prefixes=["TEMPORARY"],
+                    postgresql_on_commit="DROP")
+
+
+post_image = Table(
+                    "post_image",
+                    Base.metadata,
+                    Column("post_id", Integer, ForeignKey("post.id", ondelete="CASCADE"), primary_key=True),
+                    Column("image_id", Integer, ForeignKey("image.id"), primary_key=True),
+                    Index("idx_post_image_image_id", "image_id", postgresql_using="btree"))
 
 
 class ImageModel(Base):
@@ -42,12 +86,30 @@ class ImageModel(Base):
     __tablename__ = "image"
     __table_args__ = (
                         Index("idx_image_id", "id", postgresql_using="btree"),
-                        Index("idx_image_post_id", "post_id", postgresql_using="btree"))
+                        Index("idx_image_sha256", "sha256", postgresql_using="btree"))
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
-    location: Mapped[str] = mapped_column(String, unique=True, nullable=False)
-    filename: Mapped[str] = mapped_column(String, nullable=False)
+    location: Mapped[str] = mapped_column(String, nullable=False)
+    filename: Mapped[str] = mapped_column(String, unique=True, nullable=False)
     size: Mapped[int] = mapped_column(Integer, nullable=False)
     content_type: Mapped[str] = mapped_column(String, nullable=False)
-    post_id: Mapped[int] = mapped_column(Integer, ForeignKey("post.id"))
-    posts: Mapped["PostModel"] = relationship("PostModel", back_populates="images")
+    sha256: Mapped[str] = mapped_column(String(64), nullable=False)
+    refcount: Mapped[int] = mapped_column(Integer, nullable=False, server_default="0")
+    derivatives_ready: Mapped[bool] = mapped_column(Boolean, server_default="False")
+    posts: Mapped[list["PostModel"]] = relationship("PostModel", secondary="post_image", back_populates="images")
+
+    @staticmethod
+    def get_derivative_names(file_name: str) -> dict[str, str]:
+        stem, extension = os.path.splitext(file_name)
+        names = {}
+        for size in settings.DERIVATIVE_SIZES:
+            names[size] = f"{stem}_{size}{extension}"
+            names[f"{size}_webp"] = f"{stem}_{size}.webp"
+        return names
+
+    @property
+    def derivatives(self) -> dict[str, str]:
+        if not self.derivatives_ready:
+            return {}
+        base_url = self.location.rsplit("/", 1)[0]
+        return {name: f"{base_url}/{file_name}" for name, file_name in self.get_derivative_names(self.filename).items()}
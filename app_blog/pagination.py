@@ -0,0 +1,111 @@
+import json
+import base64
+import binascii
+from datetime import datetime
+from sqlalchemy import and_, or_, inspect, literal, tuple_
+from config.database import Base
+from config.settings import settings
+from typing import TypeVar
+from . import exceptions
+
+
+Model = TypeVar("Model", bound=Base)
+
+
+class KeysetPagination:
+
+    tie_breakers = ["-created_at", "-id"]
+
+    def __init__(self, model: Model, ordering: list[str] = None, cursor: str = None, limit: int = None):
+        self.model = model
+        self.limit = min(limit or settings.PAGE_SIZE_DEFAULT, settings.PAGE_SIZE_MAX)
+        self.keys = self.get_keys(ordering or [])
+        self.values = self.decode(cursor) if cursor else None
+
+
+    @property
+    def signature(self) -> list[str]:
+        return [f"-{name}" if descending else name for name, descending in self.keys]
+
+
+    def get_keys(self, ordering: list[str]) -> list[tuple[str, bool]]:
+        columns = inspect(self.model).columns
+        keys = []
+        for field in ordering + self.tie_breakers:
+            name = field.replace("-", "").replace("+", "")
+            if name not in columns:
+                raise exceptions.BadRequestException(f"Posts cannot be ordered by {name}.")
+            if name in (key for key, _ in keys):
+                continue
+            keys.append((name, field.startswith("-")))
+            if columns[name].primary_key:
+                break
+        return keys
+
+
+    def encode(self, instance: Model) -> str:
+        values = []
+        for name, _ in self.keys:
+            value = getattr(instance, name)
+            values.append(value.isoformat() if isinstance(value, datetime) else value)
+        payload = json.dumps({"keys": self.signature, "values": values}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii")
+
+
+    def decode(self, cursor: str) -> list:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            if payload["keys"] != self.signature or len(payload["values"]) != len(self.keys):
+                raise ValueError
+            columns = inspect(self.model).columns
+            values = []
+            for (name, _), value in zip(self.keys, payload["values"]):
+                python_type = columns[name].type.python_type
+                if value is None:
+                    if not columns[name].nullable:
+                        raise ValueError
+                elif python_type is datetime:
+                    value = datetime.fromisoformat(value)
+                elif type(value) is not python_type:
+                    raise TypeError
+                values.append(value)
+            return values
+        except (ValueError, KeyError, TypeError, UnicodeError, binascii.Error, NotImplementedError):
+            raise exceptions.BadRequestException("Invalid cursor.")
+
+
+    def predicate(self):
+        columns = [getattr(self.model, name) for name, _ in self.keys]
+        values = [literal(value, column.type) for column, value in zip(columns, self.values)]
+        directions = {descending for _, descending in self.keys}
+        if len(directions) == 1:
+            if directions.pop():
+                return tuple_(*columns) < tuple_(*values)
+            return tuple_(*columns) > tuple_(*values)
+        clauses = []
+        for index, (_, descending) in enumerate(self.keys):
+            equal = [column == value for column, value in zip(columns[:index], values[:index])]
+            compare = columns[index] < values[index] if descending else columns[index] > values[index]
+            clauses.append(and_(*equal, compare))
+        return or_(*clauses)
+
+
+    def order(self, query):
+        order = []
+        for name, descending in self.keys:
+            column = getattr(self.model, name)
+            order.append(column.desc() if descending else column.asc())
+        return query.order_by(*order)
+
+
+    def apply(self, query):
+        if self.values is not None:
+            query = query.filter(self.predicate())
+        return self.order(query).limit(self.limit + 1)
+
+
+    def page(self, rows: list) -> tuple[list, str]:
+        if len(rows) > self.limit:
+            rows = rows[:self.limit]
+            return rows, self.encode(rows[-1])
+        return rows, None
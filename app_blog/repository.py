@@ -1,75 +1,175 @@
 import os
+import anyio
 import bcrypt
+import hashlib
+import logging
 import uuid
+from functools import lru_cache
 from pydantic import BaseModel
-from fastapi import UploadFile
+from fastapi import HTTPException, UploadFile
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.requests import Request
 from fastapi_filter.contrib.sqlalchemy import Filter
-from sqlalchemy import exists, select
-from sqlalchemy.orm import Session
+from sqlalchemy import exists, select, inspect, func, cast, literal, delete, update, or_, String
+from sqlalchemy.dialects.postgresql import ARRAY, REGCONFIG, insert
+from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timedelta, timezone
 from config.settings import settings
-from config.database import Base
+from config.database import Base, DatabaseSessionClass
+from config.workers import workers, WorkerPoolSaturatedError
 from jose import JWTError, jwt
-from typing import IO, TypeVar, Annotated
+from typing import TypeVar, Annotated, get_args
 from . import exceptions
-from .models import ImageModel
+from .models import UserModel, PostModel, ImageModel, post_image, post_import
 from .schemas import ImageBase
+from .cache import token_cache
+from .revocation import token_revocation
+
+
+logger = logging.getLogger("uvicorn.error")
+FILE_EXTENSION_ALIASES = {"jpeg": "jpg", "tif": "tiff"}
 
 
 Model = TypeVar("Model", bound=Base)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/admin/login/")
 
 
+def get_schema_model(annotation) -> type[BaseModel]:
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return annotation
+    for argument in get_args(annotation):
+        schema = get_schema_model(argument)
+        if schema is not None:
+            return schema
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_load_options(model: Model, schema: type[BaseModel]) -> tuple:
+    options = []
+    relationships = inspect(model).relationships
+    for name, field in schema.model_fields.items():
+        if name not in relationships:
+            continue
+        relationship = relationships[name]
+        attribute = getattr(model, name)
+        loader = selectinload(attribute) if relationship.uselist else joinedload(attribute)
+        nested_schema = get_schema_model(field.annotation)
+        if nested_schema is not None:
+            nested_options = get_load_options(relationship.mapper.class_, nested_schema)
+            if nested_options:
+                loader = loader.options(*nested_options)
+        options.append(loader)
+    return tuple(options)
+
+
+def get_search_query(term: str):
+    return func.websearch_to_tsquery(cast(literal(settings.SEARCH_LANGUAGE), REGCONFIG), term)
+
+
+def get_media_shards(file_name: str) -> list[str]:
+    return [file_name[index * 2:index * 2 + 2] for index in range(settings.MEDIA_SHARD_DEPTH)]
+
+
+def get_file_extension(file_name: str) -> str:
+    extension = file_name.split(".").pop().lower()
+    return FILE_EXTENSION_ALIASES.get(extension, extension)
+
+
+def get_media_path(file_name: str) -> str:
+    return os.path.join(settings.MEDIA_ROOT, *get_media_shards(file_name), file_name)
+
+
+def get_media_url(request: Request, file_name: str) -> str:
+    return f"{str(request.base_url)[:-1]}{settings.MEDIA_URL}/{"/".join([*get_media_shards(file_name), file_name])}"
+
+
+def get_post_counters(record: PostModel) -> dict:
+    return {
+            "post_count": 1,
+            "published_post_count": 1 if record.published else 0}
+
+
+async def update_user_counters(db: AsyncSession, user_id, counters: dict) -> None:
+    counters = {name: value for name, value in counters.items() if value}
+    if counters:
+        await db.execute(
+                            update(UserModel)
+                            .where(UserModel.id == user_id)
+                            .values({name: getattr(UserModel, name) + value for name, value in counters.items()}))
+
+
+def hash_password_blocking(password: str, rounds: int) -> str:
+    pwd = password.encode("utf-8")
+    salt = bcrypt.gensalt(rounds=rounds)
+    return str(bcrypt.hashpw(password=pwd, salt=salt).decode("utf-8"))
+
+
+def verify_password_blocking(password: str, hashed_password: str) -> bool:
+    pwd = password.encode("utf-8")
+    hashed_pwd = hashed_password.encode("utf-8")
+    return bool(bcrypt.checkpw(password=pwd, hashed_password=hashed_pwd))
+
+
 class AuthenticationRepository:
 
-    def __init__(self, db: Session = None, model: Model = None):
+    def __init__(self, db: AsyncSession = None, model: Model = None):
         self.db = db
         self.model = model
 
 
-    def check_if_exists_user_by_username(self, username: str) -> bool:
+    async def check_if_exists_user_by_username(self, username: str) -> bool:
         query = select(self.model).filter_by(username=username)
         query = exists(query).select()
-        return self.db.scalar(query)
+        return await self.db.scalar(query)
 
 
-    def check_if_exists_user_by_email(self, email: str) -> bool:
+    async def check_if_exists_user_by_email(self, email: str) -> bool:
         query = select(self.model).filter_by(email=email)
         query = exists(query).select()
-        return self.db.scalar(query)
+        return await self.db.scalar(query)
 
 
-    def get_user_by_username(self, username: str) -> str:
+    async def get_user_by_username(self, username: str) -> str:
         query = select(self.model).filter_by(username=username)
-        return self.db.scalar(query)
+        return await self.db.scalar(query)
+
+
+    async def get_user_stats(self, user_id: int):
+        query = (
+                    select(self.model.post_count, self.model.published_post_count, self.model.image_bytes)
+                    .filter_by(id=user_id))
+        return (await self.db.execute(query)).mappings().one_or_none()
 
 
     def check_the_same_password(self, password: str, password_confirm: str) -> bool:
         return bool(password == password_confirm)
 
 
-    def hash_password(self, password: str) -> str:
-        pwd = password.encode("utf-8")
-        salt = bcrypt.gensalt()
-        return str(bcrypt.hashpw(password=pwd, salt=salt).decode("utf-8"))
+    async def hash_password(self, password: str) -> str:
+        try:
+            return await workers.run(hash_password_blocking, password, settings.BCRYPT_ROUNDS)
+        except WorkerPoolSaturatedError:
+            raise exceptions.TooManyRequestsException
 
 
-    def verify_password(self, password: str, hashed_password: str) -> bool:
-        pwd = password.encode("utf-8")
-        hashed_pwd = hashed_password.encode("utf-8")
-        return bool(bcrypt.checkpw(password=pwd, hashed_password=hashed_pwd))
+    async def verify_password(self, password: str, hashed_password: str) -> bool:
+        try:
+            return await workers.run(verify_password_blocking, password, hashed_password)
+        except WorkerPoolSaturatedError:
+            raise exceptions.TooManyRequestsException
 
 
-    def get_active_status(self, username: str) -> bool:
+    async def get_active_status(self, username: str) -> bool:
         query = select(self.model).filter_by(username=username)
-        return bool(self.db.scalar(query).is_active)
+        return bool((await self.db.scalar(query)).is_active)
 
 
-    def authenticate_user(self, username: str, password: str):
-        instance = self.get_user_by_username(username=username)
-        if instance and self.verify_password(password, instance.hashed_password) == True:
+    async def authenticate_user(self, username: str, password: str):
+        instance = await self.get_user_by_username(username=username)
+        if instance and await self.verify_password(password, instance.hashed_password) == True:
             return instance
         else:
             return False
@@ -83,44 +183,60 @@ class AuthenticationRepository:
         else:
             expire = datetime.now(timezone.utc) + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
             secret_key = settings.ACCESS_SECRET_KEY
-        to_encode.update({"exp": expire})
+        to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc).timestamp()})
         encoded_jwt = jwt.encode(to_encode, secret_key, algorithm=settings.ALGORITHM)
         return str(encoded_jwt)
 
 
-    def verify_token(self, token: str, refresh: bool) -> str:
+    def get_token_claims(self, token: str, refresh: bool) -> dict:
+        claims = token_cache.get(token, refresh)
+        if claims is not None:
+            return claims
         try:
             if refresh:
-                payload = jwt.decode(token, settings.REFRESH_SECRET_KEY, algorithms=[settings.ALGORITHM])
+                claims = jwt.decode(token, settings.REFRESH_SECRET_KEY, algorithms=[settings.ALGORITHM])
             else:
-                payload = jwt.decode(token, settings.ACCESS_SECRET_KEY, algorithms=[settings.ALGORITHM])
-            username: str = payload.get("sub")
-            if username is None:
-                return None
-            return username
+                claims = jwt.decode(token, settings.ACCESS_SECRET_KEY, algorithms=[settings.ALGORITHM])
         except jwt.ExpiredSignatureError:
             raise exceptions.TokenExpiredException
         except JWTError:
             return None
+        token_cache.set(token, refresh, claims)
+        return claims
+
+
+    async def verify_token(self, token: str, refresh: bool) -> str:
+        claims = self.get_token_claims(token, refresh)
+        if claims is None or claims.get("sub") is None:
+            return None
+        if await token_revocation.is_revoked(claims):
+            return None
+        return claims["sub"]
 
 
 class BlogRepository:
 
-    def __init__(self, db: Session, model: Model):
+    def __init__(self, db: AsyncSession, model: Model):
         self.db = db
         self.model = model
 
-    def get_post_by_user_id(self, user_id: int) -> Model:
+    async def check_if_exists_post_by_user_id(self, user_id: int) -> bool:
         query = select(self.model).filter_by(created_by=user_id)
-        return self.db.scalars(query).all()
+        query = exists(query).select()
+        return await self.db.scalar(query)
 
 
-    def query_get_post_by_user_id(self, user_id: int):
-        return select(self.model).filter_by(created_by=user_id)
+    def shape_query(self, query, schema: type[BaseModel]):
+        return query.options(*get_load_options(self.model, schema))
 
 
-    def query_get_post_by_title(self, title_post: str):
-        return select(self.model).filter_by(title=title_post)
+    async def get_post_by_id_shaped(self, post_id: int, schema: type[BaseModel]) -> Model:
+        query = self.shape_query(select(self.model).filter_by(id=post_id), schema)
+        return await self.db.scalar(query.execution_options(populate_existing=True))
+
+
+    def query_get_post_by_user_id(self, user_id: int):
+        return select(self.model).filter_by(created_by=user_id)
 
 
     def query_get_post_own_by_ids(self, post_id: int, user_id: int):
@@ -131,93 +247,293 @@ class BlogRepository:
         return select(self.model)
 
 
+    def query_search_post(self, term: str):
+        search_query = get_search_query(term)
+        rank = func.ts_rank(self.model.search_vector, search_query).label("rank")
+        headline = func.ts_headline(
+                                    cast(literal(settings.SEARCH_LANGUAGE), REGCONFIG),
+                                    self.model.content,
+                                    search_query,
+                                    settings.SEARCH_HEADLINE_OPTIONS).label("headline")
+        return (
+                select(self.model, rank, headline)
+                .filter(self.model.search_vector.bool_op("@@")(search_query))
+                .order_by(rank.desc(), self.model.id.desc()))
+
+
+    async def create_import_table(self) -> None:
+        connection = await self.db.connection()
+        await connection.run_sync(post_import.create)
+
+
+    async def copy_import_rows(self, records: list[tuple]) -> None:
+        connection = await self.db.connection()
+        raw_connection = await connection.get_raw_connection()
+        await raw_connection.driver_connection.copy_records_to_table(
+                                                                        post_import.name,
+                                                                        records=records,
+                                                                        columns=[column.name for column in post_import.columns])
+
+
+    async def merge_import_rows(self, user_id: int, limit: int) -> list:
+        ranked = select(
+                        post_import,
+                        func.row_number().over(partition_by=post_import.c.title, order_by=post_import.c.line).label("rank")).cte("ranked")
+        inserted = (
+                    insert(PostModel)
+                    .from_select(
+                                    ["title", "content", "published", "created_at", "created_by"],
+                                    select(
+                                            ranked.c.title,
+                                            ranked.c.content,
+                                            ranked.c.published,
+                                            func.coalesce(ranked.c.created_at, func.now()),
+                                            literal(user_id))
+                                    .filter(ranked.c.rank == 1))
+                    .on_conflict_do_nothing(index_elements=["title"])
+                    .returning(PostModel.title)
+                    .cte("inserted"))
+        query = (
+                    select(
+                            ranked.c.line,
+                            ranked.c.rank,
+                            func.count().over().label("failed"),
+                            func.count().filter(ranked.c.published).over().label("failed_published"))
+                    .select_from(ranked.outerjoin(inserted, inserted.c.title == ranked.c.title))
+                    .filter(or_(ranked.c.rank > 1, inserted.c.title.is_(None)))
+                    .order_by(ranked.c.line)
+                    .limit(limit))
+        return (await self.db.execute(query)).all()
+
+
 class MediaRepository:
 
+    image_fields = ("location", "filename", "size", "content_type", "sha256")
+
     async def upload_files(self, files_to_upload: list[UploadFile], request: Request):
         list_of_files = []
+        temp_files = {}
         try:
             for file in files_to_upload:
-                file_name = uuid.uuid4().hex
-                file_extension = file.filename.split('.').pop()
-                file_name_full = f"{file_name}.{file_extension}"
-                file_path = os.path.join(settings.MEDIA_ROOT, file_name_full)
-                file_url = f"{str(request.base_url)[:-1]}{settings.MEDIA_URL}/{file_name_full}"
-                file.file.seek(0)
-                data = await file.read()
-                with open(file_path, "wb") as buffer:
-                    buffer.write(data)
-                    buffer.close()
+                temp_path = os.path.join(settings.MEDIA_ROOT, f"{uuid.uuid4().hex}.upload")
+                size, sha256 = await self.stream_file(file, temp_path, settings.MAX_FILE_SIZE)
+                file_name_full = f"{sha256}.{get_file_extension(file.filename)}"
+                if file_name_full in temp_files:
+                    await anyio.to_thread.run_sync(self.remove_file, temp_path)
+                else:
+                    temp_files[file_name_full] = temp_path
                 list_of_files.append({
-                                        "location" : str(file_url),
+                                        "location" : get_media_url(request, file_name_full),
                                         "filename" : str(file_name_full),
-                                        "size": int(file.size),
-                                        "content_type": str(file.content_type)})
-        except:
+                                        "size": size,
+                                        "content_type": str(file.content_type),
+                                        "sha256": sha256})
+        except HTTPException:
+            await self.remove_temp_files(temp_files)
+            raise
+        except Exception:
+            await self.remove_temp_files(temp_files)
             raise exceptions.UploadFileException
-        return list_of_files
+        return list_of_files, temp_files
+
+
+    async def stream_file(self, file: UploadFile, file_path: str, max_size: int) -> tuple[int, str]:
+        size = 0
+        digest = hashlib.sha256()
+        partial_path = f"{file_path}.part"
+        try:
+            await file.seek(0)
+            async with await anyio.open_file(partial_path, "wb") as buffer:
+                while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_size:
+                        raise exceptions.TooLargeFileException
+                    digest.update(chunk)
+                    await buffer.write(chunk)
+            await anyio.to_thread.run_sync(os.replace, partial_path, file_path)
+        except BaseException:
+            await anyio.to_thread.run_sync(self.remove_file, partial_path)
+            raise
+        return size, digest.hexdigest()
+
+
+    def store_blob(self, temp_path: str, file_path: str) -> None:
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            if not os.path.exists(file_path):
+                os.replace(temp_path, file_path)
+        finally:
+            self.remove_file(temp_path)
+
+
+    def remove_file(self, file_path: str) -> None:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+
+    async def remove_derivatives(self, file_names: list[str]) -> None:
+        for file_name in file_names:
+            for derivative_name in ImageModel.get_derivative_names(file_name).values():
+                await anyio.to_thread.run_sync(self.remove_file, get_media_path(derivative_name))
 
 
-    def validate_file_by_size(self, file: IO, max_size: int):
-        real_file_size = 0
-        for chunk in file.file:
-            real_file_size += len(chunk)
-            if real_file_size > max_size:
-                raise exceptions.TooLargeFileException
+    async def remove_temp_files(self, temp_files: dict[str, str]) -> None:
+        for temp_path in temp_files.values():
+            await anyio.to_thread.run_sync(self.remove_file, temp_path)
+        temp_files.clear()
 
 
-    async def create_info_files(self, db, post_id: int, list_of_files: list):
+    async def remove_blobs(self, file_names: list[str], with_derivatives: bool = True) -> None:
+        for file_name in file_names:
+            await anyio.to_thread.run_sync(self.remove_file, get_media_path(file_name))
+        if with_derivatives:
+            await self.remove_derivatives(file_names)
+
+
+    async def lock_blobs(self, db: AsyncSession, file_names: list[str]) -> None:
+        names = (
+                    select(func.unnest(literal(sorted(set(file_names)), ARRAY(String))).column_valued("name"))
+                    .order_by("name")
+                    .subquery())
+        await db.execute(select(func.pg_advisory_xact_lock(func.hashtext(names.c.name))))
+
+
+    async def collect_blobs(self, file_names: list[str]) -> None:
+        if not file_names:
+            return
         try:
-            for file in list_of_files:
+            async with DatabaseSessionClass() as db:
+                await self.lock_blobs(db, file_names)
+                referenced = set((await db.scalars(
+                                                    select(ImageModel.filename)
+                                                    .where(ImageModel.filename.in_(file_names)))).all())
+                await self.remove_blobs(sorted(set(file_names) - referenced))
+        except (SQLAlchemyError, OSError) as exception:
+            logger.warning(f"Blobs {file_names} were not collected: {exception}")
+
+
+    async def create_info_files(self, db: AsyncSession, post_id: int, list_of_files: list, temp_files: dict[str, str]):
+        try:
+            image_ids = []
+            files = {file["filename"]: file for file in list_of_files}
+            await self.lock_blobs(db, list(files))
+            for file_name, temp_path in list(temp_files.items()):
+                await anyio.to_thread.run_sync(self.store_blob, temp_path, get_media_path(file_name))
+                del temp_files[file_name]
+            for file in files.values():
                 ImageBase(**file)
-                instance = ImageModel(**file, post_id=post_id)
-                db.add(instance)
-                db.flush()
+                query = (
+                            insert(ImageModel)
+                            .values(**{field: file[field] for field in self.image_fields}, refcount=1)
+                            .on_conflict_do_update(
+                                                    index_elements=[ImageModel.filename],
+                                                    set_={"refcount": ImageModel.refcount + 1})
+                            .returning(ImageModel.id))
+                image_ids.append(await db.scalar(query))
+            await db.execute(
+                                post_image.insert(),
+                                [{"post_id": post_id, "image_id": image_id} for image_id in image_ids])
+            await update_user_counters(
+                                        db,
+                                        select(PostModel.created_by).filter_by(id=post_id).scalar_subquery(),
+                                        {"image_bytes": sum(file["size"] for file in files.values())})
         except:
             raise exceptions.BadRequestException("Error with saving info files.")
 
 
+    async def release_files(self, db: AsyncSession, post_id: int) -> list[str]:
+        query = (
+                    delete(post_image)
+                    .where(post_image.c.post_id == post_id, post_image.c.image_id == ImageModel.id)
+                    .returning(post_image.c.image_id, ImageModel.size))
+        images = (await db.execute(query)).all()
+        if not images:
+            return []
+        image_ids = [image_id for image_id, _ in images]
+        await update_user_counters(
+                                    db,
+                                    select(PostModel.created_by).filter_by(id=post_id).scalar_subquery(),
+                                    {"image_bytes": -sum(size for _, size in images)})
+        await db.execute(
+                            update(ImageModel)
+                            .where(ImageModel.id.in_(image_ids))
+                            .values(refcount=ImageModel.refcount - 1))
+        query = (
+                    delete(ImageModel)
+                    .where(ImageModel.id.in_(image_ids), ImageModel.refcount <= 0)
+                    .returning(ImageModel.filename))
+        return (await db.scalars(query)).all()
+
+
 class CrudOperationRepository:
 
-    def __init__(self, db: Session, model: Model):
+    def __init__(self, db: AsyncSession, model: Model):
         self.db = db
         self.model = model
 
 
-    def get_by_id(self, id: int) -> Model:
-        return self.db.get(self.model, id)
+    async def get_by_id(self, id: int) -> Model:
+        return await self.db.get(self.model, id)
 
 
-    def get_all(self, filter: Filter = None) -> Model:
+    async def get_all(self, filter: Filter = None) -> Model:
         query = select(self.model)
         if filter is not None:
             query = filter.filter(query)
             query = filter.sort(query)
-        return self.db.scalars(query).all()
+        return (await self.db.scalars(query)).all()
 
 
-    def create(self, data: dict) -> Model:
+    def get_counters(self, record: Model) -> dict:
+        if self.model is PostModel:
+            return get_post_counters(record)
+        return {}
+
+
+    async def update_counters(self, record: Model, before: dict, after: dict) -> None:
+        counters = {name: after.get(name, 0) - before.get(name, 0) for name in {*before, *after}}
+        if any(counters.values()):
+            await update_user_counters(self.db, record.created_by, counters)
+
+
+    async def create(self, data: dict) -> Model:
         record = self.model(**data)
         self.db.add(record)
-        self.db.flush()
-        self.db.refresh(record)
+        await self.db.flush()
+        await self.update_counters(record, {}, self.get_counters(record))
+        return record
+
+
+    async def create_unique(self, data: dict, index_elements: list[str]) -> Model:
+        query = (
+                    insert(self.model)
+                    .values(**data)
+                    .on_conflict_do_nothing(index_elements=index_elements)
+                    .returning(self.model))
+        record = await self.db.scalar(query)
+        if record is not None:
+            await self.update_counters(record, {}, self.get_counters(record))
         return record
 
 
-    def update(self, record: Model, data: Annotated[BaseModel, dict]) -> Model:
+    async def update(self, record: Model, data: Annotated[BaseModel, dict]) -> Model:
         if isinstance(data, BaseModel):
             data = data.model_dump(exclude_none=True)
+        before = self.get_counters(record)
         for key, value in data.items():
             setattr(record, key, value)
-        self.db.merge(record)
-        self.db.flush()
-        self.db.refresh(record)
+        await self.db.flush()
+        await self.update_counters(record, before, self.get_counters(record))
         return record
 
 
-    def delete(self, record: Model) -> bool:
+    async def delete(self, record: Model) -> bool:
         if record is not None:
-            self.db.delete(record)
-            self.db.flush()
+            await self.db.delete(record)
+            await self.db.flush()
+            await self.update_counters(record, self.get_counters(record), {})
             return True
         else:
             return False
@@ -0,0 +1,159 @@
+import os
+import re
+import uuid
+import anyio
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import status
+from fastapi.responses import Response, StreamingResponse
+from starlette.datastructures import Headers
+from config.settings import settings
+from .repository import get_media_shards
+
+
+CONTENT_ADDRESSED_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+RANGE_PATTERN = re.compile(r"^\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+def is_content_addressed(file_name: str) -> bool:
+    return CONTENT_ADDRESSED_PATTERN.match(os.path.splitext(file_name)[0]) is not None
+
+
+def get_etag(file_name: str, stat: os.stat_result) -> str:
+    if is_content_addressed(file_name):
+        return f"\"{os.path.splitext(file_name)[0]}\""
+    return f"\"{stat.st_mtime_ns:x}-{stat.st_size:x}\""
+
+
+def is_not_modified(headers: Headers, etag: str, last_modified: float) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range(header: str, size: int) -> list[tuple[int, int]]:
+    unit, _, specs = header.partition("=")
+    if unit.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for spec in specs.split(","):
+        match = RANGE_PATTERN.match(spec)
+        if match is None or match.groups() == ("", ""):
+            return None
+        start, end = match.groups()
+        if start == "":
+            if int(end) > 0:
+                ranges.append((max(size - int(end), 0), size - 1))
+            continue
+        if end != "" and int(end) < int(start):
+            return None
+        if int(start) < size:
+            ranges.append((int(start), min(int(end), size - 1) if end != "" else size - 1))
+    if len(ranges) > settings.DOWNLOAD_MAX_RANGES:
+        return None
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+async def read_range(file_path: str, start: int, end: int):
+    async with await anyio.open_file(file_path, "rb") as file:
+        await file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await file.read(min(settings.DOWNLOAD_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def read_ranges(file_path: str, parts: list[tuple[bytes, int, int]], boundary: str):
+    for header, start, end in parts:
+        yield header
+        async for chunk in read_range(file_path, start, end):
+            yield chunk
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode("latin-1")
+
+
+async def media_file_response(
+                                headers: Headers,
+                                file_path: str,
+                                file_name: str,
+                                media_type: str = "application/octet-stream") -> Response:
+    stat = await anyio.to_thread.run_sync(os.stat, file_path)
+    etag = get_etag(file_name, stat)
+    response_headers = {
+                        "ETag": etag,
+                        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+                        "Accept-Ranges": "bytes",
+                        "Cache-Control": settings.DOWNLOAD_CACHE_CONTROL if is_content_addressed(file_name) else "private, no-cache"}
+    if is_not_modified(headers, etag, stat.st_mtime):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=response_headers)
+    response_headers["Content-Disposition"] = f"attachment; filename={file_name}"
+    size = stat.st_size
+    ranges = None
+    if_range = headers.get("if-range")
+    if "range" in headers and (if_range is None or if_range in (etag, response_headers["Last-Modified"])):
+        ranges = parse_range(headers["range"], size)
+    if ranges is None:
+        response_headers["Content-Length"] = str(size)
+        return StreamingResponse(
+                                    content=read_range(file_path, 0, size - 1),
+                                    status_code=status.HTTP_200_OK,
+                                    media_type=media_type,
+                                    headers=response_headers)
+    if not ranges:
+        return Response(
+                        status_code=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                        headers={**response_headers, "Content-Range": f"bytes */{size}"})
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response_headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response_headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(
+                                    content=read_range(file_path, start, end),
+                                    status_code=status.HTTP_206_PARTIAL_CONTENT,
+                                    media_type=media_type,
+                                    headers=response_headers)
+    boundary = uuid.uuid4().hex
+    parts = [
+                (
+                    (
+                        f"--{boundary}\r\n"
+                        f"Content-Type: {media_type}\r\n"
+                        f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode("latin-1"),
+                    start,
+                    end)
+                for start, end in ranges]
+    content_length = sum(len(header) + end - start + 1 + 2 for header, start, end in parts) + len(boundary) + 6
+    response_headers["Content-Length"] = str(content_length)
+    return StreamingResponse(
+                                content=read_ranges(file_path, parts, boundary),
+                                status_code=status.HTTP_206_PARTIAL_CONTENT,
+                                media_type=f"multipart/byteranges; boundary={boundary}",
+                                headers=response_headers)
+
+
+async def media_accel_response(file_path: str, file_name: str, media_type: str = "application/octet-stream") -> Response:
+    if not await anyio.to_thread.run_sync(os.path.isfile, file_path):
+        raise FileNotFoundError(file_path)
+    return Response(
+                    status_code=status.HTTP_200_OK,
+                    media_type=media_type,
+                    headers={
+                                "X-Accel-Redirect": f"{settings.MEDIA_ACCEL_LOCATION}/{"/".join([*get_media_shards(file_name), file_name])}",
+                                "Content-Disposition": f"attachment; filename={file_name}",
+                                "Cache-Control": settings.DOWNLOAD_CACHE_CONTROL if is_content_addressed(file_name) else "private, no-cache"})
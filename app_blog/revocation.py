@@ -0,0 +1,159 @@
+import json
+import math
+import time
+import logging
+from redis.exceptions import RedisError
+from config.bloom import BloomFilter
+from config.cache import MemoryCache, run_blocking
+from config.settings import settings
+
+
+logger = logging.getLogger("uvicorn.error")
+FAIL_CLOSED = {"before": math.inf}
+
+
+def get_stream_id(entry_id: str) -> tuple[int, int]:
+    milliseconds, _, sequence = entry_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+def get_revocation_ttl() -> int:
+    return (settings.ACCESS_TOKEN_EXPIRE_MINUTES + settings.REFRESH_TOKEN_EXPIRE_MINUTES) * 60
+
+
+class TokenRevocation:
+
+    prefix = "revocation"
+
+    def __init__(self):
+        self.bloom = self.create_bloom()
+        self.local = MemoryCache(maxsize=settings.TOKEN_REVOCATION_LOCAL_SIZE)
+        self.redis = None
+        self.retry_at = 0
+        self.sync_at = 0
+        self.rebuilt_at = 0
+        self.last_id = None
+
+
+    def create_bloom(self) -> BloomFilter:
+        return BloomFilter(size=settings.TOKEN_REVOCATION_BLOOM_SIZE, hashes=settings.TOKEN_REVOCATION_BLOOM_HASHES)
+
+
+    def get_backend(self):
+        if self.redis is None and settings.TOKEN_REVOCATION_BACKEND == "redis" and time.monotonic() >= self.retry_at:
+            try:
+                from config.redis import get_redis
+                self.redis = next(get_redis())
+            except RedisError as exception:
+                self.retry_at = time.monotonic() + settings.TOKEN_REVOCATION_RETRY
+                logger.warning(f"Token revocation store is unavailable: {exception}")
+        return self.redis
+
+
+    async def revoke(self, item: str, record: dict, ttl: int) -> None:
+        self.local.set(item, record, ttl)
+        self.bloom.add(item)
+        await run_blocking(settings.TOKEN_REVOCATION_BACKEND, self.share, item, record, ttl)
+
+
+    def share(self, item: str, record: dict, ttl: int) -> None:
+        backend = self.get_backend()
+        if backend is None:
+            return
+        try:
+            pipeline = backend.pipeline()
+            pipeline.set(f"{self.prefix}:{item}", json.dumps(record), ex=ttl)
+            pipeline.zadd(f"{self.prefix}:items", {item: time.time() + ttl})
+            pipeline.xadd(f"{self.prefix}:log", {"item": item}, maxlen=settings.TOKEN_REVOCATION_LOG_SIZE, approximate=True)
+            pipeline.execute()
+        except RedisError as exception:
+            logger.warning(f"Token revocation was not shared: {exception}")
+
+
+    async def revoke_session(self, session: str) -> None:
+        await self.revoke(f"session:{session}", {}, get_revocation_ttl())
+
+
+    async def revoke_user(self, username: str, before: float, session: str = None) -> None:
+        await self.revoke(f"user:{username}", {"before": before, "session": session}, get_revocation_ttl())
+
+
+    async def lookup(self, item: str) -> dict:
+        record = self.local.get(item)
+        if record is not None or settings.TOKEN_REVOCATION_BACKEND != "redis":
+            return record
+        return await run_blocking(settings.TOKEN_REVOCATION_BACKEND, self.fetch, item)
+
+
+    def fetch(self, item: str) -> dict:
+        backend = self.get_backend()
+        if backend is None:
+            return FAIL_CLOSED
+        try:
+            value = backend.get(f"{self.prefix}:{item}")
+        except RedisError as exception:
+            logger.warning(f"Token revocation lookup failed: {exception}")
+            return FAIL_CLOSED
+        return json.loads(value) if value is not None else None
+
+
+    async def is_revoked(self, claims: dict) -> bool:
+        await self.sync()
+        session = claims.get("sid")
+        if session is not None and f"session:{session}" in self.bloom and await self.lookup(f"session:{session}") is not None:
+            return True
+        user = f"user:{claims.get("sub")}"
+        if user in self.bloom:
+            record = await self.lookup(user)
+            if record is not None and claims.get("iat", 0) < record["before"] and (session is None or session != record.get("session")):
+                return True
+        return False
+
+
+    async def sync(self) -> None:
+        now = time.monotonic()
+        if settings.TOKEN_REVOCATION_BACKEND != "redis" or now < self.sync_at:
+            return
+        self.sync_at = now + settings.TOKEN_REVOCATION_SYNC_INTERVAL
+        rebuild = self.last_id is None or now >= self.rebuilt_at + settings.TOKEN_REVOCATION_REBUILD_INTERVAL
+        try:
+            changes = await run_blocking(settings.TOKEN_REVOCATION_BACKEND, self.read_log, rebuild, self.last_id)
+        except RedisError as exception:
+            self.sync_at = time.monotonic() + settings.TOKEN_REVOCATION_RETRY
+            logger.warning(f"Token revocation sync failed: {exception}")
+            return
+        if changes is None:
+            return
+        rebuilt, last_id, items = changes
+        if rebuilt:
+            bloom = self.create_bloom()
+            for item in [*items, *self.local.keys()]:
+                bloom.add(item)
+            self.bloom = bloom
+            self.rebuilt_at = time.monotonic()
+        else:
+            for item in items:
+                self.bloom.add(item)
+        self.last_id = last_id
+
+
+    def read_log(self, rebuild: bool, last_id: str) -> tuple[bool, str, list[str]]:
+        backend = self.get_backend()
+        if backend is None:
+            return None
+        if not rebuild:
+            pipeline = backend.pipeline(transaction=False)
+            pipeline.xrange(f"{self.prefix}:log", count=1)
+            pipeline.xrange(f"{self.prefix}:log", min=f"({last_id}", count=settings.TOKEN_REVOCATION_LOG_SIZE)
+            first, entries = pipeline.execute()
+            if not first or get_stream_id(first[0][0]) <= get_stream_id(last_id):
+                return False, entries[-1][0] if entries else last_id, [fields["item"] for _, fields in entries]
+        pipeline = backend.pipeline()
+        pipeline.xrevrange(f"{self.prefix}:log", count=1)
+        pipeline.zremrangebyscore(f"{self.prefix}:items", "-inf", time.time())
+        pipeline.zrange(f"{self.prefix}:items", 0, -1)
+        last, _, items = pipeline.execute()
+        return True, last[0][0] if last else "0-0", items
+
+
+token_revocation = TokenRevocation()
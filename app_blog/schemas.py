@@ -1,5 +1,5 @@
 from fastapi import UploadFile
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, field_validator
 from datetime import datetime
 from typing import Optional
 
@@ -48,11 +48,39 @@ class TokenAccessBase(BaseModel):
     token_type: str = "bearer"
 
 
+class PoolStatusBase(BaseModel):
+    connects: int
+    checkouts: int
+    checkins: int
+    invalidations: int
+    timeouts: int
+    checked_out: int
+    peak_checked_out: int
+    pool_size: Optional[int] = None
+    max_overflow: Optional[int] = None
+    checked_in: Optional[int] = None
+    overflow: Optional[int] = None
+
+
+class UserStatsBase(BaseModel):
+    post_count: int
+    published_post_count: int
+    image_bytes: int
+
+
+class CacheStatusBase(BaseModel):
+    backend: Optional[str] = None
+    hits: int
+    misses: int
+    invalidations: int
+
+
 class ImageBase(BaseModel):
     location: str
     filename: str
     size: int
     content_type: str
+    derivatives: dict[str, str] = {}
 
 
 class PostCreateBase(BaseModel):
@@ -61,6 +89,32 @@ class PostCreateBase(BaseModel):
     image: Optional[list[UploadFile]] | None = None
 
 
+class PostImportBase(BaseModel):
+    title: str
+    content: str
+    published: bool = False
+    created_at: Optional[datetime] = None
+
+    @field_validator("title", "content")
+    @classmethod
+    def check_null_character(cls, value: str) -> str:
+        if "\x00" in value:
+            raise ValueError("Null characters are not allowed.")
+        return value
+
+
+class ImportErrorBase(BaseModel):
+    line: int
+    error: str
+
+
+class ImportResultBase(BaseModel):
+    received: int
+    created: int
+    failed: int
+    errors: list[ImportErrorBase]
+
+
 class PostUpdateBase(BaseModel):
     content: Optional[str] = None
     published: Optional[bool] = None
@@ -74,3 +128,13 @@ class PostViewBase(BaseModel):
     created_at: datetime
     users: UserBase
     images: list[ImageBase]
+
+
+class PostPageBase(BaseModel):
+    items: list[PostViewBase]
+    next_cursor: Optional[str] = None
+
+
+class PostSearchBase(PostViewBase):
+    rank: float
+    headline: str
@@ -1,16 +1,27 @@
 import os
+import time
+import uuid
+import anyio
 from typing import TypeVar
 from pydantic import BaseModel
-from fastapi import status, Request
+from fastapi import status, Request, UploadFile
 from fastapi.security import OAuth2PasswordBearer
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi_filter.contrib.sqlalchemy import Filter
-from sqlalchemy.orm import Session
-from config.database import Base
+from sqlalchemy.ext.asyncio import AsyncSession
+from config.database import Base, on_commit, on_rollback
 from config.settings import settings
 from . import exceptions
-from .repository import AuthenticationRepository, BlogRepository, MediaRepository, CrudOperationRepository
+from .repository import AuthenticationRepository, BlogRepository, MediaRepository, CrudOperationRepository, get_media_path, get_media_shards, update_user_counters
 from .models import UserModel, PostModel
+from .schemas import PostViewBase, PostPageBase
+from .cache import principal_cache, post_cache
+from .pagination import KeysetPagination
+from .responses import media_file_response, media_accel_response
+from .derivatives import derivatives
+from .revocation import token_revocation
+from .imports import get_import_format, read_batches
+from .exports import EXPORT_FORMATS, stream_export
 
 
 media = MediaRepository()
@@ -19,7 +30,7 @@ Model = TypeVar("Model", bound=Base)
 
 class AuthenticationService:
 
-    def __init__(self, db: Session, cuser: str = None):
+    def __init__(self, db: AsyncSession, cuser: str = None):
         self.db = db
         self.cuser = cuser
         self.model = UserModel
@@ -28,10 +39,10 @@ class AuthenticationService:
         self.blog = BlogRepository(self.db, PostModel)
 
 
-    def auth_register_user(self, data: BaseModel) -> Model:
-        if self.auth.check_if_exists_user_by_username(data.username):
+    async def auth_register_user(self, data: BaseModel) -> Model:
+        if await self.auth.check_if_exists_user_by_username(data.username):
             raise exceptions.UserExistsException
-        if self.auth.check_if_exists_user_by_email(data.email):
+        if await self.auth.check_if_exists_user_by_email(data.email):
             raise exceptions.EmailExistsException
         if self.auth.check_the_same_password(data.password, data.password_confirm) == False:
             raise exceptions.NotTheSamePasswordException
@@ -39,60 +50,98 @@ class AuthenticationService:
             "username": data.username,
             "full_name": data.full_name,
             "email": data.email,
-            "hashed_password": self.auth.hash_password(data.password)}
-        return self.crud.create(input)
+            "hashed_password": await self.auth.hash_password(data.password)}
+        return await self.crud.create(input)
 
 
-    def auth_update_user(self, data: BaseModel) -> Model:
-        instance = self.auth.get_user_by_username(self.cuser.username)
+    async def invalidate_principal(self, username: str = None) -> None:
+        username = username or self.cuser.username
+        await principal_cache.invalidate(username)
+        on_commit(self.db, lambda: principal_cache.invalidate(username))
+
+
+    async def auth_update_user(self, data: BaseModel) -> Model:
+        instance = await self.auth.get_user_by_username(self.cuser.username)
         if not instance:
             raise exceptions.UserNotFoundException
-        return self.crud.update(instance, data)
+        username = instance.username
+        instance = await self.crud.update(instance, data)
+        usernames = {username, instance.username}
+        for name in usernames:
+            await self.invalidate_principal(name)
+        on_commit(self.db, lambda: post_cache.invalidate(*usernames))
+        return instance
 
 
-    def auth_delete_user(self):
-        instance = self.auth.get_user_by_username(self.cuser.username)
+    async def auth_delete_user(self):
+        instance = await self.auth.get_user_by_username(self.cuser.username)
         if not instance:
             raise exceptions.UserNotFoundException
-        if self.blog.get_post_by_user_id(self.cuser.id):
+        if await self.blog.check_if_exists_post_by_user_id(self.cuser.id):
             raise exceptions.BadRequestException("At least one post belongs to this user.")
-        if not self.crud.delete(instance):
+        await self.invalidate_principal()
+        if not await self.crud.delete(instance):
             raise
         return JSONResponse(content={"message": "User deleted successfully."}, status_code=status.HTTP_200_OK)
 
 
-    def auth_change_password(self, data: BaseModel):
-        instance = self.auth.get_user_by_username(self.cuser.username)
+    async def auth_user_stats(self):
+        instance = await self.auth.get_user_stats(self.cuser.id)
+        if not instance:
+            raise exceptions.UserNotFoundException
+        return instance
+
+
+    async def auth_change_password(self, data: BaseModel, token: str = None):
+        instance = await self.auth.get_user_by_username(self.cuser.username)
         if not instance:
             raise exceptions.UserNotFoundException
         if self.auth.check_the_same_password(data.new_password, data.new_password_confirm) == False:
             raise exceptions.NotTheSamePasswordException
-        if self.auth.verify_password(data.old_password, instance.hashed_password) == False:
+        if await self.auth.verify_password(data.old_password, instance.hashed_password) == False:
             raise exceptions.IncorrectPasswordException
-        data = {"hashed_password": self.auth.hash_password(data.new_password)}
-        self.crud.update(instance, data)
+        data = {"hashed_password": await self.auth.hash_password(data.new_password)}
+        await self.invalidate_principal()
+        await self.crud.update(instance, data)
+        claims = self.auth.get_token_claims(token, refresh=False) if token else None
+        on_commit(self.db, lambda: token_revocation.revoke_user(
+                                                                self.cuser.username,
+                                                                before=time.time(),
+                                                                session=claims.get("sid") if claims else None))
         return JSONResponse(content={"message": "Password changed successfully."}, status_code=status.HTTP_200_OK)
 
 
-    def auth_login(self, data: OAuth2PasswordBearer):
-        user = self.auth.authenticate_user(data.username, data.password)
+    async def auth_login(self, data: OAuth2PasswordBearer):
+        user = await self.auth.authenticate_user(data.username, data.password)
         if not user:
             raise exceptions.CredentialsException
-        if self.auth.get_active_status(user.username) == False:
+        if await self.auth.get_active_status(user.username) == False:
             raise exceptions.UserInActiveException
-        access_token = self.auth.create_token(data={"sub": user.username}, refresh=False)
-        refresh_token = self.auth.create_token(data={"sub": user.username}, refresh=True)
+        session = uuid.uuid4().hex
+        access_token = self.auth.create_token(data={"sub": user.username, "sid": session}, refresh=False)
+        refresh_token = self.auth.create_token(data={"sub": user.username, "sid": session}, refresh=True)
         return JSONResponse(content={"access_token": access_token, "refresh_token": refresh_token}, status_code=status.HTTP_200_OK)
 
 
-    def auth_refresh(self):
-        access_token = self.auth.create_token(data={"sub": self.cuser.username}, refresh=False)
+    async def auth_refresh(self, token: str = None):
+        claims = self.auth.get_token_claims(token, refresh=True) if token else None
+        data = {"sub": self.cuser.username}
+        if claims and claims.get("sid"):
+            data["sid"] = claims["sid"]
+        access_token = self.auth.create_token(data=data, refresh=False)
         return JSONResponse(content={"access_token": access_token}, status_code=status.HTTP_200_OK)
 
 
+    async def auth_logout(self, token: str):
+        claims = self.auth.get_token_claims(token, refresh=False)
+        if claims and claims.get("sid"):
+            await token_revocation.revoke_session(claims["sid"])
+        return JSONResponse(content={"message": "Logged out successfully."}, status_code=status.HTTP_200_OK)
+
+
 class BlogService:
 
-    def __init__(self, db: Session, cuser: str = None, request: Request = None):
+    def __init__(self, db: AsyncSession, cuser: str = None, request: Request = None):
         self.db = db
         self.cuser = cuser
         self.request = request
@@ -102,66 +151,160 @@ class BlogService:
         self.blog = BlogRepository(self.db, PostModel)
 
 
+    def invalidate_posts(self) -> None:
+        on_commit(self.db, lambda: post_cache.invalidate(self.cuser.username))
+
+
     async def blog_create_post(self, data: BaseModel):
-        query = self.blog.query_get_post_by_title(data.title)
-        instance = self.db.scalars(query).all()
-        if instance:
-            raise exceptions.BadRequestException("Post of this title already exists.")
         input = {**data.model_dump(exclude={"image"}), "created_by": self.cuser.id}
-        instance = self.crud.create(input)
+        instance = await self.crud.create_unique(input, index_elements=["title"])
+        if instance is None:
+            raise exceptions.BadRequestException("Post of this title already exists.")
+        self.invalidate_posts()
         if data.image:
-            for file in data.image:
-                media.validate_file_by_size(file, settings.MAX_FILE_SIZE)
-            list_of_files = await media.upload_files(files_to_upload=data.image, request=self.request)
-            await media.create_info_files(self.db, instance.id, list_of_files)
-        return instance
+            list_of_files, temp_files = await media.upload_files(files_to_upload=data.image, request=self.request)
+            on_rollback(self.db, lambda: media.collect_blobs([file["filename"] for file in list_of_files]))
+            try:
+                await media.create_info_files(self.db, instance.id, list_of_files, temp_files)
+            finally:
+                await media.remove_temp_files(temp_files)
+            on_commit(self.db, lambda: derivatives.schedule([file["filename"] for file in list_of_files]))
+        return await self.blog.get_post_by_id_shaped(instance.id, PostViewBase)
 
 
-    def blog_update_post(self, id: int, data: BaseModel):
+    async def blog_update_post(self, id: int, data: BaseModel):
         query = self.blog.query_get_post_own_by_ids(id, self.cuser.id)
-        instance = self.db.scalar(query)
+        query = self.blog.shape_query(query, PostViewBase)
+        instance = await self.db.scalar(query)
         if not instance:
             raise exceptions.NotFoundException("Post does not exists or is not yours.")
-        return self.crud.update(instance, data)
+        self.invalidate_posts()
+        return await self.crud.update(instance, data)
 
 
-    def blog_delete_post(self, id: int):
+    async def blog_delete_post(self, id: int):
         query = self.blog.query_get_post_own_by_ids(id, self.cuser.id)
-        instance = self.db.scalar(query)
+        instance = await self.db.scalar(query)
         if not instance:
             raise exceptions.NotFoundException("Post does not exists or is not yours.")
-        if not self.crud.delete(instance):
+        self.invalidate_posts()
+        orphaned_files = await media.release_files(self.db, instance.id)
+        if not await self.crud.delete(instance):
             raise
+        on_commit(self.db, lambda: media.collect_blobs(orphaned_files))
         return JSONResponse(content={"message": "Post deleted successfully."}, status_code=status.HTTP_200_OK)
 
 
-    def blog_show_my_posts(self, filter: Filter):
+    async def blog_import_posts(self, file: UploadFile, format: str = None):
+        batches = read_batches(
+                                file.file,
+                                get_import_format(file.filename, file.content_type, format),
+                                settings.IMPORT_BATCH_SIZE)
+        await self.blog.create_import_table()
+        received, staged, published, invalid, errors = 0, 0, 0, 0, []
+        while (batch := await anyio.to_thread.run_sync(next, batches, None)) is not None:
+            batch_received, records, batch_errors = batch
+            received += batch_received
+            invalid += len(batch_errors)
+            errors.extend(batch_errors[:settings.IMPORT_MAX_ERRORS - len(errors)])
+            if records:
+                await self.blog.copy_import_rows(records)
+                staged += len(records)
+                published += sum(1 for record in records if record[3])
+        failed, failed_published = 0, 0
+        conflicts = await self.blog.merge_import_rows(self.cuser.id, max(settings.IMPORT_MAX_ERRORS, 1)) if staged else []
+        if conflicts:
+            failed, failed_published = conflicts[0].failed, conflicts[0].failed_published
+        await update_user_counters(
+                                    self.db,
+                                    self.cuser.id,
+                                    {"post_count": staged - failed, "published_post_count": published - failed_published})
+        if staged > failed:
+            self.invalidate_posts()
+        errors.extend(
+                        (conflict.line, "Title is duplicated in the import." if conflict.rank > 1 else "Post of this title already exists.")
+                        for conflict in conflicts)
+        return {
+                "received": received,
+                "created": staged - failed,
+                "failed": invalid + failed,
+                "errors": [{"line": line, "error": error} for line, error in sorted(errors)[:settings.IMPORT_MAX_ERRORS]]}
+
+
+    async def blog_show_my_posts(self, filter: Filter, cursor: str = None, limit: int = None):
         query = self.blog.query_get_post_by_user_id(self.cuser.id)
+        query = self.blog.shape_query(query, PostViewBase)
+        pagination = KeysetPagination(self.model, filter.ordering_values if filter is not None else None, cursor, limit)
         if filter is not None:
             query = filter.filter(query)
-            query = filter.sort(query)
-        instance = self.db.scalars(query).all()
-        if not instance:
+        instance = (await self.db.scalars(pagination.apply(query))).all()
+        if not instance and cursor is None:
             raise exceptions.NotFoundException("You do not have any post.")
-        return instance
+        items, next_cursor = pagination.page(instance)
+        return {"items": items, "next_cursor": next_cursor}
+
+
+    async def blog_find_post(self, filter: Filter, cursor: str = None, limit: int = None):
+        key, content = await post_cache.get(filter, cursor, limit) if filter is not None else (None, None)
+        if content is not None:
+            return Response(content=content, media_type="application/json")
+        query = self.blog.query_get_post_all().join(UserModel)
+        query = self.blog.shape_query(query, PostViewBase)
+        pagination = KeysetPagination(self.model, filter.ordering_values if filter is not None else None, cursor, limit)
+        if filter is not None:
+            query = filter.filter(query)
+        instance = (await self.db.scalars(pagination.apply(query))).all()
+        if not instance and cursor is None:
+            raise exceptions.NotFoundException("Expected post was not found.")
+        items, next_cursor = pagination.page(instance)
+        content = PostPageBase.model_validate(
+                                                {"items": items, "next_cursor": next_cursor},
+                                                from_attributes=True).model_dump_json()
+        await post_cache.set(key, content)
+        return Response(content=content, media_type="application/json")
 
 
-    def blog_find_post(self, filter: Filter):
+    async def blog_export_posts(self, filter: Filter, format: str = "ndjson"):
         query = self.blog.query_get_post_all().join(UserModel)
+        query = self.blog.shape_query(query, PostViewBase)
+        pagination = KeysetPagination(self.model, filter.ordering_values if filter is not None else None)
         if filter is not None:
             query = filter.filter(query)
-            query = filter.sort(query)
-        instance = self.db.scalars(query).all()
+        return StreamingResponse(
+                                    content=stream_export(pagination.order(query), format),
+                                    media_type=EXPORT_FORMATS[format],
+                                    headers={"Content-Disposition": f"attachment; filename=posts.{format}"})
+
+
+    async def blog_search_post(self, term: str, limit: int = None):
+        query = self.blog.query_search_post(term)
+        query = self.blog.shape_query(query, PostViewBase)
+        query = query.limit(min(limit or settings.PAGE_SIZE_DEFAULT, settings.PAGE_SIZE_MAX))
+        instance = (await self.db.execute(query)).all()
         if not instance:
             raise exceptions.NotFoundException("Expected post was not found.")
-        return instance
+        return [
+                {
+                    **{field: getattr(post, field) for field in PostViewBase.model_fields},
+                    "rank": rank,
+                    "headline": headline}
+                for post, rank, headline in instance]
+
+
+    async def blog_download_file(self, file_name: str):
+        location = os.path.join(os.getcwd(), get_media_path(file_name))
+        if file_name.startswith("."):
+            raise exceptions.NotFoundException("File was not found.")
+        try:
+            if settings.MEDIA_ACCEL_REDIRECT:
+                return await media_accel_response(location, file_name)
+            return await media_file_response(self.request.headers, location, file_name)
+        except FileNotFoundError:
+            raise exceptions.NotFoundException("File was not found.")
 
 
-    def blog_download_file(self, file_name: str):
-        location = os.path.join(os.getcwd(), settings.MEDIA_ROOT, file_name)
-        if not os.path.exists(location):
+    async def blog_media_file(self, file_path: str):
+        *shards, file_name = file_path.split("/")
+        if shards != get_media_shards(file_name):
             raise exceptions.NotFoundException("File was not found.")
-        return FileResponse(
-                                path=location,
-                                media_type="application/octet-stream",
-                                headers={"Content-Disposition": f"attachment; filename={file_name}"})
+        return await self.blog_download_file(file_name=file_name)
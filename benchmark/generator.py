@@ -0,0 +1,144 @@
+import os
+import random
+import hashlib
+from io import BytesIO
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from PIL import Image
+from sqlalchemy import select
+from config.database import get_engine
+from config.settings import settings
+from app_blog.models import ImageModel, PostModel, UserModel, post_image
+from app_blog.repository import get_media_path, hash_password_blocking
+
+
+VOCABULARY = [
+                "python", "postgres", "redis", "fastapi", "async", "index", "query", "cache", "latency", "throughput",
+                "pool", "worker", "image", "upload", "stream", "filter", "cursor", "bcrypt", "token", "session",
+                "benchmark", "profile", "metric", "histogram", "replica", "vacuum", "trigram", "search", "export", "import"]
+BASE_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+COPY_BATCH_SIZE = 10_000
+
+
+@dataclass
+class Dataset:
+    prefix: str
+    password: str
+    usernames: list[str] = field(default_factory=list)
+    titles: list[str] = field(default_factory=list)
+    images: list[str] = field(default_factory=list)
+
+
+def get_password(prefix: str) -> str:
+    return f"!ws@{prefix}_password"
+
+
+def make_image(rng: random.Random, size: tuple[int, int]) -> bytes:
+    image = Image.new("RGB", size, tuple(rng.randrange(256) for _ in range(3)))
+    for _ in range(8):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        image.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, min(x + size[0] // 4, size[0]), min(y + size[1] // 4, size[1])))
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=80)
+    return buffer.getvalue()
+
+
+def write_images(rng: random.Random, count: int, size: tuple[int, int]) -> list[dict]:
+    images = []
+    for _ in range(count):
+        content = make_image(rng, size)
+        sha256 = hashlib.sha256(content).hexdigest()
+        file_name = f"{sha256}.jpg"
+        file_path = get_media_path(file_name)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as file:
+            file.write(content)
+        images.append({
+                        "location": f"http://benchmark{settings.MEDIA_URL}/{os.path.relpath(file_path, settings.MEDIA_ROOT).replace(os.sep, "/")}",
+                        "filename": file_name,
+                        "size": len(content),
+                        "content_type": "image/jpeg",
+                        "sha256": sha256})
+    return images
+
+
+async def copy_records(connection, table: str, columns: list[str], records: list[tuple]) -> None:
+    raw_connection = await connection.get_raw_connection()
+    for start in range(0, len(records), COPY_BATCH_SIZE):
+        await raw_connection.driver_connection.copy_records_to_table(
+                                                                        table,
+                                                                        records=records[start:start + COPY_BATCH_SIZE],
+                                                                        columns=columns)
+
+
+async def generate_dataset(
+                            prefix: str = "bench",
+                            users: int = 100,
+                            posts_per_user: int = 100,
+                            images: int = 20,
+                            image_ratio: float = 0.2,
+                            image_size: tuple[int, int] = (640, 480),
+                            seed: int = 0) -> Dataset:
+    rng = random.Random(seed)
+    dataset = Dataset(prefix=prefix, password=get_password(prefix))
+    hashed_password = hash_password_blocking(dataset.password, settings.BCRYPT_ROUNDS)
+    image_rows = list({image["filename"]: image for image in write_images(rng, images, image_size)}.values())
+    dataset.images = [image["filename"] for image in image_rows]
+
+    post_rows, links = [], []
+    counters = [[0, 0, 0] for _ in range(users)]
+    for index in range(users * posts_per_user):
+        owner = index % users
+        published = rng.random() < 0.5
+        title = f"{prefix}_title_{index:08d}"
+        content = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(20, 60)))
+        post_rows.append((title, content, published, BASE_TIME - timedelta(seconds=index), owner))
+        counters[owner][0] += 1
+        counters[owner][1] += published
+        if image_rows and rng.random() < image_ratio:
+            image = rng.randrange(len(image_rows))
+            links.append((title, image))
+            counters[owner][2] += image_rows[image]["size"]
+    dataset.titles = [row[0] for row in post_rows]
+    refcounts = [0] * len(image_rows)
+    for _, image in links:
+        refcounts[image] += 1
+
+    async with get_engine().begin() as connection:
+        dataset.usernames = [f"{prefix}_user_{index:06d}" for index in range(users)]
+        await copy_records(
+                            connection,
+                            UserModel.__tablename__,
+                            ["username", "full_name", "email", "hashed_password", "is_active", "post_count", "published_post_count", "image_bytes"],
+                            [
+                                (username, f"Benchmark user {index}", f"{username}@example.com", hashed_password, True, *counters[index])
+                                for index, username in enumerate(dataset.usernames)])
+        user_ids = dict((await connection.execute(
+                                                    select(UserModel.username, UserModel.id)
+                                                    .where(UserModel.username.like(f"{prefix}\\_user\\_%")))).all())
+        await copy_records(
+                            connection,
+                            PostModel.__tablename__,
+                            ["title", "content", "published", "created_at", "created_by"],
+                            [(*row[:4], user_ids[dataset.usernames[row[4]]]) for row in post_rows])
+        await copy_records(
+                            connection,
+                            ImageModel.__tablename__,
+                            ["location", "filename", "size", "content_type", "sha256", "refcount"],
+                            [
+                                (image["location"], image["filename"], image["size"], image["content_type"], image["sha256"], refcounts[index])
+                                for index, image in enumerate(image_rows)])
+        if links:
+            post_ids = dict((await connection.execute(
+                                                        select(PostModel.title, PostModel.id)
+                                                        .where(PostModel.title.like(f"{prefix}\\_title\\_%")))).all())
+            image_ids = dict((await connection.execute(
+                                                        select(ImageModel.filename, ImageModel.id)
+                                                        .where(ImageModel.filename.in_(dataset.images)))).all())
+            await copy_records(
+                                connection,
+                                post_image.name,
+                                ["post_id", "image_id"],
+                                sorted({(post_ids[title], image_ids[dataset.images[image]]) for title, image in links}))
+        await connection.exec_driver_sql("ANALYZE")
+    return dataset
@@ -0,0 +1,112 @@
+import sys
+import time
+import random
+import asyncio
+import platform
+import subprocess
+from datetime import datetime, timezone
+import httpx
+from sqlalchemy import event
+from config.database import get_engine
+from app_blog.derivatives import derivatives
+from .generator import Dataset
+from .scenarios import SCENARIOS
+
+
+def percentile(values: list[float], percent: int) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class StatementCounter:
+
+    def __init__(self):
+        self.count = 0
+
+
+    def on_execute(self, connection, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+    def __enter__(self):
+        event.listen(get_engine().sync_engine, "after_cursor_execute", self.on_execute)
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        event.remove(get_engine().sync_engine, "after_cursor_execute", self.on_execute)
+
+
+async def run_requests(factories: list, concurrency: int) -> tuple[list, list, float]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(factory):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await factory()
+            return response.status_code, time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(timed(factory) for factory in factories))
+    elapsed = time.perf_counter() - start
+    return [status for status, _ in results], [latency for _, latency in results], elapsed
+
+
+async def run_scenario(
+                        cli: httpx.AsyncClient,
+                        name: str,
+                        dataset: Dataset,
+                        rng: random.Random,
+                        run: str,
+                        requests: int,
+                        concurrency: int) -> dict:
+    factories = SCENARIOS[name](cli, dataset, rng, run, requests)
+    with StatementCounter() as counter:
+        statuses, latencies, elapsed = await run_requests(factories, concurrency)
+        await derivatives.drain()
+    return {
+            "requests": requests,
+            "concurrency": concurrency,
+            "errors": sum(1 for status in statuses if status >= 400),
+            "statuses": {str(status): statuses.count(status) for status in sorted(set(statuses))},
+            "duration": elapsed,
+            "throughput": requests / elapsed,
+            "latency_ms": {
+                            "mean": sum(latencies) / len(latencies) * 1000,
+                            "p50": percentile(latencies, 50) * 1000,
+                            "p95": percentile(latencies, 95) * 1000,
+                            "p99": percentile(latencies, 99) * 1000},
+            "statements_per_request": counter.count / requests}
+
+
+async def run_benchmark(
+                        app,
+                        dataset: Dataset,
+                        scenarios: list[str],
+                        requests: int,
+                        concurrency: int,
+                        seed: int = 0,
+                        scale: dict = None) -> dict:
+    run = f"{time.time_ns():x}"
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as cli:
+        for index, name in enumerate(scenarios):
+            rng = random.Random(f"{seed}:{name}")
+            results[name] = await run_scenario(cli, name, dataset, rng, f"{run}{index}", requests, concurrency)
+    return {
+            "meta": {
+                        "commit": get_commit(),
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                        "python": sys.version.split()[0],
+                        "platform": platform.platform(),
+                        "seed": seed,
+                        "scale": scale or {}},
+            "scenarios": results}
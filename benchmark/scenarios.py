@@ -0,0 +1,92 @@
+import random
+from typing import Callable
+import httpx
+from app_blog.repository import AuthenticationRepository
+from .generator import Dataset, make_image
+
+
+UPLOAD_POOL_SIZE = 8
+UPLOAD_IMAGE_SIZE = (320, 240)
+
+
+def get_headers(username: str) -> dict:
+    token = AuthenticationRepository().create_token(data={"sub": username}, refresh=False)
+    return {"Authorization": f"Bearer {token}"}
+
+
+def scenario_register(cli: httpx.AsyncClient, dataset: Dataset, rng: random.Random, run: str, requests: int) -> list[Callable]:
+
+    def register(index: int):
+        username = f"{dataset.prefix}_new_{run}_{index}"
+        return lambda: cli.post(
+                                url="/admin/register/",
+                                json={
+                                        "username": username,
+                                        "full_name": f"Registered {index}",
+                                        "email": f"{username}@example.com",
+                                        "password": dataset.password,
+                                        "password_confirm": dataset.password})
+
+    return [register(index) for index in range(requests)]
+
+
+def scenario_login(cli: httpx.AsyncClient, dataset: Dataset, rng: random.Random, run: str, requests: int) -> list[Callable]:
+
+    def login(username: str):
+        return lambda: cli.post(
+                                url="/admin/login/",
+                                data={"username": username, "password": dataset.password})
+
+    return [login(rng.choice(dataset.usernames)) for _ in range(requests)]
+
+
+def scenario_create_post(cli: httpx.AsyncClient, dataset: Dataset, rng: random.Random, run: str, requests: int) -> list[Callable]:
+    uploads = [make_image(rng, UPLOAD_IMAGE_SIZE) for _ in range(UPLOAD_POOL_SIZE)]
+
+    def create_post(index: int, username: str, images: list[int]):
+        headers = get_headers(username)
+        return lambda: cli.post(
+                                url="/blog/create_post/",
+                                data={"title": f"{dataset.prefix}_{run}_created_{index}", "content": f"Created by {username}"},
+                                files=[("image", (f"upload_{image}.jpg", uploads[image], "image/jpeg")) for image in images],
+                                headers=headers)
+
+    return [
+            create_post(index, rng.choice(dataset.usernames), rng.sample(range(UPLOAD_POOL_SIZE), rng.randint(1, 2)))
+            for index in range(requests)]
+
+
+def scenario_find_post(cli: httpx.AsyncClient, dataset: Dataset, rng: random.Random, run: str, requests: int) -> list[Callable]:
+
+    def get_filter() -> dict:
+        username = rng.choice(dataset.usernames)
+        title = rng.choice(dataset.titles)
+        return rng.choice([
+                            {"username": username},
+                            {"username": username, "published": "true"},
+                            {"title__like": f"{title[:-2]}%"},
+                            {"title__like": f"{title[:-3]}%", "order_by": "title"},
+                            {"published": "false", "limit": 10}])
+
+    def find_post(params: dict, headers: dict):
+        return lambda: cli.get(url="/blog/find_post/", params=params, headers=headers)
+
+    headers = get_headers(dataset.usernames[0])
+    return [find_post(get_filter(), headers) for _ in range(requests)]
+
+
+def scenario_download_file(cli: httpx.AsyncClient, dataset: Dataset, rng: random.Random, run: str, requests: int) -> list[Callable]:
+
+    def download_file(file_name: str, headers: dict):
+        return lambda: cli.get(url=f"/blog/download_file/{file_name}/", headers=headers)
+
+    headers = get_headers(dataset.usernames[0])
+    return [download_file(rng.choice(dataset.images), headers) for _ in range(requests)]
+
+
+SCENARIOS = {
+                "register": scenario_register,
+                "login": scenario_login,
+                "create_post": scenario_create_post,
+                "find_post": scenario_find_post,
+                "download_file": scenario_download_file}
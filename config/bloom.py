@@ -0,0 +1,29 @@
+import hashlib
+import threading
+
+
+class BloomFilter:
+
+    def __init__(self, size: int, hashes: int):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray((size + 7) // 8)
+        self.lock = threading.Lock()
+
+
+    def get_positions(self, item: str) -> list[int]:
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+
+    def add(self, item: str) -> None:
+        positions = self.get_positions(item)
+        with self.lock:
+            for position in positions:
+                self.bits[position >> 3] |= 1 << (position & 7)
+
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.get_positions(item))
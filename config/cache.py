@@ -0,0 +1,153 @@
+import json
+import time
+import logging
+import threading
+import anyio
+from collections import OrderedDict
+from redis.exceptions import ConnectionError, RedisError
+from .settings import settings
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class MemoryCache:
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.counters = {}
+        self.lock = threading.Lock()
+
+
+    def get(self, key: str):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self.data[key]
+                return None
+            self.data.move_to_end(key)
+            return value
+
+
+    def set(self, key: str, value, ttl: int) -> None:
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + ttl)
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            self.data.pop(key, None)
+
+
+    def keys(self) -> list[str]:
+        now = time.monotonic()
+        with self.lock:
+            return [key for key, (_, expires_at) in self.data.items() if expires_at >= now]
+
+
+    def get_counters(self, keys: list[str]) -> list[int]:
+        with self.lock:
+            return [self.counters.get(key, 0) for key in keys]
+
+
+    def incr(self, key: str) -> int:
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+            self.counters.clear()
+
+
+class RedisCache:
+
+    def __init__(self, prefix: str):
+        self.client = None
+        self.retry_at = 0
+        self.prefix = prefix
+
+
+    @property
+    def redis(self):
+        if self.client is None:
+            if time.monotonic() < self.retry_at:
+                raise ConnectionError("Redis is not ready.")
+            try:
+                from .redis import get_redis
+                self.client = next(get_redis())
+            except RedisError:
+                self.retry_at = time.monotonic() + settings.REDIS_RETRY
+                raise
+        return self.client
+
+
+    def get(self, key: str):
+        try:
+            value = self.redis.get(f"{self.prefix}:{key}")
+        except RedisError as exception:
+            logger.warning(f"Cache read failed: {exception}")
+            return None
+        return json.loads(value) if value is not None else None
+
+
+    def set(self, key: str, value, ttl: int) -> None:
+        try:
+            self.redis.set(f"{self.prefix}:{key}", json.dumps(value), ex=max(int(ttl), 1))
+        except RedisError as exception:
+            logger.warning(f"Cache write failed: {exception}")
+
+
+    def delete(self, key: str) -> None:
+        try:
+            self.redis.delete(f"{self.prefix}:{key}")
+        except RedisError as exception:
+            logger.warning(f"Cache delete failed: {exception}")
+
+
+    def get_counters(self, keys: list[str]) -> list[int]:
+        try:
+            values = self.redis.mget([f"{self.prefix}:counter:{key}" for key in keys])
+        except RedisError as exception:
+            logger.warning(f"Cache read failed: {exception}")
+            return None
+        return [int(value or 0) for value in values]
+
+
+    def incr(self, key: str) -> int:
+        try:
+            return self.redis.incr(f"{self.prefix}:counter:{key}")
+        except RedisError as exception:
+            logger.warning(f"Cache write failed: {exception}")
+            return None
+
+
+    def clear(self) -> None:
+        try:
+            for key in self.redis.scan_iter(match=f"{self.prefix}:*"):
+                self.redis.delete(key)
+        except RedisError as exception:
+            logger.warning(f"Cache clear failed: {exception}")
+
+
+async def run_blocking(backend: str, function, *args):
+    if backend == "redis":
+        return await anyio.to_thread.run_sync(function, *args)
+    return function(*args)
+
+
+def get_cache(backend: str, prefix: str, maxsize: int):
+    if backend == "redis":
+        return RedisCache(prefix=prefix)
+    if backend == "memory":
+        return MemoryCache(maxsize=maxsize)
+    return None
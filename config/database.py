@@ -1,56 +1,203 @@
-import os
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, DeclarativeBase
-from sqlalchemy.exc import DatabaseError, SQLAlchemyError
-from dotenv import load_dotenv
+import inspect
+import logging
+import threading
+from typing import Callable
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine, AsyncSession
+from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.exc import DatabaseError, SQLAlchemyError, TimeoutError
+from .metrics import instrument_engine
 from .settings import settings
 from .util import Singleton
-from .redis import get_redis
 
 
-redis_session = next(get_redis())
+logger = logging.getLogger("uvicorn.error")
+
 
 class Base(DeclarativeBase):
     pass
 
 
-load_dotenv()
-url = os.getenv("DATABASE_URL", default=settings.DATABASE_URL_LOCAL)
+def get_async_url(db_url: str) -> str:
+    url = make_url(db_url)
+    if url.drivername in ("postgresql", "postgresql+psycopg2"):
+        url = url.set(drivername="postgresql+asyncpg")
+    return url.render_as_string(hide_password=False)
+
+
+class PoolMetrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+
+    def reset(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+
+
+    def register(self, engine: Engine):
+        event.listen(engine, "connect", self.on_connect)
+        event.listen(engine, "checkout", self.on_checkout)
+        event.listen(engine, "checkin", self.on_checkin)
+        event.listen(engine, "invalidate", self.on_invalidate)
+
+
+    def on_connect(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.connects += 1
+
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checkins += 1
+            self.checked_out = max(self.checked_out - 1, 0)
+
+
+    def on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self.lock:
+            self.invalidations += 1
+
+
+    def on_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
 
+    def snapshot(self, engine: Engine = None) -> dict:
+        with self.lock:
+            result = {
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "checked_out": self.checked_out,
+                "peak_checked_out": self.peak_checked_out}
+        if engine is not None:
+            pool = engine.pool
+            result.update({
+                "pool_size": pool.size(),
+                "max_overflow": settings.DB_MAX_OVERFLOW,
+                "checked_in": pool.checkedin(),
+                "overflow": pool.overflow()})
+        return result
 
-def get_engine(db_url: str = url):
-    cached_value = redis_session.get("db_url")
-    if cached_value is not None:
-        url = cached_value
-    else:
-        redis_session.set("db_url", db_url, ex=3600)
-        url = db_url
-    return create_engine(url=url, pool_pre_ping=True)
 
+class DatabaseEngineClass(metaclass=Singleton):
 
-def get_session():
-    session = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
-    return session()
+    def __init__(self):
+        self.engine = None
+        self.session_factory = None
+        self.metrics = PoolMetrics()
 
 
-class DatabaseSessionClass(metaclass=Singleton):
+    def init(self, db_url: str = None) -> AsyncEngine:
+        if self.engine is not None:
+            return self.engine
+        self.engine = create_async_engine(
+                                    url=get_async_url(db_url or settings.DATABASE_URL),
+                                    pool_pre_ping=settings.DB_POOL_PRE_PING,
+                                    pool_size=settings.DB_POOL_SIZE,
+                                    max_overflow=settings.DB_MAX_OVERFLOW,
+                                    pool_recycle=settings.DB_POOL_RECYCLE,
+                                    pool_timeout=settings.DB_POOL_TIMEOUT)
+        self.metrics.register(self.engine.sync_engine)
+        instrument_engine(self.engine.sync_engine)
+        self.session_factory = async_sessionmaker(
+                                    bind=self.engine,
+                                    autoflush=False,
+                                    expire_on_commit=False)
+        logger.info("Database engine has been created.")
+        return self.engine
 
-    def __enter__(self):
+
+    async def dispose(self) -> None:
+        if self.engine is not None:
+            await self.engine.dispose()
+            logger.info("Database engine has been disposed.")
+        self.engine = None
+        self.session_factory = None
+
+
+    def get_session(self) -> AsyncSession:
+        if self.session_factory is None:
+            self.init()
+        return self.session_factory()
+
+
+    def pool_status(self) -> dict:
+        return self.metrics.snapshot(self.engine.sync_engine if self.engine is not None else None)
+
+
+database = DatabaseEngineClass()
+
+
+def get_engine() -> AsyncEngine:
+    return database.init()
+
+
+def get_session() -> AsyncSession:
+    return database.get_session()
+
+
+def on_commit(db: AsyncSession, callback: Callable) -> None:
+    db.info.setdefault("on_commit", []).append(callback)
+
+
+def on_rollback(db: AsyncSession, callback: Callable) -> None:
+    db.info.setdefault("on_rollback", []).append(callback)
+
+
+class DatabaseSessionClass:
+
+    async def __aenter__(self) -> AsyncSession:
         self.db = get_session()
         return self.db
 
-    def __exit__(self, exc_type, exc_value: str, exc_traceback: str) -> None:
+    async def run_callbacks(self, name: str) -> None:
+        callbacks = self.db.info.pop(name, [])
+        self.db.info.pop("on_rollback" if name == "on_commit" else "on_commit", None)
+        for callback in callbacks:
+            result = callback()
+            if inspect.isawaitable(result):
+                await result
+
+    async def __aexit__(self, exc_type, exc_value: str, exc_traceback: str) -> None:
+        committed = False
         try:
-            if any([exc_type, exc_value, exc_traceback]):
-                raise
-            self.db.commit()
-        except (SQLAlchemyError, DatabaseError, Exception) as exception:
-            self.db.rollback()
+            if exc_type is None:
+                await self.db.commit()
+                committed = True
+                await self.run_callbacks("on_commit")
+            else:
+                if isinstance(exc_value, TimeoutError):
+                    database.metrics.on_timeout()
+                await self.db.rollback()
+        except (SQLAlchemyError, DatabaseError) as exception:
+            if not committed:
+                await self.db.rollback()
             raise exception
         finally:
-            self.db.close()
+            await self.db.close()
+            if not committed:
+                await self.run_callbacks("on_rollback")
 
 
-def get_db():
-    with DatabaseSessionClass() as db:
+async def get_db():
+    async with DatabaseSessionClass() as db:
         yield db
@@ -0,0 +1,150 @@
+import os
+import hmac
+import time
+import contextvars
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Match
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from .settings import settings
+
+
+STATEMENT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89, 144)
+REDIS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+request_duration = Histogram(
+                                "http_request_duration_seconds",
+                                "HTTP request latency by route.",
+                                ["method", "route", "status"])
+requests_in_flight = Gauge(
+                                "http_requests_in_flight",
+                                "HTTP requests being served by route.",
+                                ["method", "route"],
+                                multiprocess_mode="livesum")
+request_statements = Histogram(
+                                "http_request_db_statements",
+                                "Database statements executed per HTTP request.",
+                                ["method", "route"],
+                                buckets=STATEMENT_BUCKETS)
+request_db_duration = Histogram(
+                                "http_request_db_duration_seconds",
+                                "Time spent in database statements per HTTP request.",
+                                ["method", "route"])
+statements_total = Counter(
+                                "db_statements_total",
+                                "Database statements executed.")
+statement_duration = Histogram(
+                                "db_statement_duration_seconds",
+                                "Database statement latency.")
+redis_duration = Histogram(
+                                "redis_command_duration_seconds",
+                                "Redis command latency.",
+                                ["command"],
+                                buckets=REDIS_BUCKETS)
+
+
+class RequestStats:
+
+    def __init__(self):
+        self.statements = 0
+        self.db_duration = 0.0
+
+
+request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+def on_before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    context.query_start = time.perf_counter()
+
+
+def on_after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_start
+    statements_total.inc()
+    statement_duration.observe(elapsed)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_duration += elapsed
+
+
+def instrument_engine(engine: Engine) -> None:
+    event.listen(engine, "before_cursor_execute", on_before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", on_after_cursor_execute)
+
+
+def observe_redis(command: str, elapsed: float) -> None:
+    redis_duration.labels(command=command).observe(elapsed)
+
+
+def get_route(scope: dict) -> str:
+    partial = None
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or "unmatched"
+
+
+class MetricsMiddleware:
+
+    def __init__(self, app):
+        self.app = app
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method, route = scope["method"], get_route(scope)
+        response_status = 500
+
+        async def send_wrapper(message):
+            nonlocal response_status
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        in_flight = requests_in_flight.labels(method=method, route=route)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_duration.labels(method=method, route=route, status=response_status).observe(time.perf_counter() - start)
+            request_statements.labels(method=method, route=route).observe(stats.statements)
+            request_db_duration.labels(method=method, route=route).observe(stats.db_duration)
+            in_flight.dec()
+            request_stats.reset(token)
+
+
+def get_registry() -> CollectorRegistry:
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def mark_process_dead() -> None:
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def is_scraper(request: Request) -> bool:
+    if not settings.METRICS_TOKEN:
+        return True
+    return hmac.compare_digest(
+                                request.headers.get("authorization", "").encode("latin-1"),
+                                f"Bearer {settings.METRICS_TOKEN}".encode("latin-1"))
+
+
+def metrics_endpoint(request: Request) -> Response:
+    if not is_scraper(request):
+        return Response(status_code=401, headers={"WWW-Authenticate": "Bearer"})
+    return Response(content=generate_latest(get_registry()), media_type=CONTENT_TYPE_LATEST)
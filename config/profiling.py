@@ -0,0 +1,167 @@
+import os
+import hmac
+import json
+import time
+import uuid
+import random
+import logging
+import contextvars
+import anyio
+from datetime import datetime, timezone
+from pyinstrument import Profiler
+from redis.exceptions import RedisError
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from .settings import settings
+
+
+logger = logging.getLogger("uvicorn.error")
+PROFILE_HEADER = "x-profile"
+
+
+class RequestProfile:
+
+    def __init__(self):
+        self.statements = {}
+
+
+    def add(self, statement: str, elapsed: float) -> None:
+        count, total, slowest = self.statements.get(statement, (0, 0.0, 0.0))
+        self.statements[statement] = (count + 1, total + elapsed, max(slowest, elapsed))
+
+
+    def sql_report(self) -> dict:
+        statements = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+                "count": sum(count for count, _, _ in self.statements.values()),
+                "duration": sum(total for _, total, _ in self.statements.values()),
+                "statements": [
+                                {"statement": statement, "count": count, "duration": total, "slowest": slowest}
+                                for statement, (count, total, slowest) in statements]}
+
+
+request_profile = contextvars.ContextVar("request_profile", default=None)
+
+
+def on_before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if request_profile.get() is not None:
+        context.profile_start = time.perf_counter()
+
+
+def on_after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    profile = request_profile.get()
+    if profile is not None:
+        profile.add(statement, time.perf_counter() - context.profile_start)
+
+
+def profiling_enabled() -> bool:
+    return bool(settings.PROFILING_TOKEN) or settings.PROFILING_SAMPLE_RATE > 0
+
+
+class ProfileStore:
+
+    prefix = "profile"
+
+    def __init__(self):
+        self.redis = None
+
+
+    def save_directory(self, report_id: str, report: dict) -> None:
+        os.makedirs(settings.PROFILING_DIRECTORY, exist_ok=True)
+        with open(os.path.join(settings.PROFILING_DIRECTORY, f"{report_id}.json"), "w") as file:
+            json.dump(report, file)
+        with os.scandir(settings.PROFILING_DIRECTORY) as entries:
+            files = sorted(
+                            (entry for entry in entries if entry.name.endswith(".json")),
+                            key=lambda entry: entry.stat().st_mtime_ns,
+                            reverse=True)
+        for entry in files[settings.PROFILING_RETENTION:]:
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+    def save_redis(self, report_id: str, report: dict) -> None:
+        if self.redis is None:
+            from .redis import get_redis
+            self.redis = next(get_redis())
+        pipeline = self.redis.pipeline()
+        pipeline.set(f"{self.prefix}:{report_id}", json.dumps(report), ex=settings.PROFILING_TTL)
+        pipeline.lpush(f"{self.prefix}:index", report_id)
+        pipeline.lrange(f"{self.prefix}:index", settings.PROFILING_RETENTION, -1)
+        pipeline.ltrim(f"{self.prefix}:index", 0, settings.PROFILING_RETENTION - 1)
+        evicted = pipeline.execute()[2]
+        if evicted:
+            self.redis.delete(*(f"{self.prefix}:{item}" for item in evicted))
+
+
+    def save(self, report_id: str, report: dict) -> None:
+        try:
+            if settings.PROFILING_BACKEND == "redis":
+                self.save_redis(report_id, report)
+            else:
+                self.save_directory(report_id, report)
+        except (OSError, RedisError) as exception:
+            logger.warning(f"Profile {report_id} was not stored: {exception}")
+
+
+class ProfilingMiddleware:
+
+    listening = False
+
+    def __init__(self, app):
+        self.app = app
+        self.store = ProfileStore()
+        if not ProfilingMiddleware.listening:
+            event.listen(Engine, "before_cursor_execute", on_before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", on_after_cursor_execute)
+            ProfilingMiddleware.listening = True
+
+
+    def is_requested(self, scope: dict) -> bool:
+        for name, value in scope["headers"]:
+            if name.decode("latin-1") == PROFILE_HEADER:
+                return bool(settings.PROFILING_TOKEN) and hmac.compare_digest(
+                                                                                value,
+                                                                                settings.PROFILING_TOKEN.encode("latin-1"))
+        return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.is_requested(scope):
+            return await self.app(scope, receive, send)
+        report_id = uuid.uuid4().hex
+        response_status = 500
+
+        async def send_wrapper(message):
+            nonlocal response_status
+            if message["type"] == "http.response.start":
+                response_status = message["status"]
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", report_id.encode("latin-1"))]
+            await send(message)
+
+        profile = RequestProfile()
+        token = request_profile.set(profile)
+        profiler = Profiler(interval=settings.PROFILING_INTERVAL, async_mode="enabled")
+        started_at = datetime.now(timezone.utc)
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            session = profiler.stop()
+            duration = time.perf_counter() - start
+            request_profile.reset(token)
+            report = {
+                        "id": report_id,
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "query": scope["query_string"].decode("latin-1"),
+                        "status": response_status,
+                        "started_at": started_at.isoformat(),
+                        "duration": duration,
+                        "sql": profile.sql_report(),
+                        "profile": profiler.output_text(unicode=True, show_all=False)}
+            await anyio.to_thread.run_sync(self.store.save, report_id, report)
+            logger.info(f"Profile {report_id} of {scope["method"]} {scope["path"]} took {duration * 1000:.1f} ms ({session.sample_count} samples).")
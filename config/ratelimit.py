@@ -0,0 +1,66 @@
+import math
+import time
+import uuid
+import logging
+from redis.exceptions import RedisError
+
+
+logger = logging.getLogger("uvicorn.error")
+
+SLIDING_WINDOW_SCRIPT = """
+local now = tonumber(ARGV[1])
+local retry_after = 0
+for index, key in ipairs(KEYS) do
+    local limit = tonumber(ARGV[index * 2 + 1])
+    local window = tonumber(ARGV[index * 2 + 2])
+    redis.call("ZREMRANGEBYSCORE", key, "-inf", now - window)
+    if redis.call("ZCARD", key) >= limit then
+        local oldest = redis.call("ZRANGE", key, 0, 0, "WITHSCORES")
+        retry_after = math.max(retry_after, tonumber(oldest[2]) + window - now)
+    end
+end
+if retry_after > 0 then
+    return retry_after
+end
+for index, key in ipairs(KEYS) do
+    redis.call("ZADD", key, now, ARGV[2])
+    redis.call("PEXPIRE", key, ARGV[index * 2 + 2])
+end
+return 0
+"""
+
+
+class SlidingWindowLimiter:
+
+    def __init__(self, prefix: str, retry: int):
+        self.prefix = prefix
+        self.retry = retry
+        self.retry_at = 0
+        self.script = None
+
+
+    def get_script(self):
+        if self.script is None and time.monotonic() >= self.retry_at:
+            try:
+                from .redis import get_redis
+                self.script = next(get_redis()).register_script(SLIDING_WINDOW_SCRIPT)
+            except RedisError as exception:
+                self.retry_at = time.monotonic() + self.retry
+                logger.warning(f"Rate limiter is unavailable: {exception}")
+        return self.script
+
+
+    def hit(self, limits: dict[str, tuple[int, int]]) -> int:
+        script = self.get_script()
+        if script is None or not limits:
+            return 0
+        keys, args = [], [int(time.time() * 1000), uuid.uuid4().hex]
+        for key, (limit, window) in limits.items():
+            keys.append(f"{self.prefix}:{key}")
+            args.extend((limit, window * 1000))
+        try:
+            retry_after = script(keys=keys, args=args)
+        except RedisError as exception:
+            logger.warning(f"Rate limiter check failed: {exception}")
+            return 0
+        return math.ceil(int(retry_after) / 1000)
@@ -1,8 +1,12 @@
 import os
+import time
 import redis
-from redis.exceptions import ConnectionError
+from redis.client import Pipeline
+from redis.exceptions import ConnectionError, TimeoutError
 from typing import Generator
 from dotenv import load_dotenv
+from .metrics import observe_redis
+from .settings import settings
 
 
 load_dotenv()
@@ -11,17 +15,43 @@ host_redis = os.getenv("REDIS_HOST", default="localhost")
 port_redis = os.getenv("REDIS_PORT", default=6379)
 
 
+class InstrumentedPipeline(Pipeline):
+
+    def execute(self, raise_on_error=True):
+        start = time.perf_counter()
+        try:
+            return super().execute(raise_on_error=raise_on_error)
+        finally:
+            observe_redis("PIPELINE", time.perf_counter() - start)
+
+
+class InstrumentedRedis(redis.Redis):
+
+    def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        try:
+            return super().execute_command(*args, **options)
+        finally:
+            observe_redis(str(args[0]).upper(), time.perf_counter() - start)
+
+
+    def pipeline(self, transaction=True, shard_hint=None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
 class RedisSupport:
 
-    def __init__(self):
+    def __init__(self, connection_pool: redis.ConnectionPool = None):
         try:
-            redis_pool = redis.ConnectionPool(
+            redis_pool = connection_pool or redis.ConnectionPool(
                                                 host=host_redis,
                                                 port=port_redis,
+                                                socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+                                                socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT,
                                                 decode_responses=True)
-            self._redis = redis.Redis(connection_pool=redis_pool)
+            self._redis = InstrumentedRedis(connection_pool=redis_pool)
             self._redis.ping()
-        except ConnectionError:
+        except (ConnectionError, TimeoutError):
             raise ConnectionError("Redis is not ready.")
 
 
@@ -29,8 +59,11 @@ class RedisSupport:
         return self._redis
 
 
-instance = RedisSupport()
+instance = None
 
 def get_redis() -> Generator:
+    global instance
+    if instance is None:
+        instance = RedisSupport()
     session = instance.init()
     yield session
@@ -1,13 +1,15 @@
 import logging
 from config.database import Base, get_engine
+from config.settings import settings
 from app_blog import controlers as blog_controlers
 
 
 logger = logging.getLogger("uvicorn.error")
 
 
-def init_models():
-    Base.metadata.create_all(bind=get_engine())
+async def init_models():
+    async with get_engine().begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
     logger.info("Tables has been created.")
 
 
@@ -20,4 +22,9 @@ def init_routers(application):
                                 router=blog_controlers.router_blog,
                                 prefix="/blog",
                                 tags=["Blog"])
+    if settings.MEDIA_ACCEL_REDIRECT:
+        application.include_router(
+                                    router=blog_controlers.router_media,
+                                    prefix=settings.MEDIA_URL,
+                                    tags=["Media"])
     logger.info("Routes has been loaded.")
@@ -16,11 +16,73 @@ class Settings(BaseSettings):
     REFRESH_SECRET_KEY: str = str(os.getenv("REFRESH_SECRET_KEY"))
     ALGORITHM: str = str(os.getenv("ALGORITHM"))
     DATABASE_URL_LOCAL: str = str(os.getenv("DATABASE_URL_LOCAL"))
+    DATABASE_URL: str = str(os.getenv("DATABASE_URL", default=os.getenv("DATABASE_URL_LOCAL")))
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_TIMEOUT: int = 30
+    DB_POOL_PRE_PING: bool = True
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 120
     REFRESH_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7
     MEDIA_ROOT: str = str(os.getenv("MEDIA_ROOT"))
     MEDIA_URL: str = str(os.getenv("MEDIA_URL"))
     MAX_FILE_SIZE: int = 1024 * 1024
+    UPLOAD_CHUNK_SIZE: int = 64 * 1024
+    MEDIA_SHARD_DEPTH: int = 2
+    DOWNLOAD_CHUNK_SIZE: int = 64 * 1024
+    DOWNLOAD_MAX_RANGES: int = 16
+    DOWNLOAD_CACHE_CONTROL: str = "private, max-age=31536000, immutable"
+    MEDIA_ACCEL_REDIRECT: bool = False
+    MEDIA_ACCEL_LOCATION: str = "/protected-media"
+    DERIVATIVE_SIZES: dict[str, int] = {"thumbnail": 256, "medium": 1024}
+    DERIVATIVE_QUALITY: int = 80
+    DERIVATIVE_POOL_SIZE: int = 2
+    DERIVATIVE_QUEUE_SIZE: int = 64
+    BCRYPT_ROUNDS: int = 12
+    WORKER_POOL_KIND: str = "thread"
+    WORKER_POOL_SIZE: int = 4
+    WORKER_QUEUE_SIZE: int = 32
+    PAGE_SIZE_DEFAULT: int = 50
+    PAGE_SIZE_MAX: int = 200
+    IMPORT_BATCH_SIZE: int = 10000
+    IMPORT_MAX_ERRORS: int = 1000
+    EXPORT_BATCH_SIZE: int = 1000
+    SEARCH_LANGUAGE: str = "english"
+    SEARCH_HEADLINE_OPTIONS: str = "StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15, MaxFragments=2"
+    PRINCIPAL_CACHE_BACKEND: str = "redis"
+    PRINCIPAL_CACHE_TTL: int = 30
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    TOKEN_CACHE_SIZE: int = 10000
+    TOKEN_CACHE_TTL: int = 300
+    TOKEN_REVOCATION_BACKEND: str = "redis"
+    TOKEN_REVOCATION_BLOOM_SIZE: int = 1 << 20
+    TOKEN_REVOCATION_BLOOM_HASHES: int = 7
+    TOKEN_REVOCATION_LOCAL_SIZE: int = 10000
+    TOKEN_REVOCATION_LOG_SIZE: int = 100000
+    TOKEN_REVOCATION_SYNC_INTERVAL: float = 1.0
+    TOKEN_REVOCATION_REBUILD_INTERVAL: int = 3600
+    TOKEN_REVOCATION_RETRY: int = 30
+    REDIS_SOCKET_TIMEOUT: float = 0.5
+    REDIS_CONNECT_TIMEOUT: float = 0.5
+    REDIS_RETRY: int = 30
+    METRICS_ENABLED: bool = True
+    METRICS_TOKEN: str = str(os.getenv("METRICS_TOKEN", default=""))
+    PROFILING_TOKEN: str = ""
+    PROFILING_SAMPLE_RATE: float = 0.0
+    PROFILING_INTERVAL: float = 0.001
+    PROFILING_BACKEND: str = "directory"
+    PROFILING_DIRECTORY: str = "profiles"
+    PROFILING_RETENTION: int = 100
+    PROFILING_TTL: int = 60 * 60 * 24
+    RATE_LIMIT_BACKEND: str = "redis"
+    RATE_LIMIT_RETRY: int = 30
+    RATE_LIMIT_TRUSTED_PROXIES: list[str] = []
+    RATE_LIMITS: dict[str, dict[str, tuple[int, int]]] = {
+                                                            "login": {"ip": (20, 60), "username": (5, 60)},
+                                                            "register": {"ip": (5, 60), "username": (5, 60)}}
+    POST_CACHE_BACKEND: str = "redis"
+    POST_CACHE_TTL: int = 60
+    POST_CACHE_SIZE: int = 10000
 
 
 @lru_cache(maxsize=None, typed=False)
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable
+from .settings import settings
+from .util import Singleton
+
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class WorkerPoolSaturatedError(Exception):
+    pass
+
+
+class WorkerPoolClass(metaclass=Singleton):
+
+    def __init__(self):
+        self.executor: Executor = None
+        self.max_workers = 0
+        self.capacity = 0
+        self.in_flight = 0
+        self.slots: asyncio.Semaphore = None
+
+
+    def init(self, max_workers: int = None, queue_size: int = None, kind: str = None) -> None:
+        if self.executor is not None:
+            return
+        self.max_workers = settings.WORKER_POOL_SIZE if max_workers is None else max_workers
+        queue_size = settings.WORKER_QUEUE_SIZE if queue_size is None else queue_size
+        kind = kind or settings.WORKER_POOL_KIND
+        self.capacity = self.max_workers + queue_size
+        self.slots = asyncio.Semaphore(self.capacity)
+        if self.max_workers > 0:
+            if kind == "process":
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="worker")
+            logger.info(f"Worker pool ({kind}) has been started with {self.max_workers} workers.")
+
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            logger.info("Worker pool has been stopped.")
+        self.executor = None
+        self.in_flight = 0
+
+
+    async def run(self, function: Callable, *args, wait: bool = False):
+        if self.executor is None:
+            return function(*args)
+        if not wait and self.slots.locked():
+            raise WorkerPoolSaturatedError
+        async with self.slots:
+            self.in_flight += 1
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+            finally:
+                self.in_flight -= 1
+
+
+class DerivativePoolClass(WorkerPoolClass):
+    pass
+
+
+workers = WorkerPoolClass()
+derivative_workers = DerivativePoolClass()
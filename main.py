@@ -1,14 +1,30 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from config import registry
+from config.database import database
+from config.metrics import MetricsMiddleware, mark_process_dead, metrics_endpoint
+from config.profiling import ProfilingMiddleware, profiling_enabled
+from config.workers import workers, derivative_workers
 from config.settings import settings
+from app_blog.derivatives import derivatives
 
 
-def lifespan(app: FastAPI):
-    registry.init_models()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    database.init()
+    workers.init()
+    derivative_workers.init(max_workers=settings.DERIVATIVE_POOL_SIZE, queue_size=settings.DERIVATIVE_QUEUE_SIZE)
+    await registry.init_models()
     registry.init_routers(app)
-    app.mount(settings.MEDIA_URL, StaticFiles(directory=settings.MEDIA_ROOT))
+    if not settings.MEDIA_ACCEL_REDIRECT:
+        app.mount(settings.MEDIA_URL, StaticFiles(directory=settings.MEDIA_ROOT))
     yield
+    await derivatives.drain()
+    derivative_workers.shutdown()
+    workers.shutdown()
+    await database.dispose()
+    mark_process_dead()
 
 
 app = FastAPI(
@@ -20,3 +36,9 @@ app = FastAPI(
                 contact={
                             "name": "Piotr",
                             "email": "pkrecz@poczta.onet.pl"})
+
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+if settings.METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
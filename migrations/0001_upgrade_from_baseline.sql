@@ -0,0 +1,70 @@
+-- Upgrades a database created by the baseline models to the current schema.
+-- New installations get the same schema from Base.metadata.create_all on startup.
+-- Run once with psql -v ON_ERROR_STOP=1 -f migrations/0001_upgrade_from_baseline.sql, with the API stopped,
+-- then move the existing media files into shard directories as described in README.md.
+
+BEGIN;
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Per-user counters (post_count, published_post_count, image_bytes).
+ALTER TABLE "user"
+    ADD COLUMN IF NOT EXISTS post_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS published_post_count INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS image_bytes BIGINT NOT NULL DEFAULT 0;
+
+-- Full-text search column, SEARCH_LANGUAGE is 'english' by default.
+ALTER TABLE post
+    ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(content, '')), 'B')) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_post_search_vector ON post USING gin (search_vector);
+CREATE INDEX IF NOT EXISTS idx_post_title_trgm ON post USING gin (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_user_username_trgm ON "user" USING gin (username gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_post_created_at_id ON post USING btree (created_at, id);
+CREATE INDEX IF NOT EXISTS idx_post_created_by_created_at_id ON post USING btree (created_by, created_at, id);
+
+-- Content-addressed images shared between posts through post_image.
+CREATE TABLE IF NOT EXISTS post_image (
+    post_id INTEGER NOT NULL REFERENCES post (id) ON DELETE CASCADE,
+    image_id INTEGER NOT NULL REFERENCES image (id),
+    PRIMARY KEY (post_id, image_id));
+
+CREATE INDEX IF NOT EXISTS idx_post_image_image_id ON post_image USING btree (image_id);
+
+ALTER TABLE image
+    ADD COLUMN IF NOT EXISTS sha256 VARCHAR(64),
+    ADD COLUMN IF NOT EXISTS refcount INTEGER NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS derivatives_ready BOOLEAN NOT NULL DEFAULT false;
+
+INSERT INTO post_image (post_id, image_id)
+SELECT post_id, id FROM image WHERE post_id IS NOT NULL
+ON CONFLICT DO NOTHING;
+
+-- Baseline files are named by a random UUID, not by content, so their stem stands in for the digest
+-- and they are never deduplicated against new uploads.
+UPDATE image SET
+    sha256 = coalesce(sha256, split_part(filename, '.', 1)),
+    refcount = (SELECT count(*) FROM post_image WHERE post_image.image_id = image.id),
+    location = regexp_replace(location, '[^/]+$', concat_ws('/', substr(filename, 1, 2), substr(filename, 3, 2), filename));
+
+ALTER TABLE image
+    ALTER COLUMN sha256 SET NOT NULL,
+    DROP CONSTRAINT IF EXISTS image_location_key,
+    DROP COLUMN IF EXISTS post_id,
+    ADD CONSTRAINT image_filename_key UNIQUE (filename);
+
+CREATE INDEX IF NOT EXISTS idx_image_sha256 ON image USING btree (sha256);
+
+UPDATE "user" SET
+    post_count = (SELECT count(*) FROM post WHERE post.created_by = "user".id),
+    published_post_count = (SELECT count(*) FROM post WHERE post.created_by = "user".id AND post.published),
+    image_bytes = (
+        SELECT coalesce(sum(image.size), 0)
+        FROM post
+        JOIN post_image ON post_image.post_id = post.id
+        JOIN image ON image.id = post_image.image_id
+        WHERE post.created_by = "user".id);
+
+COMMIT;
@@ -1,21 +1,38 @@
 import pytest
 import logging
+import fakeredis
+import redis
 from collections.abc import Generator
+from contextlib import contextmanager
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
-from config.database import get_db, Base
+from sqlalchemy import create_engine, event
+from config import redis as redis_support
+from config.database import Base, database
+from config.settings import settings
 from testcontainers.postgres import PostgresContainer
 from main import app
 
 
+@pytest.fixture(scope="session", autouse=True)
+def redis_server() -> Generator:
+
+    redis_support.instance = redis_support.RedisSupport(connection_pool=redis.ConnectionPool(
+                                                                connection_class=fakeredis.FakeConnection,
+                                                                server=fakeredis.FakeServer(),
+                                                                decode_responses=True))
+    logging.info("Configuration -----> Fake Redis server is ready.")
+    yield redis_support.instance.init()
+    redis_support.instance = None
+
+
 @pytest.fixture(scope="session")
 def sync_engine() -> Generator:
 
     container = PostgresContainer("postgres:17.0-bookworm", driver="psycopg2")
     container.start()
+    settings.DATABASE_URL = container.get_connection_url()
 
-    engine = create_engine(url=container.get_connection_url())
+    engine = create_engine(url=settings.DATABASE_URL)
 
     with engine.begin() as _engine:
         Base.metadata.drop_all(bind=_engine)
@@ -32,41 +49,49 @@ def sync_engine() -> Generator:
 
 
 @pytest.fixture(scope="session")
-def sync_session(sync_engine) -> Generator:
-
-    connection = sync_engine.connect()
-    logging.info("Configuration -----> Connection established.")
-    transaction = connection.begin()
-    logging.info("Configuration -----> Transaction started.")
-    session = sessionmaker(
-                            autocommit=False,
-                            autoflush=False,
-                            expire_on_commit=False,
-                            bind=connection)()
-    logging.info("Configuration -----> Session ready for running.")
-    yield session
-    session.close()
-    logging.info("Configuration -----> Session closed.")
-    transaction.rollback()
-    logging.info("Configuration -----> Rollback executed.")
-    connection.close()
-    logging.info("Configuration -----> Connection closed.")
-
-
-@pytest.fixture(scope="session")
-def client(sync_session: Session) -> Generator[TestClient, None, None]:
+def client(sync_engine) -> Generator[TestClient, None, None]:
 
-    def override_get_db():
-        yield sync_session
-
-    app.dependency_overrides[get_db] = override_get_db
-    logging.info("Configuration -----> Dependency overrided.")
+    settings.RATE_LIMIT_BACKEND = None
     with TestClient(app) as cli:
         logging.info("Configuration -----> Client ready for running.")
         yield cli
         logging.info("Configuration -----> Client finished job.")
 
 
+class StatementCounter:
+
+    def __init__(self):
+        self.statements = []
+
+    def __enter__(self):
+        event.listen(database.engine.sync_engine, "before_cursor_execute", self.count)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback) -> None:
+        event.remove(database.engine.sync_engine, "before_cursor_execute", self.count)
+
+    def count(self, conn, cursor, statement, parameters, context, executemany) -> None:
+        self.statements.append(statement)
+
+
+@pytest.fixture()
+def statement_counter(client: TestClient) -> type[StatementCounter]:
+    return StatementCounter
+
+
+@pytest.fixture()
+def query_budget(client: TestClient):
+
+    @contextmanager
+    def budget(limit: int) -> Generator[StatementCounter, None, None]:
+        with StatementCounter() as counter:
+            yield counter
+        statements = "\n".join(counter.statements)
+        assert len(counter.statements) <= limit, f"{len(counter.statements)} statements over budget {limit}:\n{statements}"
+
+    return budget
+
+
 @pytest.fixture()
 def data_test_register_user():
     return {
@@ -1,6 +1,32 @@
 import os
+import csv
+import uuid
+import json
+import asyncio
+import time
+import hashlib
 import logging
+import httpx
+from fastapi import FastAPI
+from io import BytesIO, TextIOWrapper
+from PIL import Image
+from sqlalchemy import delete, func, insert, select, update
+from config import registry
+from config.database import DatabaseSessionClass
+from config.workers import WorkerPoolClass, WorkerPoolSaturatedError
+from redis.exceptions import ConnectionError, TimeoutError
+from prometheus_client.parser import text_string_to_metric_families
 from config.settings import settings
+from config import redis as redis_support
+from config.cache import RedisCache
+from app_blog import exceptions
+from app_blog.cache import PrincipalCache, post_cache
+from app_blog.dependency import rate_limiter
+from app_blog.derivatives import derivatives, generate_derivatives_blocking
+from app_blog.models import ImageModel, UserModel
+from app_blog.repository import get_media_path, get_media_shards
+from app_blog.revocation import TokenRevocation
+from app_blog.service import media
 
 list_of_files_to_be_deleted = []
 
@@ -78,6 +104,61 @@ def sub_test_refresh(client):
     os.environ["BEARER_TOKEN"] = response_json["access_token"]
 
 
+def sub_test_pool_status(client):
+    response = client.get(
+                                url="/admin/pool_status/",
+                                headers={"Authorization": f"Bearer {os.environ["BEARER_TOKEN"]}"})
+    response_json = response.json()
+    logging.info("Pool status testing ...")
+    assert response.status_code == 200
+    assert response_json["pool_size"] == settings.DB_POOL_SIZE
+    assert response_json["checkouts"] >= response_json["checkins"]
+    assert response_json["peak_checked_out"] <= settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW
+    logging.info("Pool status testing finished.")
+
+
+def sub_test_metrics(client):
+    response = client.get(url="/metrics")
+    logging.info("Metrics testing ...")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    samples = {
+                (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+                for family in text_string_to_metric_families(response.text)
+                for sample in family.samples}
+    route = (("method", "GET"), ("route", "/admin/pool_status/"))
+    assert samples[("http_request_duration_seconds_count", (*route, ("status", "200")))] >= 1
+    assert samples[("http_request_db_statements_count", route)] >= 1
+    assert samples[("http_requests_in_flight", route)] == 0
+    assert samples[("http_request_db_statements_sum", (("method", "PUT"), ("route", "/admin/update/")))] >= 2
+    assert samples[("db_statements_total", ())] > 0
+    settings.METRICS_TOKEN = "metrics-token"
+    try:
+        assert client.get(url="/metrics").status_code == 401
+        assert client.get(url="/metrics", headers={"Authorization": "Bearer wrong-token"}).status_code == 401
+        assert client.get(url="/metrics", headers={"Authorization": "Bearer metrics-token"}).status_code == 200
+    finally:
+        settings.METRICS_TOKEN = ""
+    logging.info("Metrics testing finished.")
+
+
+def sub_test_logout(client):
+    response = client.post(
+                                url="/admin/logout/",
+                                headers={"Authorization": f"Bearer {os.environ["BEARER_TOKEN"]}"})
+    logging.info("Logout testing ...")
+    assert response.status_code == 200
+    response = client.get(
+                                url="/admin/pool_status/",
+                                headers={"Authorization": f"Bearer {os.environ["BEARER_TOKEN"]}"})
+    assert response.status_code == 401
+    response = client.post(
+                                url="/admin/refresh/",
+                                headers={"Authorization": f"Bearer {os.environ["REFRESH_TOKEN"]}"})
+    assert response.status_code == 401
+    logging.info("Logout testing finished.")
+
+
 def sub_test_create_post_no_file(
                                 client,
                                 data_test_create_post_no_file):
@@ -181,6 +262,32 @@ def sub_test_find_post_negative(
     logging.info("Find post negative testing finished.")
 
 
+def sub_test_user_stats(client, post_count: int, published_post_count: int, image_bytes: int):
+    response = client.get(
+                                url="/admin/me/stats/",
+                                headers={"Authorization": f"Bearer {os.environ["BEARER_TOKEN"]}"})
+    response_json = response.json()
+    logging.info("User stats testing ...")
+    assert response.status_code == 200
+    assert response_json["post_count"] == post_count
+    assert response_json["published_post_count"] == published_post_count
+    assert response_json["image_bytes"] == image_bytes
+    logging.info("User stats testing finished.")
+
+
+def sub_test_search_post(client):
+    response = client.get(
+                                url="/blog/search/?q=update",
+                                headers={"Authorization": f"Bearer {os.environ["BEARER_TOKEN"]}"})
+    response_json = response.json()
+    logging.info("Search post testing ...")
+    assert response.status_code == 200
+    assert response_json[0]["id"] == int(os.environ["POST_ID"])
+    assert response_json[0]["rank"] > 0
+    assert "<mark>" in response_json[0]["headline"]
+    logging.info("Search post testing finished.")
+
+
 def sub_test_delete_post(client):
     post_id = os.environ["POST_ID"]
     response = client.delete(
@@ -218,7 +325,7 @@ def sub_test_download_file(client):
 def sub_test_delete_media_files():
     logging.info("Deletion media files testing ...")
     for file in list_of_files_to_be_deleted:
-        file_path = os.path.join(settings.MEDIA_ROOT, file)
+        file_path = get_media_path(file)
         assert os.path.exists(file_path) == True
         if os.path.exists(file_path):
             os.remove(file_path)
@@ -238,6 +345,8 @@ def test_user(
     sub_test_update_user(client, data_test_update_user)
     sub_test_change_password(client, data_test_change_password)
     sub_test_refresh(client)
+    sub_test_pool_status(client)
+    sub_test_metrics(client)
     logging.info("STOP - testing user")
 
 
@@ -253,11 +362,14 @@ def test_blog(
     logging.info("START - testing blog")
     sub_test_create_post_no_file(client, data_test_create_post_no_file)
     sub_test_update_post(client,data_test_update_post)
+    sub_test_user_stats(client, post_count=1, published_post_count=1, image_bytes=0)
     sub_test_show_my_posts_positive(client, data_test_filter_show_post_positive)
     sub_test_show_my_posts_negative(client, data_test_filter_show_post_negative)
     sub_test_find_post_positive(client, data_test_filter_find_post_positive)
     sub_test_find_post_negative(client, data_test_filter_find_post_negative)
+    sub_test_search_post(client)
     sub_test_delete_post(client)
+    sub_test_user_stats(client, post_count=0, published_post_count=0, image_bytes=0)
     sub_test_delete_user(client)
     logging.info("STOP - testing blog")
 
@@ -273,6 +385,648 @@ def test_file_operation(
     sub_test_register_user(client, data_test_register_user)
     sub_test_login(client, data_test_login)
     sub_test_create_post_with_files(client, data_test_create_post_with_files, data_test_post_files)
+    sub_test_user_stats(
+                        client,
+                        post_count=1,
+                        published_post_count=0,
+                        image_bytes=sum(os.path.getsize(get_media_path(file)) for file in list_of_files_to_be_deleted))
     sub_test_download_file(client)
     sub_test_delete_media_files()
+    sub_test_logout(client)
     logging.info("STOP - testing file operation")
+
+
+async def login_from(app, address: str, username: str, forwarded_for: str = None) -> httpx.Response:
+    transport = httpx.ASGITransport(app=app, client=(address, 50000))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as cli:
+        return await cli.post(
+                                url="/admin/login/",
+                                data={"username": username, "password": "!ws@wrong_password"},
+                                headers={"X-Forwarded-For": forwarded_for} if forwarded_for else {})
+
+
+def sub_test_rate_limit_username(client):
+    logging.info("Rate limit per username testing ...")
+    statuses = [client.portal.call(login_from, client.app, "10.1.0.1", "limited").status_code for _ in range(3)]
+    assert statuses == [401, 401, 429]
+    response = client.portal.call(login_from, client.app, "10.1.0.2", "limited")
+    assert response.status_code == 429
+    assert 0 < int(response.headers["Retry-After"]) <= 60
+    logging.info("Rate limit per username testing finished.")
+
+
+def sub_test_rate_limit_ip(client):
+    logging.info("Rate limit per IP testing ...")
+    statuses = [client.portal.call(login_from, client.app, "10.2.0.1", f"ip_{index}").status_code for index in range(4)]
+    assert statuses == [401, 401, 401, 429]
+    response = client.portal.call(login_from, client.app, "10.2.0.1", "ip_spoofed", "10.9.9.9")
+    assert response.status_code == 429
+    logging.info("Rate limit per IP testing finished.")
+
+
+def sub_test_rate_limit_trusted_proxy(client):
+    logging.info("Rate limit behind trusted proxy testing ...")
+    statuses = [
+                client.portal.call(login_from, client.app, "172.20.0.5", f"proxied_{index}", f"10.9.9.9, 10.3.0.{index % 2}").status_code
+                for index in range(8)]
+    assert statuses == [401] * 6 + [429] * 2
+    logging.info("Rate limit behind trusted proxy testing finished.")
+
+
+def sub_test_rate_limit_fail_open(client, monkeypatch):
+    logging.info("Rate limit fail open testing ...")
+
+    def unavailable(keys, args):
+        raise TimeoutError("Timeout reading from socket")
+
+    monkeypatch.setattr(rate_limiter, "script", unavailable)
+    statuses = [client.portal.call(login_from, client.app, "10.4.0.1", "fail_open").status_code for _ in range(4)]
+    assert statuses == [401] * 4
+    logging.info("Rate limit fail open testing finished.")
+
+
+def test_rate_limit(client, monkeypatch):
+
+    logging.info("START - testing rate limit")
+    monkeypatch.setattr(settings, "RATE_LIMIT_BACKEND", "redis")
+    monkeypatch.setattr(settings, "RATE_LIMIT_TRUSTED_PROXIES", ["172.16.0.0/12"])
+    monkeypatch.setitem(settings.RATE_LIMITS, "login", {"ip": (3, 60), "username": (2, 60)})
+    sub_test_rate_limit_username(client)
+    sub_test_rate_limit_ip(client)
+    sub_test_rate_limit_trusted_proxy(client)
+    sub_test_rate_limit_fail_open(client, monkeypatch)
+    logging.info("STOP - testing rate limit")
+
+
+def make_image(color: tuple[int, int, int]) -> bytes:
+    buffer = BytesIO()
+    Image.new("RGB", (64, 48), color).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def register_and_login(client, username: str) -> dict:
+    password = f"!ws@{username}_password"
+    response = client.post(
+                                url="/admin/register/",
+                                json={
+                                        "username": username,
+                                        "full_name": username,
+                                        "email": f"{username}@example.com",
+                                        "password": password,
+                                        "password_confirm": password})
+    assert response.status_code == 201
+    response = client.post(url="/admin/login/", data={"username": username, "password": password})
+    return {"Authorization": f"Bearer {response.json()["access_token"]}"}
+
+
+def sub_test_post_cache_hit(client, headers: dict, url: str):
+    logging.info("Post cache hit testing ...")
+    assert isinstance(post_cache.get_backend(), RedisCache)
+    hits = client.get(url="/admin/cache_status/", headers=headers).json()["hits"]
+    first = client.get(url=url, headers=headers)
+    second = client.get(url=url, headers=headers)
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert client.get(url="/admin/cache_status/", headers=headers).json()["hits"] == hits + 1
+    logging.info("Post cache hit testing finished.")
+
+
+def sub_test_post_cache_update(client, headers: dict, url: str, post_id: int):
+    logging.info("Post cache update testing ...")
+    response = client.put(url=f"/blog/update_post/{post_id}/", json={"content": "cached_content_updated"}, headers=headers)
+    assert response.status_code == 200
+    assert client.get(url=url, headers=headers).json()["items"][0]["content"] == "cached_content_updated"
+    logging.info("Post cache update testing finished.")
+
+
+def sub_test_post_cache_derivatives(client, sync_engine, headers: dict, url: str, post_id: int, file_name: str):
+    logging.info("Post cache derivatives testing ...")
+    with sync_engine.begin() as connection:
+        connection.execute(update(ImageModel).where(ImageModel.filename == file_name).values(derivatives_ready=False))
+    response = client.put(url=f"/blog/update_post/{post_id}/", json={"published": True}, headers=headers)
+    assert response.status_code == 200
+    assert client.get(url=url, headers=headers).json()["items"][0]["images"][0]["derivatives"] == {}
+    client.portal.call(derivatives.process, [file_name])
+    assert client.get(url=url, headers=headers).json()["items"][0]["images"][0]["derivatives"] != {}
+    logging.info("Post cache derivatives testing finished.")
+
+
+def test_post_cache(client, sync_engine):
+
+    logging.info("START - testing post cache")
+    headers = register_and_login(client, "cache_owner")
+    response = client.post(
+                                url="/blog/create_post/",
+                                data={"title": "cached_title", "content": "cached_content"},
+                                files=[("image", ("cached.jpg", make_image((12, 34, 56)), "image/jpeg"))],
+                                headers=headers)
+    assert response.status_code == 201
+    post_id, file_name = response.json()["id"], response.json()["images"][0]["filename"]
+    client.portal.call(derivatives.drain)
+
+    url = "/blog/find_post/?username=cache_owner&title__like=cached_"
+    sub_test_post_cache_hit(client, headers, url)
+    sub_test_post_cache_update(client, headers, url, post_id)
+    sub_test_post_cache_derivatives(client, sync_engine, headers, url, post_id, file_name)
+    assert client.delete(url=f"/blog/delete_post/{post_id}/", headers=headers).status_code == 200
+    assert not os.path.exists(get_media_path(file_name))
+    assert client.delete(url="/admin/delete/", headers=headers).status_code == 200
+    logging.info("STOP - testing post cache")
+
+
+async def create_post(cli: httpx.AsyncClient, headers: dict, title: str, files: list) -> httpx.Response:
+    return await cli.post(
+                            url="/blog/create_post/",
+                            data={"title": title, "content": "media_content"},
+                            files=[("image", (file_name, content, "image/jpeg")) for file_name, content in files],
+                            headers=headers)
+
+
+async def race_delete_and_upload(app, headers: dict, payload: bytes, rounds: int) -> list[str]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as cli:
+        file_names = []
+        for index in range(rounds):
+            response = await create_post(cli, headers, f"media_race_old_{index}", [("race.jpg", payload)])
+            assert response.status_code == 201
+            deleted, created = await asyncio.gather(
+                                                    cli.delete(url=f"/blog/delete_post/{response.json()["id"]}/", headers=headers),
+                                                    create_post(cli, headers, f"media_race_new_{index}", [("race.jpg", payload)]))
+            assert deleted.status_code == 200 and created.status_code == 201
+            file_name = created.json()["images"][0]["filename"]
+            assert os.path.exists(get_media_path(file_name))
+            file_names.append(file_name)
+            response = await cli.delete(url=f"/blog/delete_post/{created.json()["id"]}/", headers=headers)
+            assert response.status_code == 200
+        return file_names
+
+
+async def collect_during_upload(file_name: str) -> tuple[bool, bool]:
+    async with DatabaseSessionClass() as db:
+        await media.lock_blobs(db, [file_name])
+        collector = asyncio.create_task(media.collect_blobs([file_name]))
+        await asyncio.sleep(0.2)
+        waited = not collector.done()
+        await db.execute(insert(ImageModel).values(
+                                                    location=file_name,
+                                                    filename=file_name,
+                                                    size=os.path.getsize(get_media_path(file_name)),
+                                                    content_type="image/jpeg",
+                                                    sha256=file_name.split(".")[0],
+                                                    refcount=1))
+    await collector
+    return waited, os.path.exists(get_media_path(file_name))
+
+
+def sub_test_media_extension(client, headers: dict):
+    logging.info("Media extension normalization testing ...")
+    payload = make_image((200, 10, 10))
+    names = []
+    for index, file_name in enumerate(["upper.JPG", "alias.jpeg"]):
+        response = client.post(
+                                    url="/blog/create_post/",
+                                    data={"title": f"media_extension_{index}", "content": "media_content"},
+                                    files=[("image", (file_name, payload, "image/jpeg"))],
+                                    headers=headers)
+        assert response.status_code == 201
+        names.append(response.json()["images"][0]["filename"])
+    assert names[0] == names[1] and names[0].endswith(".jpg")
+    logging.info("Media extension normalization testing finished.")
+    return names[0]
+
+
+def sub_test_media_race(client, headers: dict):
+    logging.info("Media delete and upload race testing ...")
+    file_names = client.portal.call(race_delete_and_upload, client.app, headers, make_image((10, 200, 10)), 5)
+    assert not os.path.exists(get_media_path(file_names[0]))
+    logging.info("Media delete and upload race testing finished.")
+
+
+def sub_test_media_collect(client, sync_engine):
+    logging.info("Media collection during upload testing ...")
+    payload = make_image((10, 200, 200))
+    file_name = f"{hashlib.sha256(payload).hexdigest()}.jpg"
+    os.makedirs(os.path.dirname(get_media_path(file_name)), exist_ok=True)
+    with open(get_media_path(file_name), "wb") as file:
+        file.write(payload)
+    assert client.portal.call(collect_during_upload, file_name) == (True, True)
+    with sync_engine.begin() as connection:
+        connection.execute(delete(ImageModel).where(ImageModel.filename == file_name))
+    client.portal.call(media.collect_blobs, [file_name])
+    assert not os.path.exists(get_media_path(file_name))
+    logging.info("Media collection during upload testing finished.")
+
+
+def sub_test_media_failed_upload(client, sync_engine, headers: dict, monkeypatch, shared_file: str):
+    logging.info("Media failed upload cleanup testing ...")
+    create_info_files = media.create_info_files
+
+    async def failing(*args):
+        await create_info_files(*args)
+        raise exceptions.BadRequestException("Error with saving info files.")
+
+    monkeypatch.setattr(media, "create_info_files", failing)
+    fresh = make_image((10, 10, 200))
+    fresh_file = f"{hashlib.sha256(fresh).hexdigest()}.jpg"
+    response = client.post(
+                                url="/blog/create_post/",
+                                data={"title": "media_failed", "content": "media_content"},
+                                files=[
+                                    ("image", ("shared.jpg", make_image((200, 10, 10)), "image/jpeg")),
+                                    ("image", ("fresh.jpg", fresh, "image/jpeg"))],
+                                headers=headers)
+    monkeypatch.undo()
+    assert response.status_code == 400
+    assert os.path.exists(get_media_path(shared_file))
+    assert not os.path.exists(get_media_path(fresh_file))
+    with sync_engine.connect() as connection:
+        assert connection.scalar(select(func.count()).where(ImageModel.filename == fresh_file)) == 0
+    assert not [file_name for file_name in os.listdir(settings.MEDIA_ROOT) if file_name.endswith(".upload")]
+    logging.info("Media failed upload cleanup testing finished.")
+
+
+def sub_test_media_too_large(client, headers: dict, monkeypatch):
+    logging.info("Media too large upload testing ...")
+    monkeypatch.setattr(settings, "MAX_FILE_SIZE", 1024)
+    response = client.post(
+                                url="/blog/create_post/",
+                                data={"title": "media_too_large", "content": "media_content"},
+                                files=[
+                                    ("image", ("small.jpg", os.urandom(512), "image/jpeg")),
+                                    ("image", ("large.jpg", os.urandom(2048), "image/jpeg"))],
+                                headers=headers)
+    monkeypatch.undo()
+    assert response.status_code == 413
+    assert not [file_name for file_name in os.listdir(settings.MEDIA_ROOT) if file_name.endswith((".upload", ".part"))]
+    assert client.get(url="/blog/show_my_posts/?title__like=media_too_large", headers=headers).status_code == 404
+    logging.info("Media too large upload testing finished.")
+
+
+async def fetch_media_urls(urls: list[str], headers: dict) -> list[httpx.Response]:
+    accel_app = FastAPI()
+    registry.init_routers(accel_app)
+    transport = httpx.ASGITransport(app=accel_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as cli:
+        return [await cli.get(url=url, headers=headers) for url in urls]
+
+
+def sub_test_media_accel(client, headers: dict, monkeypatch, file_name: str):
+    logging.info("Media X-Accel-Redirect testing ...")
+    monkeypatch.setattr(settings, "MEDIA_ACCEL_REDIRECT", True)
+    response = client.get(url=f"/blog/download_file/{file_name}/", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["x-accel-redirect"] == f"{settings.MEDIA_ACCEL_LOCATION}/{"/".join([*get_media_shards(file_name), file_name])}"
+    assert response.content == b""
+    response = client.get(url=f"/blog/download_file/{"0" * 64}.jpg/", headers=headers)
+    assert response.status_code == 404
+    assert "x-accel-redirect" not in response.headers
+    response = client.post(
+                                url="/blog/create_post/",
+                                data={"title": "media_accel", "content": "media_content"},
+                                files=[("image", ("accel.jpg", make_image((200, 200, 10)), "image/jpeg"))],
+                                headers=headers)
+    assert response.status_code == 201
+    image = response.json()["images"][0]
+    location = image["location"]
+    assert location.startswith(f"http://testserver{settings.MEDIA_URL}/")
+    shards = "/".join(get_media_shards(image["filename"]))
+    responses = client.portal.call(
+                                    fetch_media_urls,
+                                    [
+                                        location,
+                                        location.replace(f"/{shards}/", "/"),
+                                        location.replace(image["filename"], f"{image["filename"][:4]}{"0" * 60}.jpg")],
+                                    headers)
+    accel, wrong_shards, missing = responses
+    assert accel.status_code == 200
+    assert accel.headers["x-accel-redirect"] == f"{settings.MEDIA_ACCEL_LOCATION}/{shards}/{image["filename"]}"
+    assert (wrong_shards.status_code, missing.status_code) == (404, 404)
+    responses = client.portal.call(fetch_media_urls, [location], {})
+    monkeypatch.undo()
+    assert responses[0].status_code == 401
+    logging.info("Media X-Accel-Redirect testing finished.")
+
+
+def test_media_store(client, sync_engine, monkeypatch):
+
+    logging.info("START - testing media store")
+    headers = register_and_login(client, "media_owner")
+    shared_file = sub_test_media_extension(client, headers)
+    sub_test_media_race(client, headers)
+    sub_test_media_collect(client, sync_engine)
+    sub_test_media_accel(client, headers, monkeypatch, shared_file)
+    sub_test_media_failed_upload(client, sync_engine, headers, monkeypatch, shared_file)
+    sub_test_media_too_large(client, headers, monkeypatch)
+    logging.info("STOP - testing media store")
+
+
+def write_media_file(content: bytes) -> str:
+    file_name = f"{hashlib.sha256(content).hexdigest()}.jpg"
+    os.makedirs(os.path.dirname(get_media_path(file_name)), exist_ok=True)
+    with open(get_media_path(file_name), "wb") as file:
+        file.write(content)
+    return file_name
+
+
+def list_partial_files() -> list[str]:
+    return [file_name for _, _, file_names in os.walk(settings.MEDIA_ROOT) for file_name in file_names if file_name.endswith(".part")]
+
+
+def sub_test_derivatives_decompression_bomb(monkeypatch):
+    logging.info("Derivatives of a decompression bomb testing ...")
+    file_name = write_media_file(make_image((1, 2, 3)))
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100)
+    assert generate_derivatives_blocking(file_name) == False
+    monkeypatch.undo()
+    assert generate_derivatives_blocking(file_name) == True
+    logging.info("Derivatives of a decompression bomb testing finished.")
+
+
+def sub_test_derivatives_failed_save(monkeypatch):
+    logging.info("Derivatives failed save testing ...")
+    file_name = write_media_file(make_image((4, 5, 6)))
+
+    def failing_save(image, path, *args, **kwargs):
+        with open(path, "wb") as file:
+            file.write(b"partial")
+        raise OSError("No space left on device")
+
+    monkeypatch.setattr(Image.Image, "save", failing_save)
+    assert generate_derivatives_blocking(file_name) == False
+    monkeypatch.undo()
+    assert list_partial_files() == []
+    logging.info("Derivatives failed save testing finished.")
+
+
+class SaturatedPoolClass(WorkerPoolClass):
+    pass
+
+
+async def run_saturated(pool: WorkerPoolClass, jobs: int) -> tuple[list, bool]:
+    waiting = [asyncio.create_task(pool.run(time.sleep, 0.05, wait=True)) for _ in range(jobs)]
+    await asyncio.sleep(0.01)
+    try:
+        await pool.run(time.sleep, 0)
+        rejected = False
+    except WorkerPoolSaturatedError:
+        rejected = True
+    return await asyncio.gather(*waiting), rejected
+
+
+def sub_test_derivatives_saturated_pool(client):
+    logging.info("Derivatives on a saturated pool testing ...")
+    pool = SaturatedPoolClass()
+    pool.init(max_workers=1, queue_size=1, kind="thread")
+    try:
+        results, rejected = client.portal.call(run_saturated, pool, 6)
+    finally:
+        pool.shutdown()
+    assert results == [None] * 6
+    assert rejected == True
+    logging.info("Derivatives on a saturated pool testing finished.")
+
+
+def test_derivatives(client, monkeypatch):
+
+    logging.info("START - testing derivatives")
+    sub_test_derivatives_decompression_bomb(monkeypatch)
+    sub_test_derivatives_failed_save(monkeypatch)
+    sub_test_derivatives_saturated_pool(client)
+    logging.info("STOP - testing derivatives")
+
+
+async def principal_across_workers() -> tuple[str, UserModel]:
+    first, second = PrincipalCache(), PrincipalCache()
+    await first.set("shared", UserModel(id=1, username="shared", full_name="Shared", email="shared@example.com", is_active=True))
+    cached = await second.get("shared")
+    await second.invalidate("shared")
+    return cached.username, await first.get("shared")
+
+
+def sub_test_principal_cache_shared(client):
+    logging.info("Principal cache shared between workers testing ...")
+    assert client.portal.call(principal_across_workers) == ("shared", None)
+    logging.info("Principal cache shared between workers testing finished.")
+
+
+def sub_test_redis_cache_unavailable(monkeypatch):
+    logging.info("Redis cache unavailable testing ...")
+    attempts = []
+
+    def unavailable():
+        attempts.append(1)
+        raise ConnectionError("Redis is not ready.")
+
+    monkeypatch.setattr(redis_support, "get_redis", unavailable)
+    cache = RedisCache(prefix="unavailable")
+    assert cache.get("key") is None
+    cache.set("key", "value", 60)
+    assert cache.get_counters(["all"]) is None
+    assert len(attempts) == 1
+    monkeypatch.undo()
+    logging.info("Redis cache unavailable testing finished.")
+
+
+def test_principal_cache(client, monkeypatch):
+
+    logging.info("START - testing principal cache")
+    sub_test_principal_cache_shared(client)
+    sub_test_redis_cache_unavailable(monkeypatch)
+    logging.info("STOP - testing principal cache")
+
+
+def sub_test_import_ndjson(client, headers: dict):
+    logging.info("Import NDJSON testing ...")
+    lines = [
+                json.dumps({"title": f"porter_bulk_{index}", "content": f"porter_content_{index}", "published": index % 2 == 0})
+                for index in range(8)]
+    lines[1] = json.dumps({"title": "porter_title", "content": "conflicts with an existing post"})
+    lines[3] = "{not json"
+    lines[5] = json.dumps({"title": "porter_missing_content"})
+    lines[7] = json.dumps({"title": "porter_bulk_0", "content": "duplicated in the import"})
+    response = client.post(
+                                url="/blog/import/",
+                                files={"file": ("posts.ndjson", "\n".join(lines).encode("utf-8"), "application/x-ndjson")},
+                                headers=headers)
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["received"], result["created"], result["failed"]) == (8, 4, 4)
+    errors = {error["line"]: error["error"] for error in result["errors"]}
+    assert errors[2] == "Post of this title already exists."
+    assert errors[4].startswith("Invalid JSON")
+    assert errors[6].startswith("content:")
+    assert errors[8] == "Title is duplicated in the import."
+    sub_test_user_stats(client, post_count=5, published_post_count=4, image_bytes=0)
+    lines = [
+                '{"title": "porter_span_1", "content": "first"}, {"title": "porter_span_2", "content": "second"',
+                '"content": "third"}',
+                json.dumps({"title": "porter_span_3", "content": "fourth", "image": ["porter.jpg"]})]
+    response = client.post(
+                                url="/blog/import/",
+                                files={"file": ("posts.ndjson", "\n".join(lines).encode("utf-8"), "application/x-ndjson")},
+                                headers=headers)
+    assert response.status_code == 200
+    result = response.json()
+    assert (result["received"], result["created"], result["failed"]) == (3, 1, 2)
+    assert [error["line"] for error in result["errors"]] == [1, 2]
+    assert all(error["error"].startswith("Invalid JSON") for error in result["errors"])
+    post = client.get(url="/blog/show_my_posts/?title__like=porter_span_3", headers=headers).json()["items"][0]
+    assert post["images"] == []
+    logging.info("Import NDJSON testing finished.")
+
+
+def sub_test_import_csv(client, headers: dict):
+    logging.info("Import CSV testing ...")
+    rows = BytesIO()
+    with TextIOWrapper(rows, encoding="utf-8", newline="") as stream:
+        writer = csv.writer(stream)
+        writer.writerow(["title", "content", "published", "created_at"])
+        writer.writerow(["porter_csv_1", "first line\nsecond, \"quoted\" line", "true", "2020-01-01T00:00:00+00:00"])
+        writer.writerow(["porter_csv_2", "bad flag", "maybe", ""])
+        stream.flush()
+        payload = rows.getvalue()
+    response = client.post(url="/blog/import/", files={"file": ("posts.csv", payload, "text/csv")}, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {
+                                "received": 2,
+                                "created": 1,
+                                "failed": 1,
+                                "errors": [{"line": 4, "error": "published: Input should be a valid boolean, unable to interpret input"}]}
+    post = client.get(url="/blog/show_my_posts/?title__like=porter_csv_1", headers=headers).json()["items"][0]
+    assert post["content"] == "first line\nsecond, \"quoted\" line"
+    assert post["created_at"].startswith("2020-01-01")
+    response = client.post(url="/blog/import/", files={"file": ("posts.txt", b"")}, headers=headers)
+    assert response.status_code == 400
+    logging.info("Import CSV testing finished.")
+
+
+def sub_test_export(client, headers: dict):
+    logging.info("Export testing ...")
+    response = client.get(url="/blog/export/?title__like=porter_bulk_%25&order_by=title", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    posts = [json.loads(line) for line in response.text.splitlines()]
+    assert [post["title"] for post in posts] == ["porter_bulk_0", "porter_bulk_2", "porter_bulk_4", "porter_bulk_6"]
+    assert posts[0]["users"] == {"username": "porter", "email": "porter@example.com"}
+    response = client.get(url="/blog/export/?title__like=porter_bulk_%25&published=true&format=csv", headers=headers)
+    rows = list(csv.DictReader(response.text.splitlines()))
+    assert sorted(row["title"] for row in rows) == ["porter_bulk_0", "porter_bulk_2", "porter_bulk_4", "porter_bulk_6"]
+    assert all(row["published"] == "True" and row["username"] == "porter" for row in rows)
+    logging.info("Export testing finished.")
+
+
+def test_import_export(client):
+
+    logging.info("START - testing import and export")
+    headers = register_and_login(client, "porter")
+    os.environ["BEARER_TOKEN"] = headers["Authorization"].removeprefix("Bearer ")
+    response = client.post(url="/blog/create_post/", data={"title": "porter_title", "content": "porter_content"}, headers=headers)
+    assert response.status_code == 201
+    sub_test_import_ndjson(client, headers)
+    sub_test_import_csv(client, headers)
+    sub_test_export(client, headers)
+    response = client.delete(url="/admin/delete/", headers=headers)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "At least one post belongs to this user."}
+    logging.info("STOP - testing import and export")
+
+
+class SlowPipeline:
+
+    def __init__(self, delay: float, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.commands = 0
+
+    def __getattr__(self, name: str):
+        def command(*args, **kwargs):
+            self.commands += 1
+            return self
+        return command
+
+    def execute(self) -> list:
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return [[] for _ in range(self.commands)]
+
+
+class SlowRedis:
+
+    def __init__(self, delay: float, error: Exception = None):
+        self.delay = delay
+        self.error = error
+
+    def pipeline(self, transaction: bool = True) -> SlowPipeline:
+        return SlowPipeline(self.delay, self.error)
+
+    def get(self, key: str):
+        time.sleep(self.delay)
+        return None
+
+
+async def revocation_across_workers() -> tuple[bool, bool, bool]:
+    first, second = TokenRevocation(), TokenRevocation()
+    await second.sync()
+    session = uuid.uuid4().hex
+    await first.revoke_session(session)
+    claims = {"sub": "revocation_worker", "sid": session, "iat": time.time()}
+    revoked_before_sync = await second.is_revoked(claims)
+    second.sync_at = 0
+    revoked_after_sync = await second.is_revoked(claims)
+    revoked_after_rebuild = await TokenRevocation().is_revoked(claims)
+    return revoked_before_sync, revoked_after_sync, revoked_after_rebuild
+
+
+async def revocation_with_slow_redis(delay: float) -> tuple[bool, int, float]:
+    revocation = TokenRevocation()
+    revocation.redis = SlowRedis(delay)
+    revocation.last_id, revocation.rebuilt_at = "0-0", time.monotonic()
+    revocation.bloom.add("user:revocation_slow")
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    try:
+        revoked = await revocation.is_revoked({"sub": "revocation_slow", "sid": uuid.uuid4().hex, "iat": 0})
+        await revocation.revoke_session(uuid.uuid4().hex)
+    finally:
+        task.cancel()
+    return revoked, ticks, time.perf_counter() - start
+
+
+async def revocation_with_failing_redis() -> float:
+    revocation = TokenRevocation()
+    revocation.redis = SlowRedis(0, ConnectionError("Timeout connecting to server"))
+    await revocation.sync()
+    return revocation.sync_at - time.monotonic()
+
+
+def sub_test_revocation_shared(client):
+    logging.info("Token revocation shared across workers testing ...")
+    assert client.portal.call(revocation_across_workers) == (False, True, True)
+    logging.info("Token revocation shared across workers testing finished.")
+
+
+def sub_test_revocation_off_loop(client):
+    logging.info("Token revocation off the event loop testing ...")
+    revoked, ticks, elapsed = client.portal.call(revocation_with_slow_redis, 0.2)
+    assert revoked == False
+    assert elapsed >= 0.6
+    assert ticks >= 20
+    assert client.portal.call(revocation_with_failing_redis) > settings.TOKEN_REVOCATION_SYNC_INTERVAL
+    logging.info("Token revocation off the event loop testing finished.")
+
+
+def test_token_revocation(client):
+
+    logging.info("START - testing token revocation")
+    sub_test_revocation_shared(client)
+    sub_test_revocation_off_loop(client)
+    logging.info("STOP - testing token revocation")
@@ -0,0 +1,1404 @@
+import os
+import csv
+import json
+import math
+import base64
+import time
+import random
+import asyncio
+import hashlib
+import tempfile
+import tracemalloc
+import logging
+import statistics
+import httpx
+import pytest
+from datetime import datetime, timedelta, timezone
+from io import BytesIO, TextIOWrapper
+from PIL import Image
+from fastapi import UploadFile
+from sqlalchemy import delete, func, insert, literal, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+from benchmark.generator import generate_dataset
+from benchmark.runner import run_benchmark
+from benchmark.scenarios import SCENARIOS
+from config.cache import MemoryCache
+from config.database import DatabaseSessionClass, database
+from config.profiling import ProfilingMiddleware
+from config.settings import settings
+from config.workers import workers
+from app_blog.cache import post_cache, token_cache
+from app_blog.dependency import Dependency, rate_limiter
+from app_blog.derivatives import derivatives, generate_derivatives_blocking
+from app_blog.filters import PostFindFilter, UserFilter
+from app_blog.models import ImageModel, PostModel, UserModel, post_image
+from app_blog.pagination import KeysetPagination
+from app_blog.repository import AuthenticationRepository, MediaRepository, get_media_path
+
+NUMBER_OF_USERS = 4
+NUMBER_OF_REQUESTS = 200
+MAX_IN_FLIGHT = NUMBER_OF_REQUESTS
+QUERY_BUDGET_POSTS = [5, 25]
+QUERY_BUDGET_LISTING = 3
+PAGINATION_POSTS = 120
+PAGINATION_PAGE_SIZE = 25
+PAGINATION_BENCHMARK_PAGE_SIZE = 10
+PAGINATION_BENCHMARK_DEEP_PAGE = 10_000
+PAGINATION_BENCHMARK_REPEAT = 20
+TRIGRAM_USERS = 5_000
+TRIGRAM_SMALL_USERS = 20
+TRIGRAM_SMALL_DISABLED_SCANS = ["seqscan", "indexscan", "indexonlyscan"]
+TRIGRAM_POSTS_PER_USER = 4
+UPLOAD_LARGE_FILE_SIZE = 32 * 1024 * 1024
+UPLOAD_MEMORY_LIMIT = 1024 * 1024
+DEDUP_UPLOADS = 200
+DEDUP_DISTINCT_FILES = 4
+DEDUP_FILE_SIZE = 256 * 1024
+DOWNLOAD_FILE_SIZE = 512 * 1024
+DOWNLOAD_REPEAT = 20
+ACCEL_DOWNLOADS = 100
+DERIVATIVE_IMAGE_SIZE = (1600, 1200)
+WRITE_STATEMENTS_BEFORE = {
+                            "register": 4,
+                            "update_user": 3,
+                            "create_post": 7,
+                            "create_post_with_image": 9,
+                            "update_post": 6,
+                            "delete_post": 8}
+WRITE_STATEMENTS_BUDGET = {
+                            "register": 3,
+                            "update_user": 2,
+                            "create_post": 5,
+                            "create_post_with_image": 8,
+                            "update_post": 4,
+                            "delete_post": 9}
+DELETE_USER_POSTS = 50_000
+IMPORT_POSTS = 100_000
+IMPORT_MIN_RATE = 10_000
+EXPORT_POSTS = 1_000_000
+CREATE_RACE_REQUESTS = 100
+TOKEN_BENCHMARK_CALLS = 5_000
+STUFFING_USERS = 4
+STUFFING_REQUESTS = 60
+PROFILING_POSTS = 200
+PROFILING_RETENTION = 3
+SUITE_SCALE = {"users": 5, "posts_per_user": 40, "images": 4, "image_ratio": 0.5}
+SUITE_REQUESTS = 10
+EXPORT_RSS_CEILING = 64 * 1024 * 1024
+DELETE_USER_TIME_LIMIT = 0.5
+POST_CACHE_POSTS = 500
+POST_CACHE_REQUESTS = 400
+POST_CACHE_WRITE_EVERY = 50
+POST_CACHE_FILTERS = [
+                        "?username=cached",
+                        "?username=cached&published=false",
+                        "?title__like=cached_title_00001",
+                        "?order_by=title",
+                        ""]
+SEARCH_CORPUS_POSTS = 50_000
+SEARCH_RARE_TERM_EVERY = 5_000
+SEARCH_BENCHMARK_REPEAT = 10
+SEARCH_VOCABULARY = [
+                        "python", "database", "index", "query", "server", "cache", "network", "latency",
+                        "journey", "garden", "mountain", "river", "coffee", "window", "morning", "letter",
+                        "history", "science", "market", "weather", "kitchen", "painting", "music", "travel"]
+BENCHMARK_CONCURRENCY = [50, 100, 250, 500]
+BENCHMARK_DB_LATENCY = 0.005
+LOGIN_STORM_SIZE = 40
+LATENCY_PROBES = 50
+
+
+async def fire_requests(request_factories: list, limit: int) -> tuple[list, float]:
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(factory):
+        async with semaphore:
+            return await factory()
+
+    start = time.perf_counter()
+    responses = await asyncio.gather(*(bounded(factory) for factory in request_factories))
+    return responses, time.perf_counter() - start
+
+
+def seed_user_with_posts(sync_engine, username: str, number_of_posts: int, content=None) -> tuple[int, dict]:
+    now = datetime.now(timezone.utc)
+    with sync_engine.begin() as connection:
+        user_id = connection.execute(
+                                    insert(UserModel).returning(UserModel.id),
+                                    {
+                                        "username": username,
+                                        "full_name": username,
+                                        "email": f"{username}@example.com",
+                                        "hashed_password": "-",
+                                        "is_active": True}).scalar_one()
+        for start in range(0, number_of_posts, 10_000):
+            connection.execute(
+                                insert(PostModel),
+                                [
+                                    {
+                                        "title": f"{username}_title_{index:07d}",
+                                        "content": content(index) if content else f"{username}_content_{index}",
+                                        "created_by": user_id,
+                                        "created_at": now - timedelta(seconds=index // 3)}
+                                    for index in range(start, min(start + 10_000, number_of_posts))])
+    token = AuthenticationRepository().create_token(data={"sub": username}, refresh=False)
+    return user_id, {"Authorization": f"Bearer {token}"}
+
+
+def remove_seeded_user(sync_engine, user_id: int) -> None:
+    with sync_engine.begin() as connection:
+        connection.execute(delete(PostModel).where(PostModel.created_by == user_id))
+        connection.execute(delete(UserModel).where(UserModel.id == user_id))
+
+
+def list_media_files() -> set:
+    return {
+            os.path.join(root, file_name)
+            for root, _, file_names in os.walk(settings.MEDIA_ROOT)
+            for file_name in file_names}
+
+
+def percentile(values: list, percent: int) -> float:
+    return statistics.quantiles(values, n=100, method="inclusive")[percent - 1]
+
+
+async def fetch_all_pages(cli: httpx.AsyncClient, url: str, headers: dict) -> list:
+    items = []
+    params = {}
+    while True:
+        response = await cli.get(url=url, params=params, headers=headers)
+        assert response.status_code == 200
+        items.extend(response.json()["items"])
+        if response.json()["next_cursor"] is None:
+            return items
+        params = {"cursor": response.json()["next_cursor"]}
+
+
+async def register_and_login(cli: httpx.AsyncClient, index: int | str) -> tuple[str, dict]:
+    username = f"stress_{index}"
+    password = f"!ws@stress_{index}"
+    response = await cli.post(
+                                url="/admin/register/",
+                                json={
+                                        "username": username,
+                                        "full_name": f"Stress {index}",
+                                        "email": f"stress_{index}@example.com",
+                                        "password": password,
+                                        "password_confirm": password})
+    assert response.status_code == 201
+    response = await cli.post(
+                                url="/admin/login/",
+                                data={"username": username, "password": password})
+    assert response.status_code == 200
+    return username, {"Authorization": f"Bearer {response.json()["access_token"]}"}
+
+
+async def scenario_concurrent_sessions(app) -> None:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        users = [await register_and_login(cli, index) for index in range(NUMBER_OF_USERS)]
+
+        def create_post(index: int):
+            username, headers = users[index % NUMBER_OF_USERS]
+            return lambda: cli.post(
+                                    url="/blog/create_post/",
+                                    data={"title": f"stress_title_{index}", "content": f"{username}_{index}"},
+                                    headers=headers)
+
+        responses, elapsed = await fire_requests(
+                                                    [create_post(index) for index in range(NUMBER_OF_REQUESTS)],
+                                                    MAX_IN_FLIGHT)
+        logging.info(f"Create post: {NUMBER_OF_REQUESTS} requests, {NUMBER_OF_REQUESTS / elapsed:.1f} req/s.")
+        post_ids = {}
+        for index, response in enumerate(responses):
+            username, _ = users[index % NUMBER_OF_USERS]
+            assert response.status_code == 201
+            response_json = response.json()
+            assert response_json["title"] == f"stress_title_{index}"
+            assert response_json["content"] == f"{username}_{index}"
+            assert response_json["users"]["username"] == username
+            post_ids.setdefault(username, []).append(response_json["id"])
+
+        def update_user(index: int):
+            _, headers = users[index % NUMBER_OF_USERS]
+            return lambda: cli.put(
+                                    url="/admin/update/",
+                                    json={"full_name": f"Stress update {index}"},
+                                    headers=headers)
+
+        responses, elapsed = await fire_requests(
+                                                    [update_user(index) for index in range(NUMBER_OF_REQUESTS)],
+                                                    MAX_IN_FLIGHT)
+        logging.info(f"Update user: {NUMBER_OF_REQUESTS} requests, {NUMBER_OF_REQUESTS / elapsed:.1f} req/s.")
+        for index, response in enumerate(responses):
+            username, _ = users[index % NUMBER_OF_USERS]
+            assert response.status_code == 200
+            assert response.json()["username"] == username
+            assert response.json()["full_name"] == f"Stress update {index}"
+
+        for username, headers in users:
+            posts = await fetch_all_pages(cli, "/blog/show_my_posts/", headers)
+            assert sorted(post["id"] for post in posts) == sorted(post_ids[username])
+            for post_id in post_ids[username]:
+                response = await cli.delete(url=f"/blog/delete_post/{post_id}/", headers=headers)
+                assert response.status_code == 200
+            response = await cli.delete(url="/admin/delete/", headers=headers)
+            assert response.status_code == 200
+
+
+def benchmark_queries() -> list:
+    return [
+            select(func.pg_sleep(BENCHMARK_DB_LATENCY)),
+            select(PostModel).join(UserModel).filter(PostModel.published == True).limit(10)]
+
+
+async def benchmark_sync_in_async(sync_engine, concurrency: int) -> float:
+    session_factory = sessionmaker(bind=sync_engine)
+
+    async def handler():
+        with session_factory() as session:
+            for query in benchmark_queries():
+                session.execute(query).all()
+
+    _, elapsed = await fire_requests([handler for _ in range(concurrency)], concurrency)
+    return concurrency / elapsed
+
+
+async def benchmark_async(concurrency: int) -> float:
+
+    async def handler():
+        async with database.get_session() as session:
+            for query in benchmark_queries():
+                (await session.execute(query)).all()
+
+    _, elapsed = await fire_requests([handler for _ in range(concurrency)], concurrency)
+    return concurrency / elapsed
+
+
+async def scenario_benchmark_async_vs_sync(sync_engine) -> dict:
+    results = {}
+    for concurrency in BENCHMARK_CONCURRENCY:
+        results[concurrency] = (
+                                await benchmark_sync_in_async(sync_engine, concurrency),
+                                await benchmark_async(concurrency))
+    return results
+
+
+async def scenario_login_storm(app, max_workers: int) -> tuple[float, list]:
+    workers.shutdown()
+    workers.init(max_workers=max_workers)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        username, headers = await register_and_login(cli, f"storm_{max_workers}")
+        response = await cli.post(
+                                    url="/blog/create_post/",
+                                    data={"title": f"storm_title_{max_workers}", "content": "storm_content"},
+                                    headers=headers)
+        assert response.status_code == 201
+        post_id = response.json()["id"]
+
+        storm = asyncio.gather(*(
+                                    cli.post(
+                                            url="/admin/login/",
+                                            data={"username": username, "password": f"!ws@stress_storm_{max_workers}"})
+                                    for _ in range(LOGIN_STORM_SIZE)))
+        latencies = []
+        for _ in range(LATENCY_PROBES):
+            start = time.perf_counter()
+            response = await cli.get(url="/blog/find_post/", headers=headers)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200
+        statuses = [response.status_code for response in await storm]
+
+        await cli.delete(url=f"/blog/delete_post/{post_id}/", headers=headers)
+        await cli.delete(url="/admin/delete/", headers=headers)
+    workers.shutdown()
+    workers.init()
+    return percentile(latencies, 99), statuses
+
+
+async def scenario_query_budget(app, query_budget) -> None:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        _, headers = await register_and_login(cli, "budget")
+        post_ids = []
+        file_names = set()
+        for number_of_posts in QUERY_BUDGET_POSTS:
+            while len(post_ids) < number_of_posts:
+                response = await cli.post(
+                                            url="/blog/create_post/",
+                                            data={"title": f"budget_title_{len(post_ids)}", "content": "budget_content"},
+                                            files=[("image", open("./test/image_example_1.jpg", "rb"))],
+                                            headers=headers)
+                assert response.status_code == 201
+                post_ids.append(response.json()["id"])
+                file_names.add(response.json()["images"][0]["filename"])
+            await derivatives.drain()
+            await cli.get(url="/admin/pool_status/", headers=headers)
+            with query_budget(QUERY_BUDGET_LISTING):
+                response = await cli.get(url="/blog/show_my_posts/", headers=headers)
+                assert len(response.json()["items"]) == number_of_posts
+            with query_budget(QUERY_BUDGET_LISTING):
+                response = await cli.get(url="/blog/find_post/?username=stress_budget", headers=headers)
+                assert len(response.json()["items"]) == number_of_posts
+                assert all(len(post["images"]) == 1 for post in response.json()["items"])
+    for file_name in file_names:
+        os.remove(get_media_path(file_name))
+
+
+async def scenario_principal_cache(app, statement_counter) -> tuple[int, int, int]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        _, headers = await register_and_login(cli, "principal")
+        with statement_counter() as miss:
+            response = await cli.get(url="/admin/pool_status/", headers=headers)
+            assert response.status_code == 200
+        with statement_counter() as hit:
+            response = await cli.get(url="/admin/pool_status/", headers=headers)
+            assert response.status_code == 200
+        response = await cli.put(url="/admin/update/", json={"is_active": False}, headers=headers)
+        assert response.status_code == 200
+        response = await cli.get(url="/admin/pool_status/", headers=headers)
+        return len(miss.statements), len(hit.statements), response.status_code
+
+
+def test_concurrent_sessions(client):
+
+    logging.info("START - testing concurrent sessions")
+    client.portal.call(scenario_concurrent_sessions, client.app)
+    logging.info("STOP - testing concurrent sessions")
+
+
+def test_query_budget(client, query_budget):
+
+    logging.info("START - testing query budget of listing endpoints")
+    client.portal.call(scenario_query_budget, client.app, query_budget)
+    logging.info("STOP - testing query budget of listing endpoints")
+
+
+def test_principal_cache(client, statement_counter):
+
+    logging.info("START - testing principal cache")
+    miss, hit, status_after_deactivation = client.portal.call(scenario_principal_cache, client.app, statement_counter)
+    assert miss == 1
+    assert hit == 0
+    assert status_after_deactivation == 400
+    logging.info("STOP - testing principal cache")
+
+
+@pytest.mark.benchmark
+def test_benchmark_async_vs_sync(client, sync_engine):
+
+    logging.info("START - benchmark async vs sync-in-async database path")
+    results = client.portal.call(scenario_benchmark_async_vs_sync, sync_engine)
+    for concurrency, (sync_rps, async_rps) in results.items():
+        logging.info(f"Concurrency {concurrency}: sync-in-async {sync_rps:.1f} req/s, async {async_rps:.1f} req/s.")
+        assert async_rps > sync_rps
+    logging.info("STOP - benchmark async vs sync-in-async database path")
+
+
+@pytest.mark.benchmark
+def test_benchmark_find_post_during_login_storm(client):
+
+    logging.info("START - benchmark find_post latency during login storm")
+    inline_p99, _ = client.portal.call(scenario_login_storm, client.app, 0)
+    pool_p99, statuses = client.portal.call(scenario_login_storm, client.app, settings.WORKER_POOL_SIZE)
+    logging.info(f"find_post p99: inline bcrypt {inline_p99 * 1000:.1f} ms, worker pool {pool_p99 * 1000:.1f} ms.")
+    logging.info(f"Login storm with worker pool: {statuses.count(200)} accepted, {statuses.count(429)} rejected.")
+    assert set(statuses) <= {200, 429}
+    assert pool_p99 < inline_p99
+    logging.info("STOP - benchmark find_post latency during login storm")
+
+
+async def scenario_pagination(app, headers: dict) -> tuple[list, list]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        pages = []
+        for order_by in [None, "title", "-published,title"]:
+            params = {"limit": PAGINATION_PAGE_SIZE}
+            if order_by is not None:
+                params["order_by"] = order_by
+            items = []
+            while True:
+                response = await cli.get(url="/blog/show_my_posts/", params=params, headers=headers)
+                assert response.status_code == 200
+                assert len(response.json()["items"]) <= PAGINATION_PAGE_SIZE
+                items.extend(response.json()["items"])
+                if response.json()["next_cursor"] is None:
+                    break
+                params["cursor"] = response.json()["next_cursor"]
+            pages.append(items)
+        response = await cli.get(url="/blog/show_my_posts/", params={"cursor": "invalid"}, headers=headers)
+        assert response.status_code == 400
+        for order_by, values in [
+                                    (None, ["2024-01-01T00:00:00", "x"]),
+                                    (None, ["2024-01-01T00:00:00", True]),
+                                    (None, [1, 1]),
+                                    ("title", [["title"], "2024-01-01T00:00:00", 1]),
+                                    ("title", [None, "2024-01-01T00:00:00", 1])]:
+            keys = KeysetPagination(PostModel, ordering=[order_by] if order_by else None).signature
+            payload = json.dumps({"keys": keys, "values": values}).encode("utf-8")
+            params = {"cursor": base64.urlsafe_b64encode(payload).decode("ascii")}
+            if order_by is not None:
+                params["order_by"] = order_by
+            response = await cli.get(url="/blog/show_my_posts/", params=params, headers=headers)
+            assert response.status_code == 400, (values, response.text)
+            assert response.json() == {"detail": "Invalid cursor."}
+        return pages
+
+
+async def scenario_pagination_benchmark(app, headers: dict, deep_cursor: str) -> tuple[float, float]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        timings = {}
+        for name, params in [
+                                ("first", {"limit": PAGINATION_BENCHMARK_PAGE_SIZE}),
+                                ("deep", {"limit": PAGINATION_BENCHMARK_PAGE_SIZE, "cursor": deep_cursor})]:
+            latencies = []
+            for _ in range(PAGINATION_BENCHMARK_REPEAT):
+                start = time.perf_counter()
+                response = await cli.get(url="/blog/find_post/", params=params, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200
+                assert len(response.json()["items"]) == PAGINATION_BENCHMARK_PAGE_SIZE
+            timings[name] = statistics.median(latencies)
+        return timings["first"], timings["deep"]
+
+
+def test_pagination(client, sync_engine):
+
+    logging.info("START - testing keyset pagination")
+    user_id, headers = seed_user_with_posts(sync_engine, "pager", PAGINATION_POSTS)
+    default_order, title_order, published_title_order = client.portal.call(scenario_pagination, client.app, headers)
+    for items in [default_order, title_order, published_title_order]:
+        assert len(items) == PAGINATION_POSTS
+        assert len({post["id"] for post in items}) == PAGINATION_POSTS
+    assert default_order == sorted(
+                                    default_order,
+                                    key=lambda post: (datetime.fromisoformat(post["created_at"]), post["id"]),
+                                    reverse=True)
+    assert [post["title"] for post in title_order] == sorted(post["title"] for post in title_order)
+    assert [post["title"] for post in published_title_order] == sorted(post["title"] for post in published_title_order)
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - testing keyset pagination")
+
+
+@pytest.mark.benchmark
+def test_benchmark_pagination(client, sync_engine):
+
+    logging.info("START - benchmark keyset pagination depth")
+    rows = PAGINATION_BENCHMARK_PAGE_SIZE * (PAGINATION_BENCHMARK_DEEP_PAGE + 1)
+    user_id, headers = seed_user_with_posts(sync_engine, "deep_pager", rows)
+    pagination = KeysetPagination(PostModel, limit=PAGINATION_BENCHMARK_PAGE_SIZE)
+    with sessionmaker(bind=sync_engine)() as session:
+        query = pagination.apply(select(PostModel)).limit(None)
+        last_row_of_previous_page = session.scalars(
+                                                    query.offset(PAGINATION_BENCHMARK_PAGE_SIZE * (PAGINATION_BENCHMARK_DEEP_PAGE - 1) - 1)
+                                                    .limit(1)).one()
+        deep_cursor = pagination.encode(last_row_of_previous_page)
+    first, deep = client.portal.call(scenario_pagination_benchmark, client.app, headers, deep_cursor)
+    logging.info(f"find_post median latency: page 1 {first * 1000:.1f} ms, page {PAGINATION_BENCHMARK_DEEP_PAGE} {deep * 1000:.1f} ms.")
+    assert deep < first * 3
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - benchmark keyset pagination depth")
+
+
+def search_corpus_content(index: int) -> str:
+    generator = random.Random(index)
+    words = generator.choices(SEARCH_VOCABULARY, k=60)
+    if index % SEARCH_RARE_TERM_EVERY == 0:
+        words[generator.randrange(len(words))] = "zeppelin"
+    return " ".join(words)
+
+
+@pytest.mark.benchmark
+def test_benchmark_search(client, sync_engine):
+
+    logging.info("START - benchmark full-text search against ILIKE")
+    user_id, headers = seed_user_with_posts(sync_engine, "searcher", SEARCH_CORPUS_POSTS, search_corpus_content)
+    with sync_engine.begin() as connection:
+        connection.exec_driver_sql("ANALYZE post")
+    queries = {
+                "ilike": select(PostModel.id).filter(PostModel.content.ilike("%zeppelin%")),
+                "full_text": select(PostModel.id).filter(
+                                                        PostModel.search_vector.bool_op("@@")(func.websearch_to_tsquery("english", "zeppelin")))}
+    timings = {}
+    with sessionmaker(bind=sync_engine)() as session:
+        for name, query in queries.items():
+            latencies = []
+            for _ in range(SEARCH_BENCHMARK_REPEAT):
+                start = time.perf_counter()
+                matches = session.scalars(query).all()
+                latencies.append(time.perf_counter() - start)
+            assert len(matches) == SEARCH_CORPUS_POSTS // SEARCH_RARE_TERM_EVERY
+            timings[name] = statistics.median(latencies)
+    start = time.perf_counter()
+    response = client.get(url="/blog/search/?q=zeppelin", headers=headers)
+    endpoint = time.perf_counter() - start
+    assert response.status_code == 200
+    assert len(response.json()) == SEARCH_CORPUS_POSTS // SEARCH_RARE_TERM_EVERY
+    assert all("<mark>zeppelin</mark>" in post["headline"] for post in response.json())
+    response = client.get(url="/blog/show_my_posts/?search=zeppelin", headers=headers)
+    assert len(response.json()["items"]) == SEARCH_CORPUS_POSTS // SEARCH_RARE_TERM_EVERY
+    logging.info(
+                    f"Search over {SEARCH_CORPUS_POSTS} posts: ILIKE {timings["ilike"] * 1000:.1f} ms, "
+                    f"full-text {timings["full_text"] * 1000:.1f} ms, /blog/search/ {endpoint * 1000:.1f} ms.")
+    assert timings["full_text"] < timings["ilike"]
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - benchmark full-text search against ILIKE")
+
+
+def explain(sync_engine, query, disabled_scans: list[str] = ()) -> str:
+    statement = query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    with sync_engine.connect() as connection:
+        for scan in disabled_scans:
+            connection.exec_driver_sql(f"SET LOCAL enable_{scan} = off")
+        return "\n".join(connection.exec_driver_sql(f"EXPLAIN {statement}").scalars())
+
+
+def check_trigram_indexes(sync_engine, prefix: str, users: int, disabled_scans: list[str] = ()) -> None:
+    with sync_engine.begin() as connection:
+        user_ids = connection.execute(
+                                        insert(UserModel).returning(UserModel.id, sort_by_parameter_order=True),
+                                        [
+                                            {
+                                                "username": f"{prefix}_{index:05d}",
+                                                "full_name": f"{prefix}_{index:05d}",
+                                                "email": f"{prefix}_{index:05d}@example.com",
+                                                "hashed_password": "-",
+                                                "is_active": True}
+                                            for index in range(users)]).scalars().all()
+        connection.execute(
+                            insert(PostModel),
+                            [
+                                {
+                                    "title": f"{prefix}_title_{user_id}_{index}",
+                                    "content": f"{prefix}_content_{user_id}_{index}",
+                                    "created_by": user_id}
+                                for user_id in user_ids
+                                for index in range(TRIGRAM_POSTS_PER_USER)])
+        connection.exec_driver_sql("ANALYZE post")
+        connection.exec_driver_sql('ANALYZE "user"')
+    filters = {
+                "title__like": (PostFindFilter(title__like=f"%title_{user_ids[users // 4]}_2%"), "idx_post_title_trgm"),
+                "username__like": (PostFindFilter(users=UserFilter(username__like=f"%{prefix}_{users // 2:05d}%")), "idx_user_username_trgm")}
+    try:
+        for name, (filter, index) in filters.items():
+            pagination = KeysetPagination(PostModel, filter.ordering_values)
+            plan = explain(sync_engine, pagination.apply(filter.filter(select(PostModel).join(UserModel))), disabled_scans)
+            logging.info(f"Plan for {name}:\n{plan}")
+            assert index in plan
+            if disabled_scans:
+                continue
+            assert "Seq Scan on post" not in plan
+            assert "Seq Scan on \"user\"" not in plan and "Seq Scan on user" not in plan
+    finally:
+        with sync_engine.begin() as connection:
+            connection.execute(delete(PostModel).where(PostModel.created_by.in_(user_ids)))
+            connection.execute(delete(UserModel).where(UserModel.id.in_(user_ids)))
+
+
+def test_trigram_index_usage(client, sync_engine):
+
+    logging.info("START - LIKE filters can use trigram indexes")
+    check_trigram_indexes(sync_engine, "trigram_small", TRIGRAM_SMALL_USERS, TRIGRAM_SMALL_DISABLED_SCANS)
+    logging.info("STOP - LIKE filters can use trigram indexes")
+
+
+@pytest.mark.benchmark
+def test_trigram_indexes(client, sync_engine):
+
+    logging.info("START - trigram indexes serve LIKE filters")
+    check_trigram_indexes(sync_engine, "trigram", TRIGRAM_USERS)
+    logging.info("STOP - trigram indexes serve LIKE filters")
+
+
+@pytest.mark.benchmark
+def test_streaming_upload(client, sync_engine):
+
+    logging.info("START - streaming upload keeps memory flat and cleans up")
+    digest = hashlib.sha256()
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_MEMORY_LIMIT) as source:
+        chunk = os.urandom(settings.UPLOAD_CHUNK_SIZE)
+        for _ in range(UPLOAD_LARGE_FILE_SIZE // len(chunk)):
+            source.write(chunk)
+            digest.update(chunk)
+        file_path = os.path.join(settings.MEDIA_ROOT, "streaming_upload.bin")
+        with tempfile.SpooledTemporaryFile() as warm_up:
+            warm_up.write(chunk)
+            upload = UploadFile(file=warm_up, filename="streaming_upload.bin", size=len(chunk))
+            client.portal.call(MediaRepository().stream_file, upload, file_path, UPLOAD_LARGE_FILE_SIZE)
+        upload = UploadFile(file=source, filename="streaming_upload.bin", size=UPLOAD_LARGE_FILE_SIZE)
+        tracemalloc.start()
+        size, sha256 = client.portal.call(MediaRepository().stream_file, upload, file_path, UPLOAD_LARGE_FILE_SIZE)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    logging.info(f"Streamed {size} bytes with peak traced memory of {peak} bytes.")
+    assert size == UPLOAD_LARGE_FILE_SIZE
+    assert sha256 == digest.hexdigest()
+    assert os.path.getsize(file_path) == UPLOAD_LARGE_FILE_SIZE
+    assert peak < UPLOAD_MEMORY_LIMIT
+    os.remove(file_path)
+
+    user_id, headers = seed_user_with_posts(sync_engine, "uploader", 0)
+    client.portal.call(derivatives.drain)
+    media_before = list_media_files()
+    response = client.post(
+                            url="/blog/create_post/",
+                            data={"title": "uploader_too_large", "content": "uploader_content"},
+                            files=[
+                                ("image", open("./test/image_example_1.jpg", "rb")),
+                                ("image", ("too_large.bin", os.urandom(settings.MAX_FILE_SIZE + 1)))],
+                            headers=headers)
+    assert response.status_code == 413
+    assert list_media_files() == media_before
+    response = client.get(url="/blog/show_my_posts/", headers=headers)
+    assert response.status_code == 404
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - streaming upload keeps memory flat and cleans up")
+
+
+async def scenario_deduplication(app, payloads: list) -> tuple[list, dict]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        _, headers = await register_and_login(cli, "dedup")
+        posts = []
+        for index in range(DEDUP_UPLOADS):
+            response = await cli.post(
+                                        url="/blog/create_post/",
+                                        data={"title": f"dedup_title_{index}", "content": "dedup_content"},
+                                        files=[("image", (f"dedup_{index}.jpg", payloads[index % len(payloads)], "image/jpeg"))],
+                                        headers=headers)
+            assert response.status_code == 201
+            posts.append(response.json())
+        return posts, headers
+
+
+async def scenario_delete_posts(app, post_ids: list, headers: dict) -> None:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        for post_id in post_ids:
+            response = await cli.delete(url=f"/blog/delete_post/{post_id}/", headers=headers)
+            assert response.status_code == 200
+
+
+@pytest.mark.benchmark
+def test_benchmark_deduplication(client, sync_engine):
+
+    logging.info("START - benchmark content-addressed media store")
+    payloads = [os.urandom(DEDUP_FILE_SIZE) for _ in range(DEDUP_DISTINCT_FILES)]
+    media_before = list_media_files()
+    posts, headers = client.portal.call(scenario_deduplication, client.app, payloads)
+    file_names = {post["images"][0]["filename"] for post in posts}
+    blobs = list_media_files() - media_before
+    with sync_engine.connect() as connection:
+        image_rows = connection.execute(
+                                        select(ImageModel.filename, ImageModel.refcount)
+                                        .where(ImageModel.filename.in_(file_names))).all()
+        references = connection.scalar(
+                                        select(func.count())
+                                        .select_from(post_image)
+                                        .join(ImageModel)
+                                        .where(ImageModel.filename.in_(file_names)))
+    logical_bytes = DEDUP_UPLOADS * DEDUP_FILE_SIZE
+    stored_bytes = sum(os.path.getsize(blob) for blob in blobs)
+    logging.info(
+                    f"{DEDUP_UPLOADS} uploads of {DEDUP_DISTINCT_FILES} distinct files: "
+                    f"{stored_bytes} bytes on disk instead of {logical_bytes} "
+                    f"({1 - stored_bytes / logical_bytes:.1%} saved), "
+                    f"{len(image_rows)} image rows instead of {DEDUP_UPLOADS}.")
+    assert len(file_names) == DEDUP_DISTINCT_FILES
+    assert len(blobs) == DEDUP_DISTINCT_FILES
+    assert stored_bytes == DEDUP_DISTINCT_FILES * DEDUP_FILE_SIZE
+    assert len(image_rows) == DEDUP_DISTINCT_FILES
+    assert sum(refcount for _, refcount in image_rows) == references == DEDUP_UPLOADS
+    assert all(os.path.exists(get_media_path(file_name)) for file_name in file_names)
+
+    client.portal.call(scenario_delete_posts, client.app, [post["id"] for post in posts[:-1]], headers)
+    assert list_media_files() - media_before == {get_media_path(posts[-1]["images"][0]["filename"])}
+    client.portal.call(scenario_delete_posts, client.app, [posts[-1]["id"]], headers)
+    assert list_media_files() - media_before == set()
+    with sync_engine.connect() as connection:
+        assert connection.scalar(select(func.count()).where(ImageModel.filename.in_(file_names))) == 0
+    logging.info("STOP - benchmark content-addressed media store")
+
+
+def test_conditional_and_range_download(client, sync_engine):
+
+    logging.info("START - conditional and range downloads")
+    user_id, headers = seed_user_with_posts(sync_engine, "downloader", 0)
+    payload = os.urandom(DOWNLOAD_FILE_SIZE)
+    response = client.post(
+                            url="/blog/create_post/",
+                            data={"title": "downloader_title", "content": "downloader_content"},
+                            files=[("image", ("download.jpg", payload, "image/jpeg"))],
+                            headers=headers)
+    assert response.status_code == 201
+    post_id = response.json()["id"]
+    url = f"/blog/download_file/{response.json()["images"][0]["filename"]}/"
+
+    response = client.get(url=url, headers=headers)
+    assert response.status_code == 200
+    assert response.content == payload
+    assert response.headers["etag"] == f"\"{hashlib.sha256(payload).hexdigest()}\""
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["accept-ranges"] == "bytes"
+    etag, last_modified = response.headers["etag"], response.headers["last-modified"]
+
+    transferred = 0
+    for _ in range(DOWNLOAD_REPEAT):
+        response = client.get(url=url, headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        transferred += len(response.content)
+    response = client.get(url=url, headers={**headers, "If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    logging.info(f"Repeated downloads: {transferred} bytes instead of {DOWNLOAD_REPEAT * DOWNLOAD_FILE_SIZE}.")
+    assert transferred == 0
+
+    resume_from = DOWNLOAD_FILE_SIZE // 3
+    response = client.get(url=url, headers={**headers, "Range": f"bytes={resume_from}-", "If-Range": etag})
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes {resume_from}-{DOWNLOAD_FILE_SIZE - 1}/{DOWNLOAD_FILE_SIZE}"
+    assert payload[:resume_from] + response.content == payload
+    logging.info(f"Resumed download: {len(response.content)} bytes instead of {DOWNLOAD_FILE_SIZE}.")
+
+    response = client.get(url=url, headers={**headers, "Range": "bytes=0-99, 1000-1099, -100"})
+    assert response.status_code == 206
+    assert response.headers["content-type"].startswith("multipart/byteranges")
+    assert int(response.headers["content-length"]) == len(response.content)
+    boundary = response.headers["content-type"].split("boundary=")[1]
+    parts = [part for part in response.content.split(f"--{boundary}".encode()) if part.strip(b"-\r\n")]
+    bodies = [part.split(b"\r\n\r\n", 1)[1][:-2] for part in parts]
+    assert bodies == [payload[:100], payload[1000:1100], payload[-100:]]
+
+    response = client.get(url=url, headers={**headers, "Range": "bytes=0-99", "If-Range": "\"stale\""})
+    assert response.status_code == 200
+    assert response.content == payload
+    response = client.get(url=url, headers={**headers, "Range": f"bytes={DOWNLOAD_FILE_SIZE}-"})
+    assert response.status_code == 416
+    assert response.headers["content-range"] == f"bytes */{DOWNLOAD_FILE_SIZE}"
+
+    response = client.delete(url=f"/blog/delete_post/{post_id}/", headers=headers)
+    assert response.status_code == 200
+    response = client.get(url=url, headers=headers)
+    assert response.status_code == 404
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - conditional and range downloads")
+
+
+async def scenario_download_benchmark(app, url: str, headers: dict) -> tuple[float, float, int]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        transferred = 0
+        start, cpu_start = time.perf_counter(), time.process_time()
+        for _ in range(ACCEL_DOWNLOADS):
+            response = await cli.get(url=url, headers=headers)
+            assert response.status_code == 200
+            transferred += len(response.content)
+        return time.perf_counter() - start, time.process_time() - cpu_start, transferred
+
+
+@pytest.mark.benchmark
+def test_benchmark_accel_redirect(client, sync_engine):
+
+    logging.info("START - benchmark X-Accel-Redirect offload")
+    user_id, headers = seed_user_with_posts(sync_engine, "accel", 0)
+    response = client.post(
+                            url="/blog/create_post/",
+                            data={"title": "accel_title", "content": "accel_content"},
+                            files=[("image", ("accel.jpg", os.urandom(settings.MAX_FILE_SIZE), "image/jpeg"))],
+                            headers=headers)
+    assert response.status_code == 201
+    post_id = response.json()["id"]
+    file_name = response.json()["images"][0]["filename"]
+    url = f"/blog/download_file/{file_name}/"
+    results = {}
+    try:
+        for mode in (False, True):
+            settings.MEDIA_ACCEL_REDIRECT = mode
+            elapsed, cpu, transferred = client.portal.call(scenario_download_benchmark, client.app, url, headers)
+            results[mode] = (elapsed, cpu, transferred)
+            logging.info(
+                            f"X-Accel-Redirect {"on" if mode else "off"}: "
+                            f"{ACCEL_DOWNLOADS / elapsed:.0f} downloads/s, "
+                            f"{transferred / elapsed / 1024 / 1024:.1f} MB/s streamed by the API, "
+                            f"{cpu / ACCEL_DOWNLOADS * 1000:.3f} ms API CPU per download.")
+        response = client.get(url=url, headers=headers)
+        assert response.headers["x-accel-redirect"] == (
+                                                        f"{settings.MEDIA_ACCEL_LOCATION}/"
+                                                        f"{os.path.relpath(get_media_path(file_name), settings.MEDIA_ROOT)}")
+        assert response.content == b""
+    finally:
+        settings.MEDIA_ACCEL_REDIRECT = False
+    assert results[False][2] == ACCEL_DOWNLOADS * settings.MAX_FILE_SIZE
+    assert results[True][2] == 0
+    assert results[True][1] < results[False][1]
+    response = client.delete(url=f"/blog/delete_post/{post_id}/", headers=headers)
+    assert response.status_code == 200
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - benchmark X-Accel-Redirect offload")
+
+
+def make_image(size: tuple[int, int]) -> bytes:
+    buffer = BytesIO()
+    Image.frombytes("RGB", size, os.urandom(size[0] * size[1] * 3)).save(buffer, format="JPEG", quality=50)
+    return buffer.getvalue()
+
+
+def test_derivative_pipeline(client, sync_engine):
+
+    logging.info("START - testing image derivative pipeline")
+    user_id, headers = seed_user_with_posts(sync_engine, "derivative", 0)
+    start = time.perf_counter()
+    response = client.post(
+                            url="/blog/create_post/",
+                            data={"title": "derivative_title", "content": "derivative_content"},
+                            files=[("image", ("derivative.jpg", make_image(DERIVATIVE_IMAGE_SIZE), "image/jpeg"))],
+                            headers=headers)
+    create_latency = time.perf_counter() - start
+    assert response.status_code == 201
+    post_id = response.json()["id"]
+    image = response.json()["images"][0]
+    assert image["derivatives"] == {}
+    client.portal.call(derivatives.drain)
+
+    response = client.get(url="/blog/show_my_posts/", headers=headers)
+    image = response.json()["items"][0]["images"][0]
+    assert set(image["derivatives"]) == {
+                                            name
+                                            for size in settings.DERIVATIVE_SIZES
+                                            for name in (size, f"{size}_webp")}
+    for name, url in image["derivatives"].items():
+        response = client.get(url=url.removeprefix("http://testserver"))
+        assert response.status_code == 200
+        with Image.open(BytesIO(response.content)) as derivative:
+            assert max(derivative.size) == settings.DERIVATIVE_SIZES[name.removesuffix("_webp")]
+            assert derivative.format == ("WEBP" if name.endswith("_webp") else "JPEG")
+
+    derivative_paths = [get_media_path(name) for name in ImageModel.get_derivative_names(image["filename"]).values()]
+    for path in derivative_paths:
+        os.remove(path)
+    start = time.perf_counter()
+    assert generate_derivatives_blocking(image["filename"])
+    generation_time = time.perf_counter() - start
+    logging.info(
+                    f"create_post answered in {create_latency * 1000:.1f} ms, "
+                    f"derivatives took {generation_time * 1000:.1f} ms off the request path.")
+
+    response = client.delete(url=f"/blog/delete_post/{post_id}/", headers=headers)
+    assert response.status_code == 200
+    assert not any(os.path.exists(path) for path in [get_media_path(image["filename"]), *derivative_paths])
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - testing image derivative pipeline")
+
+
+async def scenario_read_heavy_mix(app, headers: dict, post_ids: list, statement_counter) -> tuple[float, int]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        start = time.perf_counter()
+        with statement_counter() as counter:
+            for index in range(POST_CACHE_REQUESTS):
+                if index % POST_CACHE_WRITE_EVERY == POST_CACHE_WRITE_EVERY - 1:
+                    response = await cli.put(
+                                                url=f"/blog/update_post/{post_ids[index % len(post_ids)]}/",
+                                                json={"published": bool(index % 2)},
+                                                headers=headers)
+                    assert response.status_code == 200
+                    continue
+                url = f"/blog/find_post/{POST_CACHE_FILTERS[index % len(POST_CACHE_FILTERS)]}"
+                response = await cli.get(url=url, headers=headers)
+                assert response.status_code == 200, (url, response.text)
+        return time.perf_counter() - start, len(counter.statements)
+
+
+@pytest.mark.benchmark
+def test_benchmark_post_cache(client, sync_engine, statement_counter):
+
+    logging.info("START - benchmark find_post response cache")
+    user_id, headers = seed_user_with_posts(sync_engine, "cached", POST_CACHE_POSTS)
+    with sync_engine.connect() as connection:
+        post_ids = connection.scalars(select(PostModel.id).where(PostModel.created_by == user_id).limit(20)).all()
+    backend = post_cache.cache
+    results = {}
+    try:
+        for mode in ("none", "memory"):
+            settings.POST_CACHE_BACKEND = mode
+            post_cache.cache = MemoryCache(settings.POST_CACHE_SIZE) if mode == "memory" else None
+            results[mode] = client.portal.call(scenario_read_heavy_mix, client.app, headers, post_ids, statement_counter)
+            logging.info(
+                            f"find_post cache {mode}: {POST_CACHE_REQUESTS / results[mode][0]:.0f} requests/s, "
+                            f"{results[mode][1]} statements.")
+
+        response = client.get(url="/admin/cache_status/", headers=headers)
+        assert response.status_code == 200
+        status = response.json()
+        logging.info(f"Cache counters: {status}")
+        assert status["hits"] > status["misses"] > 0
+        assert status["invalidations"] >= POST_CACHE_REQUESTS // POST_CACHE_WRITE_EVERY
+
+        url = f"/blog/find_post/?username=cached&title__like=title_{0:07d}"
+        assert client.get(url=url, headers=headers).json()["items"][0]["content"] == "cached_content_0"
+        post_id = client.get(url=url, headers=headers).json()["items"][0]["id"]
+        response = client.put(url=f"/blog/update_post/{post_id}/", json={"content": "cached_content_updated"}, headers=headers)
+        assert response.status_code == 200
+        assert client.get(url=url, headers=headers).json()["items"][0]["content"] == "cached_content_updated"
+    finally:
+        settings.POST_CACHE_BACKEND = "redis"
+        post_cache.cache = backend
+    assert results["memory"][1] < results["none"][1]
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - benchmark find_post response cache")
+
+
+@pytest.mark.benchmark
+def test_delete_user_with_many_posts(client, sync_engine, query_budget):
+
+    logging.info("START - testing delete of a user owning many posts")
+    user_id, headers = seed_user_with_posts(sync_engine, "prolific", DELETE_USER_POSTS)
+    client.get(url="/admin/me/stats/", headers=headers)
+    with query_budget(3) as counter:
+        start = time.perf_counter()
+        response = client.delete(url="/admin/delete/", headers=headers)
+        elapsed = time.perf_counter() - start
+    logging.info(f"Rejected delete of a user with {DELETE_USER_POSTS} posts in {elapsed * 1000:.1f} ms: {counter.statements}")
+    assert response.status_code == 400
+    assert elapsed < DELETE_USER_TIME_LIMIT
+    assert any("EXISTS" in statement for statement in counter.statements)
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - testing delete of a user owning many posts")
+
+
+async def scenario_write_statements(app, statement_counter) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        _, headers = await register_and_login(cli, "writer")
+        await cli.get(url="/admin/me/stats/", headers=headers)
+        requests = {
+                    "register": lambda: cli.post(
+                                                url="/admin/register/",
+                                                json={
+                                                        "username": "writer_registered",
+                                                        "full_name": "Writer",
+                                                        "email": "writer_registered@example.com",
+                                                        "password": "!ws@writer",
+                                                        "password_confirm": "!ws@writer"}),
+                    "update_user": lambda: cli.put(url="/admin/update/", json={"full_name": "Writer"}, headers=headers),
+                    "create_post": lambda: cli.post(
+                                                    url="/blog/create_post/",
+                                                    data={"title": "writer_title", "content": "writer_content"},
+                                                    headers=headers),
+                    "create_post_with_image": lambda: cli.post(
+                                                                url="/blog/create_post/",
+                                                                data={"title": "writer_title_image", "content": "writer_content"},
+                                                                files=[("image", ("writer.jpg", os.urandom(1024), "image/jpeg"))],
+                                                                headers=headers),
+                    "update_post": lambda: cli.put(url=f"/blog/update_post/{post_id}/", json={"published": True}, headers=headers),
+                    "delete_post": lambda: cli.delete(url=f"/blog/delete_post/{post_id}/", headers=headers)}
+        counts = {}
+        post_id = None
+        for name, request in requests.items():
+            with statement_counter() as counter:
+                response = await request()
+                assert response.status_code in (200, 201), response.text
+            counts[name] = len(counter.statements)
+            if name == "create_post_with_image":
+                post_id = response.json()["id"]
+        await derivatives.drain()
+        return counts
+
+
+def test_write_statement_budget(client, statement_counter):
+
+    logging.info("START - testing statements per write endpoint")
+    counts = client.portal.call(scenario_write_statements, client.app, statement_counter)
+    for name, count in counts.items():
+        logging.info(f"{name}: {WRITE_STATEMENTS_BEFORE[name]} statements before, {count} now.")
+    assert all(counts[name] <= WRITE_STATEMENTS_BUDGET[name] for name in counts)
+    logging.info("STOP - testing statements per write endpoint")
+
+
+@pytest.mark.benchmark
+def test_benchmark_import(client, sync_engine):
+
+    logging.info("START - benchmark bulk import of posts")
+    user_id, headers = seed_user_with_posts(sync_engine, "importer", 1)
+    lines = [
+                json.dumps({"title": f"importer_bulk_{index:07d}", "content": f"importer_content_{index}", "published": index % 2 == 0})
+                for index in range(IMPORT_POSTS)]
+    lines[10] = json.dumps({"title": "importer_title_0000000", "content": "conflicts with an existing post"})
+    lines[20] = "{not json"
+    lines[30] = json.dumps({"title": "importer_missing_content"})
+    lines[40] = json.dumps({"title": "importer_bulk_0000000", "content": "duplicated in the import"})
+    payload = "\n".join(lines).encode("utf-8")
+    start = time.perf_counter()
+    response = client.post(
+                            url="/blog/import/",
+                            files={"file": ("posts.ndjson", payload, "application/x-ndjson")},
+                            headers=headers)
+    elapsed = time.perf_counter() - start
+    logging.info(f"Imported {IMPORT_POSTS} posts in {elapsed:.2f} s ({IMPORT_POSTS / elapsed:.0f} posts/s).")
+    assert response.status_code == 200
+    result = response.json()
+    assert result["received"] == IMPORT_POSTS
+    assert result["created"] == IMPORT_POSTS - 4
+    assert result["failed"] == 4
+    errors = {error["line"]: error["error"] for error in result["errors"]}
+    assert set(errors) == {11, 21, 31, 41}
+    assert errors[11] == "Post of this title already exists."
+    assert errors[21].startswith("Invalid JSON")
+    assert errors[31].startswith("content:")
+    assert errors[41] == "Title is duplicated in the import."
+    assert IMPORT_POSTS / elapsed > IMPORT_MIN_RATE
+    stats = client.get(url="/admin/me/stats/", headers=headers).json()
+    assert stats["post_count"] == IMPORT_POSTS - 4
+    assert stats["published_post_count"] == len(range(0, IMPORT_POSTS, 2)) - 4
+
+    rows = BytesIO()
+    with TextIOWrapper(rows, encoding="utf-8", newline="") as stream:
+        writer = csv.writer(stream)
+        writer.writerow(["title", "content", "published", "created_at"])
+        writer.writerow(["importer_csv_1", "first line\nsecond, \"quoted\" line", "true", "2020-01-01T00:00:00+00:00"])
+        writer.writerow(["importer_csv_2", "no date", "", ""])
+        writer.writerow(["importer_csv_3", "bad flag", "maybe", ""])
+        stream.flush()
+        payload = rows.getvalue()
+    response = client.post(url="/blog/import/", files={"file": ("posts.csv", payload, "text/csv")}, headers=headers)
+    assert response.status_code == 200
+    assert response.json() == {
+                                "received": 3,
+                                "created": 2,
+                                "failed": 1,
+                                "errors": [{"line": 5, "error": "published: Input should be a valid boolean, unable to interpret input"}]}
+    response = client.get(url="/blog/show_my_posts/?title__like=importer_csv_1", headers=headers)
+    post = response.json()["items"][0]
+    assert post["content"] == "first line\nsecond, \"quoted\" line"
+    assert post["published"] is True
+    assert post["created_at"].startswith("2020-01-01")
+    response = client.post(url="/blog/import/", files={"file": ("posts.txt", b"")}, headers=headers)
+    assert response.status_code == 400
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - benchmark bulk import of posts")
+
+
+def get_rss() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+async def scenario_stream_export(app, url: str, headers: dict) -> tuple[int, int, int]:
+    path, _, query = url.partition("?")
+    scope = {
+                "type": "http",
+                "asgi": {"version": "3.0"},
+                "http_version": "1.1",
+                "method": "GET",
+                "scheme": "http",
+                "path": path,
+                "raw_path": path.encode(),
+                "root_path": "",
+                "query_string": query.encode(),
+                "headers": [(name.lower().encode(), value.encode()) for name, value in headers.items()],
+                "client": ("test", 0),
+                "server": ("test", 80)}
+    requested, finished = False, asyncio.Event()
+    status_code, lines, rss_before = None, 0, get_rss()
+    rss_peak = rss_before
+
+    async def receive() -> dict:
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: dict) -> None:
+        nonlocal status_code, lines, rss_peak
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+        elif message["type"] == "http.response.body":
+            lines += message.get("body", b"").count(b"\n")
+            rss_peak = max(rss_peak, get_rss())
+
+    await app(scope, receive, send)
+    finished.set()
+    return status_code, lines, rss_peak - rss_before
+
+
+@pytest.mark.benchmark
+def test_export_streaming(client, sync_engine):
+
+    logging.info("START - streaming export of posts keeps memory bounded")
+    user_id, headers = seed_user_with_posts(sync_engine, "exporter", 0)
+    with sync_engine.begin() as connection:
+        series = select(func.generate_series(1, EXPORT_POSTS).column_valued("index")).subquery()
+        connection.execute(
+                            insert(PostModel).from_select(
+                                ["title", "content", "published", "created_by"],
+                                select(
+                                        func.concat("exporter_title_", series.c.index),
+                                        func.concat("exporter_content_", series.c.index),
+                                        series.c.index % 2 == 0,
+                                        literal(user_id))))
+        connection.exec_driver_sql("ANALYZE post")
+
+    response = client.get(url="/blog/export/?title__like=exporter_title_1000%25&order_by=title", headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    expected = [index for index in range(1, EXPORT_POSTS + 1) if str(index).startswith("1000")]
+    posts = [json.loads(line) for line in response.text.splitlines()]
+    assert [post["title"] for post in posts] == sorted(f"exporter_title_{index}" for index in expected)
+    assert posts[0]["users"] == {"username": "exporter", "email": "exporter@example.com"}
+    assert posts[0]["images"] == []
+    response = client.get(url="/blog/export/?title__like=exporter_title_1000%25&published=true&format=csv", headers=headers)
+    assert response.status_code == 200
+    rows = list(csv.DictReader(response.text.splitlines()))
+    assert len(rows) == len([index for index in expected if index % 2 == 0])
+    assert all(row["published"] == "True" and row["username"] == "exporter" and row["images"] == "[]" for row in rows)
+
+    start = time.perf_counter()
+    status_code, lines, rss_growth = client.portal.call(scenario_stream_export, client.app, "/blog/export/", headers)
+    elapsed = time.perf_counter() - start
+    logging.info(f"Exported {lines} posts in {elapsed:.1f} s ({lines / elapsed:.0f} posts/s), RSS grew by {rss_growth // 1024} KiB.")
+    assert status_code == 200
+    assert lines >= EXPORT_POSTS
+    assert rss_growth < EXPORT_RSS_CEILING
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - streaming export of posts keeps memory bounded")
+
+
+async def scenario_create_post_race(app) -> tuple[list, dict]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        _, headers = await register_and_login(cli, "race")
+        factories = [
+                        lambda: cli.post(
+                                            url="/blog/create_post/",
+                                            data={"title": "race_title", "content": "race_content"},
+                                            headers=headers)
+                        for _ in range(CREATE_RACE_REQUESTS)]
+        responses, _ = await fire_requests(factories, CREATE_RACE_REQUESTS)
+        return responses, headers
+
+
+def test_create_post_title_race(client):
+
+    logging.info("START - concurrent creates of the same title")
+    responses, headers = client.portal.call(scenario_create_post_race, client.app)
+    statuses = [response.status_code for response in responses]
+    logging.info(f"Statuses of {CREATE_RACE_REQUESTS} racing creates: {sorted(set(statuses))}")
+    assert statuses.count(201) == 1
+    assert statuses.count(400) == CREATE_RACE_REQUESTS - 1
+    assert all(
+                response.json() == {"detail": "Post of this title already exists."}
+                for response in responses if response.status_code == 400)
+    response = client.get(url="/admin/me/stats/", headers=headers)
+    assert response.json()["post_count"] == 1
+    response = client.get(url="/blog/show_my_posts/", headers=headers)
+    assert [post["title"] for post in response.json()["items"]] == ["race_title"]
+    logging.info("STOP - concurrent creates of the same title")
+
+
+async def scenario_password_change_revocation(app) -> dict:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        username, headers = await register_and_login(cli, "revocation")
+        response = await cli.post(
+                                    url="/admin/login/",
+                                    data={"username": username, "password": "!ws@stress_revocation"})
+        other_headers = {"Authorization": f"Bearer {response.json()["access_token"]}"}
+        other_refresh = {"Authorization": f"Bearer {response.json()["refresh_token"]}"}
+        response = await cli.put(
+                                    url="/admin/change_password/",
+                                    json={
+                                            "old_password": "!ws@stress_revocation",
+                                            "new_password": "!ws@stress_revoked",
+                                            "new_password_confirm": "!ws@stress_revoked"},
+                                    headers=headers)
+        assert response.status_code == 200
+        statuses = {
+                    "current": (await cli.get(url="/admin/pool_status/", headers=headers)).status_code,
+                    "other": (await cli.get(url="/admin/pool_status/", headers=other_headers)).status_code,
+                    "other_refresh": (await cli.post(url="/admin/refresh/", headers=other_refresh)).status_code}
+        response = await cli.post(
+                                    url="/admin/login/",
+                                    data={"username": username, "password": "!ws@stress_revoked"})
+        statuses["login"] = response.status_code
+        response = await cli.delete(url="/admin/delete/", headers=headers)
+        assert response.status_code == 200
+        return statuses
+
+
+def test_password_change_revokes_other_sessions(client):
+
+    logging.info("START - password change revokes other sessions")
+    statuses = client.portal.call(scenario_password_change_revocation, client.app)
+    assert statuses == {"current": 200, "other": 401, "other_refresh": 401, "login": 200}
+    logging.info("STOP - password change revokes other sessions")
+
+
+async def scenario_log_dependency(token: str) -> float:
+    dependency = Dependency()
+    async with DatabaseSessionClass() as db:
+        start = time.perf_counter()
+        for _ in range(TOKEN_BENCHMARK_CALLS):
+            await dependency.log_dependency(token=token, db=db)
+        return (time.perf_counter() - start) / TOKEN_BENCHMARK_CALLS
+
+
+@pytest.mark.benchmark
+def test_benchmark_log_dependency(client, sync_engine):
+
+    logging.info("START - benchmark token verification")
+    user_id, headers = seed_user_with_posts(sync_engine, "token_benchmark", 0)
+    token = headers["Authorization"].removeprefix("Bearer ")
+    cache = token_cache.cache
+    try:
+        token_cache.cache = None
+        uncached = client.portal.call(scenario_log_dependency, token)
+        token_cache.cache = cache
+        cached = client.portal.call(scenario_log_dependency, token)
+    finally:
+        token_cache.cache = cache
+    logging.info(f"log_dependency: {uncached * 1e6:.1f} us per call without token cache, {cached * 1e6:.1f} us with it.")
+    assert cached < uncached
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - benchmark token verification")
+
+
+async def scenario_credential_stuffing(app, usernames: list) -> tuple[list, float]:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        factories = [
+                        lambda index=index: cli.post(
+                                                        url="/admin/login/",
+                                                        data={
+                                                                "username": usernames[index % len(usernames)],
+                                                                "password": f"!ws@guess_{index}"})
+                        for index in range(STUFFING_REQUESTS)]
+        start = time.process_time()
+        responses, _ = await fire_requests(factories, settings.WORKER_POOL_SIZE)
+        return responses, time.process_time() - start
+
+
+async def scenario_register_users(app, prefix: str, count: int) -> list:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        return [await register_and_login(cli, f"{prefix}_{index}") for index in range(count)]
+
+
+@pytest.mark.benchmark
+def test_benchmark_credential_stuffing(client):
+
+    logging.info("START - benchmark rate limiter under credential stuffing")
+    users = client.portal.call(scenario_register_users, client.app, "stuffing", STUFFING_USERS)
+    usernames = [username for username, _ in users]
+    unlimited, unlimited_cpu = client.portal.call(scenario_credential_stuffing, client.app, usernames)
+    assert {response.status_code for response in unlimited} <= {401, 429}
+    settings.RATE_LIMIT_BACKEND = "redis"
+    try:
+        limited, limited_cpu = client.portal.call(scenario_credential_stuffing, client.app, usernames)
+        script, retry_at = rate_limiter.script, rate_limiter.retry_at
+        rate_limiter.script, rate_limiter.retry_at = None, math.inf
+        try:
+            fail_open, _ = client.portal.call(scenario_credential_stuffing, client.app, usernames[:1])
+        finally:
+            rate_limiter.script, rate_limiter.retry_at = script, retry_at
+    finally:
+        settings.RATE_LIMIT_BACKEND = None
+    rejected = [response for response in limited if response.status_code == 429]
+    attempted = len(limited) - len(rejected)
+    logging.info(
+                    f"Credential stuffing ({STUFFING_REQUESTS} logins): {unlimited_cpu:.2f} s CPU without limiter, "
+                    f"{limited_cpu:.2f} s CPU with limiter, {attempted} reached bcrypt.")
+    ip_limit, _ = settings.RATE_LIMITS["login"]["ip"]
+    username_limit, window = settings.RATE_LIMITS["login"]["username"]
+    assert attempted <= min(ip_limit, username_limit * STUFFING_USERS)
+    assert all(0 < int(response.headers["Retry-After"]) <= window for response in rejected)
+    assert limited_cpu < unlimited_cpu / 2
+    assert all(response.status_code == 401 for response in fail_open)
+    for _, headers in users:
+        response = client.delete(url="/admin/delete/", headers=headers)
+        assert response.status_code == 200
+    logging.info("STOP - benchmark rate limiter under credential stuffing")
+
+
+async def scenario_profiled_requests(app, url: str, headers: dict, profiled_headers: dict, count: int) -> list:
+    transport = httpx.ASGITransport(app=ProfilingMiddleware(app))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as cli:
+        return [await cli.get(url=url, headers={**headers, **profiled_headers}) for _ in range(count)]
+
+
+def test_request_profiling(client, sync_engine):
+
+    logging.info("START - on-demand request profiling")
+    assert not any(middleware.cls is ProfilingMiddleware for middleware in client.app.user_middleware)
+    user_id, headers = seed_user_with_posts(sync_engine, "profiled", PROFILING_POSTS)
+    url = "/blog/find_post/?username=profiled&title__like=title_00001"
+    backend = (settings.PROFILING_TOKEN, settings.PROFILING_SAMPLE_RATE, settings.PROFILING_DIRECTORY, settings.PROFILING_RETENTION)
+    with tempfile.TemporaryDirectory() as directory:
+        settings.PROFILING_TOKEN, settings.PROFILING_DIRECTORY, settings.PROFILING_RETENTION = "profile-secret", directory, PROFILING_RETENTION
+        try:
+            responses = client.portal.call(scenario_profiled_requests, client.app, url, headers, {"X-Profile": "wrong"}, 2)
+            assert all(response.status_code == 200 and "x-profile-id" not in response.headers for response in responses)
+            assert os.listdir(directory) == []
+
+            responses = client.portal.call(
+                                            scenario_profiled_requests,
+                                            client.app,
+                                            url.replace("title_00001", "title_00000"),
+                                            headers,
+                                            {"X-Profile": "profile-secret"},
+                                            1)
+            assert responses[0].status_code == 200
+            with open(os.path.join(directory, f"{responses[0].headers["x-profile-id"]}.json")) as file:
+                report = json.load(file)
+            logging.info(f"Profile of find_post: {report["duration"] * 1000:.1f} ms, {report["sql"]["count"]} statements, {report["sql"]["duration"] * 1000:.1f} ms in SQL.")
+            assert report["path"] == "/blog/find_post/"
+            assert report["status"] == 200
+            assert report["sql"]["count"] == sum(statement["count"] for statement in report["sql"]["statements"]) > 0
+            assert any("FROM post" in statement["statement"] for statement in report["sql"]["statements"])
+            assert 0 < report["sql"]["duration"] < report["duration"]
+            assert report["profile"]
+
+            settings.PROFILING_SAMPLE_RATE = 1.0
+            responses = client.portal.call(scenario_profiled_requests, client.app, url, headers, {}, PROFILING_RETENTION + 2)
+            assert all("x-profile-id" in response.headers for response in responses)
+            assert len(os.listdir(directory)) == PROFILING_RETENTION
+            assert f"{responses[-1].headers["x-profile-id"]}.json" in os.listdir(directory)
+        finally:
+            settings.PROFILING_TOKEN, settings.PROFILING_SAMPLE_RATE, settings.PROFILING_DIRECTORY, settings.PROFILING_RETENTION = backend
+    remove_seeded_user(sync_engine, user_id)
+    logging.info("STOP - on-demand request profiling")
+
+
+async def scenario_benchmark_suite(app) -> tuple:
+    dataset = await generate_dataset(prefix="suite", seed=1, **SUITE_SCALE)
+    results = await run_benchmark(app, dataset, list(SCENARIOS), requests=SUITE_REQUESTS, concurrency=4, seed=1, scale=SUITE_SCALE)
+    return dataset, results
+
+
+@pytest.mark.benchmark
+def test_benchmark_suite(client, sync_engine):
+
+    logging.info("START - benchmark suite at small scale")
+    dataset, results = client.portal.call(scenario_benchmark_suite, client.app)
+    logging.info(f"Benchmark suite results: {json.dumps(results["scenarios"])}")
+    with sync_engine.connect() as connection:
+        user = connection.execute(select(UserModel).where(UserModel.username == dataset.usernames[0])).one()
+        published = connection.scalars(select(PostModel.published).where(PostModel.created_by == user.id)).all()
+        assert user.post_count == len(published) >= SUITE_SCALE["posts_per_user"]
+        assert user.published_post_count == sum(published)
+    assert len(dataset.titles) == SUITE_SCALE["users"] * SUITE_SCALE["posts_per_user"]
+    assert all(os.path.exists(get_media_path(file_name)) for file_name in dataset.images)
+    assert results["meta"]["scale"] == SUITE_SCALE
+    assert set(results["scenarios"]) == set(SCENARIOS)
+    for name, result in results["scenarios"].items():
+        assert result["errors"] == 0, (name, result["statuses"])
+        assert result["requests"] == SUITE_REQUESTS
+        assert result["throughput"] > 0
+        assert result["latency_ms"]["p50"] <= result["latency_ms"]["p95"] <= result["latency_ms"]["p99"]
+    assert results["scenarios"]["download_file"]["statements_per_request"] == 0
+    assert results["scenarios"]["create_post"]["statements_per_request"] > 0
+    logging.info("STOP - benchmark suite at small scale")